@@ -3,7 +3,8 @@
 import asyncio
 import logging
 from chatbot import api  # Needed for typehints. pylint: disable=unused-import
-from typing import Iterable, Optional
+from typing import Iterable
+from .EventScheduler import EventScheduler
 
 
 class APIBase:
@@ -42,6 +43,7 @@ class APIBase:
         self._events = {}
         self._api_id = api_id
         self._stub = stub
+        self._scheduler = EventScheduler()
 
     @property
     def api_id(self) -> str:
@@ -52,6 +54,21 @@ class APIBase:
         """
         return self._api_id
 
+    @property
+    def scheduler(self) -> EventScheduler:
+        """Returns the scheduler that runs all event tasks.
+
+        See also set_scheduler().
+        """
+        return self._scheduler
+
+    def set_scheduler(self, scheduler: EventScheduler) -> None:
+        """Replace the event scheduler, e.g. to apply concurrency and queue limits.
+
+        Should be called before the API is started.
+        """
+        self._scheduler = scheduler
+
     @property
     def version(self) -> str:
         """Return API version as string."""
@@ -160,23 +177,44 @@ class APIBase:
         """
         self.register_event_handler(event, None)
 
-    def _trigger(self, event, *args, **kwargs) -> Optional[asyncio.Task]:
+    def _trigger(self, event, *args, **kwargs) -> bool:
         """Triggers the given event with the given arguments.
 
-        Runs the associated callback as a new asyncio task and returns the
-        Task object.
-        The task will not be finished, yet when this function returns.
+        Submits the associated callback to the event scheduler, which runs it
+        as a new asyncio task, either immediately or when a running task
+        finished. The task will not be finished, yet when this function
+        returns.
 
-        Returns None, if no callback registered.
+        Returns True if the event was scheduled, False if no callback is
+        registered or the scheduler discarded the event because its queue is
+        full.
+        This function never waits, hence with `OverflowPolicy.Block` events
+        are discarded when the queue is full. Use _trigger_async() to wait
+        instead, e.g. when receiving messages.
 
         Should be used instead of accessing self._events directly.
         """
         ev = self._events.get(event, None)
         if ev is not None:
-            return asyncio.create_task(ev(*args, **kwargs))
+            return self._scheduler.submit_nowait(ev(*args, **kwargs))
+        if self._stub:
+            logging.debug("Unhandled event: %s", str(event))
+        return False
+
+    async def _trigger_async(self, event, *args, **kwargs) -> bool:
+        """Same as _trigger() but waits for room in the event queue if necessary.
+
+        This applies back-pressure to the caller and should be used by API
+        implementations for incoming events, e.g. received messages.
+        Must not be called from inside an event handler, as it could wait for
+        itself to finish.
+        """
+        ev = self._events.get(event, None)
+        if ev is not None:
+            return await self._scheduler.submit(ev(*args, **kwargs))
         if self._stub:
             logging.debug("Unhandled event: %s", str(event))
-        return None
+        return False
 
     def __str__(self):
         return "API: {}, version {}".format(self.api_name, self.version)
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import contextvars
+import enum
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Coroutine, Deque, List, Optional, Set, Tuple
+
+DROP_LOG_INTERVAL = 10.0  # Seconds
+
+
+class OverflowPolicy(str, enum.Enum):
+    """Determines what happens when an event is submitted to a full queue."""
+
+    """Discard the oldest queued event to make room for the new one."""
+    DropOldest = "drop_oldest"
+
+    """Discard the new event."""
+    DropNewest = "drop_newest"
+
+    """Let the producer wait until there is room in the queue.
+
+    Only `EventScheduler.submit()` can wait. Synchronous submissions using
+    `submit_nowait()` are discarded like with `DropNewest`.
+    """
+    Block = "block"
+
+
+@dataclass
+class SchedulerStats:
+    """A snapshot of the scheduler's counters.
+
+    Times are measured in seconds.
+    `wait` is the time an event spent in the queue, `run` is the time from
+    starting the event task until it finished.
+    """
+    queue_depth: int = 0
+    running: int = 0
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    dropped: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+    run_total: float = 0.0
+    run_max: float = 0.0
+
+    @property
+    def wait_avg(self) -> float:
+        started = self.completed + self.failed + self.running
+        return self.wait_total / started if started else 0.0
+
+    @property
+    def run_avg(self) -> float:
+        finished = self.completed + self.failed
+        return self.run_total / finished if finished else 0.0
+
+
+class EventScheduler:
+    """Owns and runs event tasks with a concurrency limit and a bounded queue.
+
+    Events are run as asyncio tasks. If there are already `max_concurrency`
+    tasks running, new events are queued and started as soon as a running
+    task finishes. The scheduler keeps references to all tasks, so they can't
+    be garbage collected while still running.
+
+    If the queue holds `max_queue_size` events, the `OverflowPolicy`
+    determines what happens to new events.
+
+    A value <= 0 for `max_concurrency` or `max_queue_size` means unlimited.
+
+    Queued events run in a copy of the context they were submitted from,
+    just like tasks started immediately.
+    """
+
+    def __init__(self, max_concurrency: int = 0, max_queue_size: int = 0,
+                 overflow_policy: OverflowPolicy = OverflowPolicy.Block):
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        self._queue: Deque[Tuple[Coroutine, float, contextvars.Context]] = deque()
+        self._running: Set[asyncio.Task] = set()
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._idle_waiters: List[asyncio.Future] = []
+        self._stats = SchedulerStats()
+        self._unlogged_drops = 0
+        self._last_drop_log = float("-inf")
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of events waiting to be started."""
+        return len(self._queue)
+
+    @property
+    def running(self) -> int:
+        """Number of currently running event tasks."""
+        return len(self._running)
+
+    def stats(self) -> SchedulerStats:
+        """Return a copy of the current counters."""
+        self._stats.queue_depth = self.queue_depth
+        self._stats.running = self.running
+        return SchedulerStats(**vars(self._stats))
+
+    def reset_stats(self) -> None:
+        """Reset all counters."""
+        self._stats = SchedulerStats()
+
+    def submit_nowait(self, coro: Coroutine) -> bool:
+        """Schedule a coroutine without waiting.
+
+        Returns True if the coroutine was started or queued, False if it was
+        discarded according to the overflow policy. Discarded coroutines are
+        closed.
+        """
+        self._stats.submitted += 1
+
+        if self._has_free_slot():
+            self._start(coro, time.perf_counter())
+            return True
+
+        if self._queue_full():
+            if self.overflow_policy == OverflowPolicy.DropOldest and self._queue:
+                self._drop(self._queue.popleft()[0])
+            else:
+                self._drop(coro)
+                return False
+
+        self._queue.append((coro, time.perf_counter(), contextvars.copy_context()))
+        return True
+
+    async def submit(self, coro: Coroutine) -> bool:
+        """Schedule a coroutine.
+
+        Same as `submit_nowait()` but with `OverflowPolicy.Block` it waits
+        until there is room in the queue.
+        """
+        if self.overflow_policy == OverflowPolicy.Block:
+            while self._queue_full() and not self._has_free_slot():
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+                try:
+                    await waiter
+                except asyncio.CancelledError:
+                    coro.close()
+                    if not waiter.cancelled():
+                        # Woken up but cancelled before using the room, pass it on
+                        self._wake_waiters()
+                    raise
+        return self.submit_nowait(coro)
+
+    async def join(self) -> None:
+        """Wait until the queue is empty and all event tasks finished."""
+        while self._queue or self._running:
+            waiter = asyncio.get_running_loop().create_future()
+            self._idle_waiters.append(waiter)
+            await waiter
+
+    async def shutdown(self) -> None:
+        """Discard all queued events, cancel running tasks and wait for them to finish."""
+        while self._queue:
+            self._drop(self._queue.popleft()[0])
+
+        tasks = list(self._running)
+        for i in tasks:
+            i.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _has_free_slot(self) -> bool:
+        return self.max_concurrency <= 0 or len(self._running) < self.max_concurrency
+
+    def _queue_full(self) -> bool:
+        return 0 < self.max_queue_size <= len(self._queue)
+
+    def _drop(self, coro: Coroutine) -> None:
+        self._stats.dropped += 1
+        coro.close()
+
+        # Log at most once per interval, overload tends to drop many events
+        self._unlogged_drops += 1
+        now = time.monotonic()
+        if now - self._last_drop_log >= DROP_LOG_INTERVAL:
+            logging.warning("Event queue full (%s events) -> dropped %s event(s)", len(self._queue), self._unlogged_drops)
+            self._unlogged_drops = 0
+            self._last_drop_log = now
+
+    def _start(self, coro: Coroutine, enqueue_time: float, context: Optional[contextvars.Context] = None) -> None:
+        start_time = time.perf_counter()
+        wait = start_time - enqueue_time
+        self._stats.wait_total += wait
+        self._stats.wait_max = max(self._stats.wait_max, wait)
+
+        if context is None:
+            task = asyncio.create_task(coro)
+        else:
+            task = context.run(asyncio.create_task, coro)
+        self._running.add(task)
+        task.add_done_callback(lambda t: self._on_task_done(t, start_time))
+
+    def _on_task_done(self, task: asyncio.Task, start_time: float) -> None:
+        self._running.discard(task)
+
+        runtime = time.perf_counter() - start_time
+        self._stats.run_total += runtime
+        self._stats.run_max = max(self._stats.run_max, runtime)
+
+        if task.cancelled():
+            self._stats.failed += 1
+        elif exc := task.exception():
+            self._stats.failed += 1
+            logging.error("Exception in event task")
+            logging.exception(exc, exc_info=exc)
+        else:
+            self._stats.completed += 1
+
+        while self._queue and self._has_free_slot():
+            self._start(*self._queue.popleft())
+
+        self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        while self._waiters and not self._queue_full():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+        if not self._queue and not self._running:
+            for i in self._idle_waiters:
+                if not i.done():
+                    i.set_result(None)
+            self._idle_waiters.clear()
@@ -2,6 +2,7 @@ import importlib
 import logging
 from typing import Dict, Any
 from .APIBase import APIBase
+from .EventScheduler import EventScheduler, OverflowPolicy, SchedulerStats
 from .APIEvents import APIEvents
 from .ChatMessage import ChatMessage, MessageType
 from .User import User, GenericUser
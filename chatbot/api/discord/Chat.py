@@ -2,6 +2,7 @@
 
 import discord as discordapi
 from chatbot import api
+from chatbot.util import tracing
 from typing import Union, cast
 
 
@@ -37,7 +38,8 @@ class DiscordChat():
         return False
 
     async def send_message(self, text):
-        await self._chat.send(content=text)
+        with tracing.span("send_message"):
+            await self._chat.send(content=text)
 
     async def send_action(self, text):
         await self.send_message("*{} {}*".format(
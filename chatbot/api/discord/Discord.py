@@ -4,6 +4,7 @@ import asyncio
 import logging
 import discord as discordapi
 from chatbot import api
+from chatbot.util import tracing
 from .User import User
 from .ChatMessage import Message
 from .Chat import create_chat
@@ -130,7 +131,8 @@ class DiscordClient(discordapi.Client):
                 self._api._trigger(api.APIEvents.MessageSent, Message(self._api, msg, True))
             else:
                 # msg.ack() is not available for bot accounts and no longer supported by the non-bot API.
-                self._api._trigger(api.APIEvents.Message, Message(self._api, msg, False))
+                with tracing.start_trace(api.APIEvents.Message):
+                    await self._api._trigger_async(api.APIEvents.Message, Message(self._api, msg, False))
 
     async def on_member_join(self, member):
         self._api._trigger(api.APIEvents.GroupMemberJoin, User(self._api, member))
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from chatbot import api
+from chatbot.util import tracing
 from . import Telegram  # Needed for type hints, pylint: disable=unused-import
 
 
@@ -26,7 +27,8 @@ class Chat(api.Chat):
         return False
 
     async def send_message(self, text: str) -> None:
-        await self._api._send_message(self._id, text)
+        with tracing.span("send_message"):
+            await self._api._send_message(self._id, text)
 
     async def send_action(self, text: str) -> None:
         name = (await self._api.get_user()).display_name
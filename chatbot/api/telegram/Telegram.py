@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import time
 import telethon
 from telethon.tl.functions.account import UpdateProfileRequest
 import logging
 from chatbot import api
+from chatbot.util import tracing
 from typing import Iterable
 from .User import User
 from .Chat import Chat
@@ -122,8 +124,10 @@ class TelegramAPI(api.APIBase):
         # logging.info("received %s", msg.stringify())
 
         if not msg.out:
+            received = time.perf_counter()
             apimsg = await ChatMessage.create(self, msg)
-            self._trigger(api.APIEvents.Message, apimsg)
+            with tracing.start_trace(api.APIEvents.Message, received):
+                await self._trigger_async(api.APIEvents.Message, apimsg)
         else:
             await self._on_sent(msg)
 
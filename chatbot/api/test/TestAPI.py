@@ -4,6 +4,7 @@ import time
 import asyncio
 import logging
 from chatbot import api, util
+from chatbot.util import tracing
 
 
 class TestAPI(api.APIBase):  # pylint: disable=too-many-instance-attributes
@@ -45,9 +46,9 @@ class TestAPI(api.APIBase):  # pylint: disable=too-many-instance-attributes
 
                 if text:
                     if text.startswith("/me "):
-                        await self.trigger_receive(text[4:], api.MessageType.Action)
+                        await self.trigger_receive_async(text[4:], api.MessageType.Action)
                     else:
-                        await self.trigger_receive(text)
+                        await self.trigger_receive_async(text)
             else:
                 await asyncio.sleep(1)
 
@@ -92,10 +93,24 @@ class TestAPI(api.APIBase):  # pylint: disable=too-many-instance-attributes
         }
 
     # Testing functions
-    def trigger_receive(self, text, msgtype=api.MessageType.Normal):
-        msg = TestingMessage(self._otheruser, text, self._chat, msgtype)
+    def trigger_receive(self, text, msgtype=api.MessageType.Normal, author: "User" = None, chat: "TestChat" = None):
+        """Simulate receiving a message.
+
+        By default, the message is sent by a predefined user in the default
+        chat. Use `author` and `chat` to simulate other users and chats,
+        see create_user() and create_chat().
+        """
+        msg = TestingMessage(author or self._otheruser, text, chat or self._chat, msgtype)
         logging.info(str(msg))
-        self._trigger(api.APIEvents.Message, msg)
+        with tracing.start_trace(api.APIEvents.Message):
+            self._trigger(api.APIEvents.Message, msg)
+
+    async def trigger_receive_async(self, text, msgtype=api.MessageType.Normal, author: "User" = None, chat: "TestChat" = None):
+        """Same as trigger_receive() but waits if the event queue is full."""
+        msg = TestingMessage(author or self._otheruser, text, chat or self._chat, msgtype)
+        logging.info(str(msg))
+        with tracing.start_trace(api.APIEvents.Message):
+            await self._trigger_async(api.APIEvents.Message, msg)
 
     async def trigger_sent(self, text):
         await self._chat.send_message(text)
@@ -106,10 +121,13 @@ class TestAPI(api.APIBase):  # pylint: disable=too-many-instance-attributes
     def create_chat(self) -> "TestChat":
         return TestChat(self)
 
+    def create_user(self, userid: str, name: str = "", chat: "TestChat" = None) -> "User":
+        return User(userid, name or userid, chat or self._chat)
+
     async def _timer_func(self):
         while True:
             await asyncio.sleep(1)
-            await self.trigger_receive(self._msg)
+            await self.trigger_receive_async(self._msg)
 
 
 class TestingMessage(api.ChatMessage):
@@ -169,9 +187,10 @@ class TestChat(api.Chat):
         return False
 
     async def send_message(self, text, msgtype=api.MessageType.Normal):  # pylint: disable=arguments-differ
-        msg = TestingMessage(await self._api.get_user(), text, self, msgtype)
-        logging.info(str(msg))
-        self._api._trigger(api.APIEvents.MessageSent, msg)
+        with tracing.span("send_message"):
+            msg = TestingMessage(await self._api.get_user(), text, self, msgtype)
+            logging.info(str(msg))
+            self._api._trigger(api.APIEvents.MessageSent, msg)
 
     async def send_action(self, text):
         await self.send_message(text, api.MessageType.Action)
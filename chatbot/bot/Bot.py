@@ -2,10 +2,14 @@
 
 import logging
 import os
-from typing import Iterable, Tuple, cast
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Tuple, cast
 import chatbot
 from chatbot import api
-from chatbot.util import config
+from chatbot.util import config, tracing, http_client, http_cache, worker_pool
+from chatbot.util.file_watcher import FileWatcher
+from chatbot.util import event
+from chatbot.util.event import HandlerStats
 from .subsystem import APIEventDispatcher, command
 from .subsystem.async_plugin import PluginManager
 from . import BotProfile
@@ -28,6 +32,11 @@ class Bot:
         self._dispatcher: APIEventDispatcher = None
         self._cmdhandler: command.CommandHandler = None
         self._pluginmgr: PluginManager = None
+        self._config_watcher: Optional[FileWatcher] = None
+        self._http: http_client.HTTPClient = None
+        self._workers: worker_pool.WorkerPools = None
+        self._deferred_commands: Dict[str, str] = {}  # command -> plugin name
+        self._deferred_handles: Dict[str, List[event.Handle]] = {}  # plugin name -> event placeholders
 
     async def close(self, code=ExitCode.Normal) -> None:
         """Gives the signal to stop with the given exit code."""
@@ -87,18 +96,52 @@ class Bot:
     def profile(self) -> BotProfile:
         return self._profile
 
+    @property
+    def http(self) -> http_client.HTTPClient:
+        """Returns the shared HTTP client, also used by util.async_http_get_*()."""
+        return self._http
+
+    @property
+    def workers(self) -> worker_pool.WorkerPools:
+        """Returns the thread pools used by util.run_in_thread() and util.run_cpu_bound()."""
+        return self._workers
+
     # Wrappers
     # TODO: Consider using some hacks to set the docstrings to the wrapped functions' docstring.
 
-    def register_event_handler(self, event: str, callback, nice=0):
+    def register_event_handler(self, event: str, callback, nice=0, label=""):
         """Register an event handler and return a handle to it.
 
         To unregister call handle.unregister().
+        `label` identifies the handler in event statistics, e.g. a plugin name.
         See bot.subsystem.APIEventDispatcher for further information.
         """
-        return self._dispatcher.register(event, callback, nice)
+        return self._dispatcher.register(event, callback, nice, label)
+
+    def get_event_stats(self) -> Dict[Tuple[str, str], HandlerStats]:
+        """Returns timing statistics of event handlers keyed by (event, handler label).
+
+        See bot.subsystem.APIEventDispatcher.get_stats().
+        """
+        return self._dispatcher.get_stats()
+
+    def reset_event_stats(self) -> None:
+        self._dispatcher.reset_stats()
+
+    def enable_event_stats(self, enable: bool = True) -> None:
+        """Enable or disable recording event handler statistics.
+
+        Disabling discards existing statistics.
+        See bot.subsystem.APIEventDispatcher.enable_stats().
+        """
+        self._dispatcher.enable_stats(enable, slow_threshold=float(self._config["slow_event_handler_threshold"]))
+
+    @property
+    def event_stats_enabled(self) -> bool:
+        return self._dispatcher.stats_enabled
 
     async def mount_plugin(self, name: str) -> None:
+        self._remove_deferred_triggers(name)
         await self._pluginmgr.mount_plugin(name, self)
 
     async def unmount_plugin(self, name: str) -> None:
@@ -107,6 +150,10 @@ class Bot:
     def iter_plugins(self) -> Iterable[Tuple[str, "chatbot.bot.BotPlugin"]]:
         return cast(Iterable[Tuple[str, "chatbot.bot.BotPlugin"]], self._pluginmgr.iter_plugins())
 
+    def iter_deferred_plugins(self) -> Iterable[str]:
+        """Iterate through names of plugins that are loaded on first use."""
+        return ( name for name, _ in self._pluginmgr.iter_deferred() )
+
     def register_command(self, *args, **kwargs) -> None:
         """Register a command.
 
@@ -144,6 +191,78 @@ class Bot:
             self._handle_plugin_exc("", e)
             await msg.reply(f"Error: {e}.")
 
+    async def _on_plugin_config_changed(self, path: str) -> None:
+        name, ext = os.path.splitext(os.path.basename(path))
+        if ext != ".json":
+            return
+
+        plugin = cast("chatbot.bot.BotPlugin", self._pluginmgr.get_plugin(name))
+        # Skip unmounted plugins and the bot's own writes
+        if plugin is None or not plugin.cfg.is_modified_on_disk():
+            return
+
+        logging.info("Config of plugin %s changed, reloading...", name)
+        # The file on disk wins, writing back pending changes would overwrite the edit
+        if plugin.cfg.discard_pending():
+            logging.warning("Discarded unsaved config changes of plugin %s", name)
+        try:
+            await plugin.reload()
+        except Exception as e:
+            self._handle_plugin_exc(name, e)
+
+    async def _load_deferred_command(self, name: str) -> None:
+        if plugin_name := self._deferred_commands.get(name, None):
+            if await self._activate_plugin(plugin_name) is None:
+                raise command.CommandError(f"Failed to load plugin {plugin_name}")
+
+    async def _on_deferred_event(self, plugin_name: str, evname: str, *args, **kwargs) -> int:
+        # Handlers registered during activation miss the current event, hence forward it
+        if plugin := await self._activate_plugin(plugin_name):
+            for handle in plugin.get_event_handles(evname):
+                if await handle(*args, **kwargs) == event.EVENT_HANDLED:
+                    return event.EVENT_HANDLED
+        return event.EVENT_CONTINUE
+
+    async def _activate_plugin(self, name: str) -> Optional["chatbot.bot.BotPlugin"]:
+        """Mounts a deferred plugin. Returns None if it failed."""
+        self._remove_deferred_triggers(name)
+        plugin = None
+        try:
+            plugin = cast(Optional["chatbot.bot.BotPlugin"], await self._pluginmgr.activate(name))
+        except Exception as e:
+            self._handle_plugin_exc(name, e)
+
+        for cmd in [ k for k, v in self._deferred_commands.items() if v == name ]:
+            del self._deferred_commands[cmd]
+            # Otherwise the placeholder was overwritten by the actual command
+            if plugin is None:
+                self._cmdhandler.unregister(cmd)
+        return plugin
+
+    def _register_deferred_triggers(self) -> None:
+        """Registers placeholder commands and event handlers that mount deferred plugins on first use."""
+        for name, manifest in self._pluginmgr.iter_deferred():
+            for cmd in manifest.commands:
+                self._cmdhandler.register(cmd, self._load_deferred_command, argc=0, flags=command.CommandFlag.Deferred)
+                self._deferred_commands[cmd] = name
+            for cmd in manifest.admin_commands:
+                self._cmdhandler.register(cmd, self._load_deferred_command, argc=0,
+                                          flags=command.CommandFlag.Deferred | command.CommandFlag.Admin)
+                self._deferred_commands[cmd] = name
+
+            self._deferred_handles[name] = [
+                self._dispatcher.register(ev, partial(self._on_deferred_event, name, ev), label=name)
+                for ev in manifest.events
+            ]
+
+    def _remove_deferred_triggers(self, name: str) -> None:
+        """Removes placeholder event handlers of a deferred plugin.
+
+        Placeholder commands are overwritten by the plugin when it is mounted.
+        """
+        for handle in self._deferred_handles.pop(name, ()):
+            handle.unregister()
+
     @staticmethod
     async def _autoaccept(request: chatbot.api.FriendRequest) -> None:
         await request.accept()
@@ -171,24 +290,61 @@ class Bot:
 
         self._config = self._profile.get_bot_config()
         self._config.load(self.get_default_config())
+        self._profile.enable_write_behind(float(self._config["write_behind_delay"]))
+        self._profile.set_storage_backend(self._config["storage_backend"], bool(self._config["storage_journal_fsync"]))
+        await self._profile.migrate_storages()
 
         self._cmdhandler = command.CommandHandler(
             prefix=self._config["prefix"],
             admins=self._config["admins"],
-            history_size=int(self._config["cmd_history_size"]))
+            history_size=int(self._config["cmd_history_size"]),
+            history_max_keys=int(self._config["cmd_history_max_keys"]),
+            history_ttl=float(self._config["cmd_history_ttl"]))
 
         self._pluginmgr = PluginManager(
             os.path.dirname(chatbot.bot.plugins.__file__),
             whitelist=self._config["plugin_whitelist"],
-            blacklist=self._config["plugin_blacklist"])
+            blacklist=self._config["plugin_blacklist"],
+            init_timeout=float(self._config["plugin_init_timeout"]) or None,
+            lazy=bool(self._config["plugin_lazy_loading"]))
 
         logging.info("Preparing API...")
         apicfg = self._profile.get_api_config().load()
         self._api = api.create_api_object(self._config["api"], apicfg.data)
-
-        self._dispatcher = APIEventDispatcher(self._api, self._handle_event_exc)
-        self._dispatcher.register(api.APIEvents.Message, self._handle_command)
-        self._dispatcher.register(api.APIEvents.Ready, self._on_ready)
+        self._api.set_scheduler(api.EventScheduler(
+            max_concurrency=int(self._config["event_max_concurrency"]),
+            max_queue_size=int(self._config["event_max_queue_size"]),
+            overflow_policy=api.OverflowPolicy(self._config["event_overflow_policy"])))
+
+        # Lanes are bounded like the scheduler queue, so a busy chat can't queue messages without limit
+        self._dispatcher = APIEventDispatcher(self._api, self._handle_event_exc,
+                                              max_lane_workers=int(self._config["message_lane_workers"]),
+                                              max_lane_queue_size=int(self._config["event_max_queue_size"]),
+                                              lane_overflow_policy=api.OverflowPolicy(self._config["event_overflow_policy"]))
+        if self._config["message_lanes"]:
+            # Handle messages of the same chat in order
+            self._dispatcher.set_lane_key(api.APIEvents.Message, lambda msg: msg.chat.id)
+        self.enable_event_stats(self._config["event_stats"])
+        for i in self._config["concurrent_events"]:
+            self._dispatcher.set_concurrent(i, handler_timeout=float(self._config["concurrent_event_timeout"]) or None)
+        tracing.configure(sample_rate=float(self._config["trace_sample_rate"]), log=True)
+
+        self._http = http_client.HTTPClient(
+            timeout=float(self._config["http_timeout"]),
+            retries=int(self._config["http_retries"]),
+            limit_per_host=int(self._config["http_max_connections_per_host"]))
+        if int(self._config["http_cache_entries"]) > 0:
+            self._http.cache = http_cache.HTTPCache(
+                max_entries=int(self._config["http_cache_entries"]),
+                directory=self._profile.get_cache_dir("http") if self._config["http_cache_disk"] else None)
+        http_client.set_default_client(self._http)
+
+        self._workers = worker_pool.WorkerPools(io_workers=int(self._config["io_workers"]),
+                                                cpu_workers=int(self._config["cpu_workers"]))
+        worker_pool.set_default_pools(self._workers)
+
+        self._dispatcher.register(api.APIEvents.Message, self._handle_command, label="commands")
+        self._dispatcher.register(api.APIEvents.Ready, self._on_ready, label="bot")
 
         if self._config["autoaccept_friend"]:
             self._dispatcher.register(api.APIEvents.FriendRequest, self._autoaccept)
@@ -199,20 +355,45 @@ class Bot:
 
         logging.info("Mounting plugins...")
         await self._pluginmgr.mount_all(self._handle_plugin_exc, self)
+        self._register_deferred_triggers()
+
+        if self._config["watch_plugin_configs"]:
+            self._config_watcher = FileWatcher(self._profile.get_plugin_config_dir(), self._on_plugin_config_changed,
+                                               debounce=float(self._config["watch_plugin_configs_debounce"]))
+            self._config_watcher.start()
 
         logging.info("Done")
 
     async def _cleanup(self) -> None:
         """Performs actual cleanup after exiting the main loop."""
+        logging.info("Stopping event tasks...")
+        await self._api.scheduler.shutdown()
+
+        if self._config_watcher is not None:
+            await self._config_watcher.stop()
+            self._config_watcher = None
+
         logging.info("Umounting plugins...")
         await self._pluginmgr.unmount_all(self._handle_plugin_exc)
 
+        logging.info("Closing HTTP connections...")
+        await self._http.close()
+        http_client.set_default_client(None)
+
+        logging.info("Writing pending config changes...")
+        await self._profile.shutdown()
+
         logging.info("Unregistering commands...")
         self._cmdhandler.clear()
 
         logging.info("Unregistering event handlers...")
         self._dispatcher.clear()
 
+        # Last, because the steps above may still use worker threads
+        logging.info("Stopping worker threads...")
+        await self._workers.shutdown(timeout=float(self._config["worker_shutdown_timeout"]))
+        worker_pool.set_default_pools(None)
+
     @staticmethod
     def _handle_plugin_exc(name, exc) -> bool:
         logging.error("Exception in plugin: %s", name)
@@ -231,6 +412,8 @@ class Bot:
             "api": "",  # This key is also used in BotProfileManager
             "plugin_whitelist": [],
             "plugin_blacklist": [ "gw2" ],
+            "plugin_init_timeout": 0,  # Max. seconds a plugin may take to initialize, 0 means unlimited
+            "plugin_lazy_loading": False,  # Load plugins providing a manifest only when one of their commands or events is used
             "prefix": [ "!bot", "@bot", "!" ],
             "admins": [],
             "echo": False,
@@ -238,4 +421,29 @@ class Bot:
             "autoaccept_invite": True,
             "autoleave": False,
             "cmd_history_size": 5,
+            "cmd_history_max_keys": 10000,  # Max. amount of (user, chat) pairs with a history
+            "cmd_history_ttl": 24 * 60 * 60,  # Seconds until unused histories are removed
+            "event_max_concurrency": 64,  # <= 0 means unlimited
+            "event_max_queue_size": 1024,  # <= 0 means unlimited
+            "event_overflow_policy": "block",  # "block", "drop_oldest" or "drop_newest"
+            "message_lanes": True,  # Handle messages of the same chat in order
+            "message_lane_workers": 0,  # Max. chats handled at the same time, <= 0 means unlimited
+            "concurrent_events": [],  # Events whose handlers run concurrently, e.g. [ "Ready", "MessageSent" ]
+            "concurrent_event_timeout": 60,  # Max. seconds per handler of concurrent events, 0 means unlimited
+            "event_stats": False,  # Record timing statistics of event handlers, can be toggled with the eventstats admin command
+            "slow_event_handler_threshold": 1.0,  # Log event handlers taking longer (seconds), 0 to disable
+            "storage_backend": "json",  # Plugin storage backend: "json", "journal" (append-only) or "sqlite"
+            "storage_journal_fsync": True,  # Wait until journal records are on disk, disable for faster but less durable writes
+            "write_behind_delay": 2.0,  # Coalesce config and storage writes within this many seconds, 0 writes immediately
+            "http_timeout": 30,  # Seconds until a HTTP request is aborted
+            "http_retries": 2,  # Retry failed idempotent HTTP requests, e.g. GET, this many times
+            "http_max_connections_per_host": 8,
+            "http_cache_entries": 256,  # Max. HTTP responses to cache in memory, 0 disables caching
+            "http_cache_disk": True,  # Also cache HTTP responses in the profile directory
+            "io_workers": 16,  # Threads for blocking I/O, e.g. file access
+            "cpu_workers": 0,  # Threads for CPU-bound work, 0 means one per CPU
+            "worker_shutdown_timeout": 5,  # Max. seconds to wait for running worker threads when exiting
+            "trace_sample_rate": 0.0,  # Fraction of received messages to trace and log at debug level, 0 to disable
+            "watch_plugin_configs": True,  # Reload plugins when their config file is modified on disk
+            "watch_plugin_configs_debounce": 0.5,  # Seconds to wait for further changes before reloading
         }
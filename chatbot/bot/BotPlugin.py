@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from typing import List
+from typing import List, Tuple
 from .subsystem.async_plugin import BasePlugin
 import chatbot  # Used for type hints, pylint: disable=unused-import
 from chatbot.util import event, config, Storage
@@ -16,9 +16,9 @@ class BotPlugin(BasePlugin):
 
         # Keep track of registered commands and event handlers to unregister them automatically
         self.__commands: List[str] = []
-        self.__handles: List[event.Handle] = []
+        self.__handles: List[Tuple[str, event.Handle]] = []  # (event name, handle)
 
-        self.bot.register_event_handler(chatbot.api.APIEvents.Ready, self._on_ready)
+        self.register_event_handler(chatbot.api.APIEvents.Ready, self._on_ready)
 
     async def init(self, _old_instance: BasePlugin) -> bool:
         await self.reload()
@@ -31,9 +31,14 @@ class BotPlugin(BasePlugin):
         """Called when the API becomes ready or, if it already is, after reload() finished."""
 
     async def reload(self):
-        """Reloads the plugin configuration. Called by BotPlugin.init() automatically."""
-        self.cfg.load(self.get_default_config(), create=True)
-        self.storage.load()
+        """Reloads the plugin configuration if it was modified. Called by BotPlugin.init() automatically.
+
+        The config and storage are shared with previous instances of this
+        plugin, hence only files modified on disk are read again.
+        """
+        self.cfg.reload(self.get_default_config(), create=True)
+        if self.storage.is_modified_on_disk():
+            self.storage.load()
 
     def save_config(self):
         self.cfg.write()
@@ -45,11 +50,16 @@ class BotPlugin(BasePlugin):
         # Configs on the other hand are intended to be manipulated by hand. Saving the config here
         # could cause manual changes while the bot is running to get lost.
         self.storage.write()
+        self.abort()
+
+    def abort(self) -> None:
+        self.bot.profile.release_plugin_storage(self.name)
+        self.bot.profile.release_plugin_config(self.name)
 
         self.bot.unregister_command(*self.__commands)
 
-        for i in self.__handles:
-            i.unregister()
+        for _, handle in self.__handles:
+            handle.unregister()
 
     @staticmethod
     def get_default_config():
@@ -68,20 +78,24 @@ class BotPlugin(BasePlugin):
     def storage(self) -> Storage:
         return self.__storage
 
-    def register_command(self, name, callback, argc=1, flags=0, types=()):  # pylint: disable=too-many-positional-arguments
+    def register_command(self, name, callback, argc=1, flags=0, types=(), predicate=None):  # pylint: disable=too-many-positional-arguments
         """Wrapper around Bot.register_command"""
-        self.bot.register_command(name, callback, argc, flags, types)
+        self.bot.register_command(name, callback, argc, flags, types, predicate)
         self.__commands.append(name)
 
-    def register_command_expand(self, name, callback, argc=1, flags=0, types=()):  # pylint: disable=too-many-positional-arguments
+    def register_command_expand(self, name, callback, argc=1, flags=0, types=(), predicate=None):  # pylint: disable=too-many-positional-arguments
         """Wrapper around Bot.register_command with CommandFlag.Expand flag set"""
-        self.register_command(name, callback, argc, flags | command.CommandFlag.Expand, types)
+        self.register_command(name, callback, argc, flags | command.CommandFlag.Expand, types, predicate)
 
-    def register_admin_command(self, name, callback, argc=1, flags=0, types=()):  # pylint: disable=too-many-positional-arguments
+    def register_admin_command(self, name, callback, argc=1, flags=0, types=(), predicate=None):  # pylint: disable=too-many-positional-arguments
         """Same as register_command() but with CMDFLAG_ADMIN flag set."""
-        self.register_command(name, callback, argc, flags | command.CommandFlag.Admin, types)
+        self.register_command(name, callback, argc, flags | command.CommandFlag.Admin, types, predicate)
 
     def register_event_handler(self, evname, callback, nice=event.EVENT_NORMAL):
         """Wrapper around Bot.register_event_handler"""
         self.__handles.append(
-            self.bot.register_event_handler(evname, callback, nice))
+            (evname, self.bot.register_event_handler(evname, callback, nice, self.name)))
+
+    def get_event_handles(self, evname) -> List[event.Handle]:
+        """Returns handles of event handlers registered for the given event."""
+        return [ handle for name, handle in self.__handles if name == evname and handle ]
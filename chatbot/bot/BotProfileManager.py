@@ -2,10 +2,12 @@
 # -*- coding: utf-8 -*-
 
 import os
+import logging
 import appdirs
-from chatbot.util import config, Storage
+from dataclasses import dataclass
+from chatbot.util import config, run_in_thread, Storage, JournalBackend, SQLiteStorage, migrate_json_file
 import chatbot
-from typing import List
+from typing import Any, Dict, List, Tuple
 
 # Profile directory structure
 #
@@ -24,28 +26,213 @@ from typing import List
 CONFIG_DIR = appdirs.user_config_dir("pychatbot")
 PLUGIN_DIR = "plugins"
 STORAGE_DIR = "storage"
+CACHE_DIR = "cache"
 BOT_CONFIG_NAME = "bot.json"
 API_CONFIG_NAME = "api.json"
 LOGFILE_NAME = "chatbot.log"
 LOGFILE_NAME_OLD = "chatbot.old.log"
 
 
-# TODO: Cache Config and Storage objects?
+@dataclass
+class _SharedEntry:
+    obj: Any
+    refs: int = 0
+
+
 class BotProfile:
     """A helper class to access config files in a simple, centralized way.
 
-    It does not manage, load, or create any files or directories automatically.
+    It does not manage, load, or create any files or directories automatically,
+    except for loading plugin storages.
+
+    Plugin configs and storages are shared: every caller of
+    get_plugin_config() or get_plugin_storage() receives the same instance
+    for the same plugin, until close() is called. The instances are
+    reference counted and stay cached when they are not used, so remounting
+    a plugin does not need to read its files again.
     """
     def __init__(self, dir_path: str):
         self._manager = config.ConfigManager(dir_path)
+        self._storage_backend = "json"
+        self._journal_fsync = True
+        self._configs: Dict[str, _SharedEntry] = {}
+        self._storages: Dict[Tuple[str, str], _SharedEntry] = {}  # (backend, plugin name) -> entry
         self._log_path = self._manager.get_file(LOGFILE_NAME)
         self._old_log_path = self._manager.get_file(LOGFILE_NAME_OLD)
 
+    def enable_write_behind(self, delay: float) -> None:
+        """Defer and coalesce writes of configs and storages retrieved afterwards.
+
+        See config.WriteBehindFlusher. A delay <= 0 disables write-behind for
+        new configs.
+        """
+        if delay <= 0:
+            self._manager.flusher = None
+        elif self._manager.flusher is None:
+            self._manager.flusher = config.WriteBehindFlusher(delay)
+        else:
+            self._manager.flusher.delay = delay
+
+    async def flush(self) -> None:
+        """Write all pending config and storage changes."""
+        if self._manager.flusher is not None:
+            await self._manager.flusher.close()
+
     def get_plugin_config(self, plugin_name: str) -> config.Config:
-        return self._manager.get_config(os.path.join(PLUGIN_DIR, plugin_name))
+        """Returns the shared config of the given plugin and increases its reference count.
+
+        The config is not loaded automatically. Use Config.reload() to only
+        read the file if it was modified on disk.
+        Call release_plugin_config() when it is no longer needed.
+        """
+        entry = self._configs.get(plugin_name, None)
+        if entry is None:
+            entry = self._configs[plugin_name] = _SharedEntry(self._manager.get_config(os.path.join(PLUGIN_DIR, plugin_name)))
+        entry.refs += 1
+        return entry.obj
+
+    def release_plugin_config(self, plugin_name: str) -> None:
+        self._release(self._configs.get(plugin_name, None), plugin_name)
+
+    def get_plugin_config_dir(self) -> str:
+        return self._manager.get_file(PLUGIN_DIR)
+
+    def get_cache_dir(self, name: str) -> str:
+        """Returns the path of a directory for cached data that can be removed at any time. It is not created automatically."""
+        return self._manager.get_file(os.path.join(CACHE_DIR, name))
+
+    def set_storage_backend(self, backend: str, journal_fsync: bool = True) -> None:
+        """Set the backend for storages retrieved afterwards.
+
+        "json": Rewrite the whole json file on every write (default).
+        "journal": Append changes to a journal, see util.JournalBackend.
+                   `journal_fsync` is passed as its `fsync` argument.
+        "sqlite": Use an SQLite database, see util.SQLiteStorage. Existing
+                  json storage files are migrated automatically.
+        """
+        if backend not in ("json", "journal", "sqlite"):
+            raise ValueError("Unknown storage backend: " + backend)
+        self._storage_backend = backend
+        self._journal_fsync = journal_fsync
+
+    async def migrate_storages(self) -> None:
+        """Migrate json storage files to the current storage backend in a background thread.
+
+        Only needed for the "sqlite" backend. Otherwise, or if a storage was
+        migrated already, it does nothing. A failed migration is retried
+        next time.
+        """
+        if self._storage_backend != "sqlite":
+            return
+
+        storage_dir = self._manager.get_file(STORAGE_DIR)
+        if not os.path.isdir(storage_dir):
+            return
+
+        names = { i[:-len(JournalBackend.JOURNAL_SUFFIX)] if i.endswith(JournalBackend.JOURNAL_SUFFIX) else i
+                  for i in os.listdir(storage_dir) }
+        for i in sorted(names):
+            jsonfile = os.path.join(storage_dir, i)
+            if i.endswith(".json") and not os.path.exists(self._get_sqlite_file(jsonfile)):
+                try:
+                    await run_in_thread(self._migrate_to_sqlite, jsonfile)
+                except Exception as e:
+                    logging.error("Failed to migrate storage %s: %s", jsonfile, e)
 
     def get_plugin_storage(self, plugin_name: str) -> Storage:
-        return Storage(self._manager.get_config(os.path.join(STORAGE_DIR, plugin_name)))
+        """Returns the shared, loaded storage of the given plugin and increases its reference count.
+
+        The storage is reloaded if it was modified on disk.
+        Call release_plugin_storage() when it is no longer needed.
+        """
+        key = (self._storage_backend, plugin_name)
+        entry = self._storages.get(key, None)
+
+        if entry is None:
+            storage = self._create_plugin_storage(plugin_name)
+            storage.load()
+            entry = self._storages[key] = _SharedEntry(storage)
+        elif entry.obj.is_modified_on_disk():
+            entry.obj.load()
+
+        entry.refs += 1
+        return entry.obj
+
+    def release_plugin_storage(self, plugin_name: str) -> None:
+        """Decrease the reference count of a plugin's storage and write it if it is no longer used."""
+        entry = self._storages.get((self._storage_backend, plugin_name), None)
+        self._release(entry, plugin_name)
+        if entry is not None and entry.refs == 0:
+            entry.obj.write()
+
+    async def shutdown(self) -> None:
+        """Write all storages, wait until all pending writes finished, then close().
+
+        Use this instead of close() while the event loop is running, as
+        storage writes may be deferred then.
+        """
+        for entry in self._storages.values():
+            entry.obj.write()
+        await self.flush()
+        self._close_all()
+
+    def close(self) -> None:
+        """Write and close all storages and forget all shared configs and storages.
+
+        See also shutdown().
+        """
+        for entry in self._storages.values():
+            entry.obj.write()
+        self._close_all()
+
+    def _close_all(self) -> None:
+        for (_, name), entry in self._storages.items():
+            if entry.refs > 0:
+                logging.warning("Closing storage still in use: %s", name)
+            entry.obj.close()
+        self._storages.clear()
+        self._configs.clear()
+
+    @staticmethod
+    def _release(entry: _SharedEntry, name: str) -> None:
+        if entry is None or entry.refs <= 0:
+            logging.warning("Releasing config or storage that is not in use: %s", name)
+        else:
+            entry.refs -= 1
+
+    @staticmethod
+    def _get_sqlite_file(jsonfile: str) -> str:
+        return os.path.splitext(jsonfile)[0] + ".sqlite3"
+
+    @staticmethod
+    def _merge_journal(jsonfile: str) -> None:
+        """Merge leftover journal records if the journal backend was used before."""
+        if os.path.exists(jsonfile + JournalBackend.JOURNAL_SUFFIX):
+            journal = JournalBackend(jsonfile)
+            journal.load()
+            journal.compact()
+
+    @staticmethod
+    def _migrate_to_sqlite(jsonfile: str) -> None:
+        BotProfile._merge_journal(jsonfile)
+        if os.path.exists(jsonfile):
+            migrate_json_file(jsonfile, BotProfile._get_sqlite_file(jsonfile))
+
+    def _create_plugin_storage(self, plugin_name: str) -> Storage:
+        cfg = self._manager.get_config(os.path.join(STORAGE_DIR, plugin_name))
+
+        if self._storage_backend == "journal":
+            return Storage(JournalBackend(cfg.filename, fsync=self._journal_fsync, flusher=self._manager.flusher))
+
+        if self._storage_backend == "sqlite":
+            dbfile = self._get_sqlite_file(cfg.filename)
+            if not os.path.exists(dbfile):
+                # Usually done by migrate_storages() already
+                self._migrate_to_sqlite(cfg.filename)
+            return SQLiteStorage(dbfile, flusher=self._manager.flusher)
+
+        self._merge_journal(cfg.filename)
+        return Storage(cfg)
 
     def get_bot_config(self) -> config.Config:
         return self._manager.get_config(BOT_CONFIG_NAME)
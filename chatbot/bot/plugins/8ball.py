@@ -7,7 +7,8 @@ import random
 class Plugin(BotPlugin):
     def __init__(self, bot):
         super().__init__(bot)
-        self.register_command("missing_8ball", self._question, argc=0, flags=command.CommandFlag.Missing)
+        self.register_command("missing_8ball", self._question, argc=0, flags=command.CommandFlag.Missing,
+                              predicate=command.CommandPredicate(suffix="?"))
 
     @staticmethod
     def get_default_config():
@@ -22,7 +23,5 @@ class Plugin(BotPlugin):
             ]
         }
 
-    async def _question(self, msg, argv):
-        if not argv[-1].endswith("?"):
-            raise command.CommandNotFoundError
+    async def _question(self, msg, _argv):
         await msg.reply(random.choice(self.cfg["answers"]))
@@ -15,9 +15,11 @@ class Plugin(BotPlugin):
     async def _listplugins(self, msg, _argv):
         """Syntax: listplugins
 
-        List mounted plugins.
+        List mounted plugins and plugins that are loaded on first use.
         """
-        await msg.reply(", ".join([ k for k, _ in self.bot.iter_plugins() ]))
+        plugins = [ k for k, _ in self.bot.iter_plugins() ]
+        plugins.extend(f"{i} (not loaded)" for i in self.bot.iter_deferred_plugins())
+        await msg.reply(", ".join(plugins))
 
     async def _plugins(self, msg, argv):
         """Syntax: plugins <mount|unmount> <plugin name>
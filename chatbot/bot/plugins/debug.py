@@ -15,6 +15,9 @@ class Plugin(BotPlugin):
         self._events: Dict[str, bool] = {}  # Store which events were triggered
 
         self.register_admin_command("testapi", self._test, argc=0)
+        self.register_admin_command("eventstats", self._eventstats, argc=0)
+        self.register_admin_command("httpstats", self._httpstats, argc=0)
+        self.register_admin_command("poolstats", self._poolstats, argc=0)
 
         for event in api.APIEvents:
             self.register_event_handler(
@@ -41,5 +44,51 @@ class Plugin(BotPlugin):
         for k, v in self._events.items():
             logging.info("%s: %s", k, states[int(v)])
 
+    async def _eventstats(self, msg: api.ChatMessage, argv):
+        """Syntax: eventstats [on|off|reset]
+
+        Show timing statistics of event handlers, slowest first.
+        `on` and `off` enable or disable recording statistics, disabling discards them.
+        If `reset` is given, all statistics are reset.
+        """
+        if len(argv) > 1:
+            if argv[1] == "reset":
+                self.bot.reset_event_stats()
+                await msg.reply("Event statistics reset.")
+            elif argv[1] in ("on", "off"):
+                self.bot.enable_event_stats(argv[1] == "on")
+                await msg.reply("Event statistics {}.".format("enabled" if argv[1] == "on" else "disabled"))
+            else:
+                await msg.reply("Unknown option: " + argv[1])
+            return
+
+        if not self.bot.event_stats_enabled:
+            await msg.reply("Event statistics are disabled. Use `eventstats on` to enable them.")
+            return
+
+        stats = sorted(self.bot.get_event_stats().items(), key=lambda x: x[1].total_time, reverse=True)
+        if not stats:
+            await msg.reply("No event statistics recorded.")
+        else:
+            await msg.reply("\n".join([ "{} ({}): {}".format(label, event, s) for (event, label), s in stats ]))
+
+    async def _httpstats(self, msg: api.ChatMessage, _argv):
+        """Syntax: httpstats
+
+        Show HTTP request and cache statistics.
+        """
+        text = f"Requests: {self.bot.http.requests}"
+        cache = self.bot.http.cache
+        if cache is not None:
+            text += f"\nCache ({len(cache)} entries): {cache.stats}"
+        await msg.reply(text)
+
+    async def _poolstats(self, msg: api.ChatMessage, _argv):
+        """Syntax: poolstats
+
+        Show worker thread pool statistics.
+        """
+        await msg.reply(str(self.bot.workers))
+
     async def _handle_event(self, event: str, *_args, **_kwargs):
         self._events[event] = True
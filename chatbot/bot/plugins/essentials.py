@@ -2,17 +2,21 @@
 
 import asyncio
 import re
-import math
 import random
-from multiprocessing import Array, Process
+from typing import Optional
 from chatbot import util, api, bot
 
 RE_ROLL = re.compile(r"(\d*)\s*d\s*(\d+)")
 
+MANIFEST = {
+    "commands": [ "clear", "calc", "hex", "binary", "choose", "random", "slap", "explode", "lenny", "roll" ],
+}
+
 
 class Plugin(bot.BotPlugin):
     def __init__(self, bot_):
         super().__init__(bot_)
+        self._evaluator: Optional[util.EvalPool] = None
         self.register_command("clear", self._clear, argc=0)
         self.register_command("calc", self._calc)
         self.register_command("hex", self._hex)
@@ -24,6 +28,33 @@ class Plugin(bot.BotPlugin):
         self.register_command("lenny", self._lenny, argc=0)
         self.register_command("roll", self._roll, argc=1)
 
+    async def reload(self):
+        await super().reload()
+
+        workers = int(self.cfg["calc_workers"])
+        if self._evaluator is not None and self._evaluator.size != workers:
+            await self._evaluator.close()
+            self._evaluator = None
+
+        if self._evaluator is None:
+            self._evaluator = util.EvalPool(workers)
+        self._evaluator.timeout = float(self.cfg["calc_timeout"])
+        self._evaluator.cache_size = int(self.cfg["calc_cache_size"])
+        self._evaluator.start()
+
+    async def quit(self):
+        if self._evaluator is not None:
+            await self._evaluator.close()
+        await super().quit()
+
+    @staticmethod
+    def get_default_config():
+        return {
+            "calc_workers": 2,  # Processes evaluating calc expressions
+            "calc_timeout": 3,  # Max. seconds to evaluate an expression
+            "calc_cache_size": 256,  # Remember results of this many expressions
+        }
+
     @staticmethod
     async def _clear(msg, _argv):
         """Syntax: clear
@@ -32,14 +63,6 @@ class Plugin(bot.BotPlugin):
         """
         await msg.reply("-" + "\n" * 50 + "-")
 
-    @staticmethod
-    def _async_eval_proc(result, expr):
-        mathlist = { k: math.__dict__[k] for k in math.__dict__ if not k.startswith("_") }
-        try:
-            result.value = str(eval(expr, { "__builtins__": None }, mathlist)).encode("utf-8")  # pylint: disable=eval-used
-        except Exception as e:
-            result.value = ("Error: " + str(e))[:256].encode("utf-8")
-
     async def _calc(self, msg: api.ChatMessage, argv):
         """Syntax: calc <expression>
 
@@ -51,22 +74,7 @@ class Plugin(bot.BotPlugin):
         if not re.match(r"^[ a-zA-Z0-9\.\+\-\*/\(\)]*$", expr):
             raise bot.command.CommandSyntaxError("Expression contains invalid characters")
 
-        def _async_calc_thread(expr):
-            result = Array("c", 256)
-            p = Process(target=self._async_eval_proc, args=(result, expr))
-            p.start()
-            p.join(3)
-            if p.is_alive():
-                p.terminate()
-                p.join()
-                return "Expression took too long to evaluate."
-            return result.value.decode("utf-8")  # type: ignore[attr-defined]
-
-        # Start a new thread and from there run a new process for calculation.
-        # We need to do this, because a ProcessPoolExecutor can't be killed
-        # apparently. Instead it hangs and blocks execution if trying to
-        # shutdown() or asyncio.wait_for().
-        result = await util.run_in_thread(_async_calc_thread, expr)
+        result = await self._evaluator.evaluate(expr)
         await msg.reply(result)
 
     @staticmethod
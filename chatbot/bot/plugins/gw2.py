@@ -5,6 +5,8 @@ from typing import List, Dict
 from chatbot.bot import BotPlugin
 from chatbot import api, util
 
+GEM_PRICE_TTL = 60  # Seconds to reuse the fetched gem exchange rate
+
 
 class Plugin(BotPlugin):
     def __init__(self, bot):
@@ -154,6 +156,7 @@ class GemPriceInfo(InfoProvider):
 
     @staticmethod
     async def get_coins_for_100_gems() -> int:
-        data: Dict = await util.async_http_get_json("https://api.guildwars2.com/v2/commerce/exchange/coins?quantity=1000000")
+        data: Dict = await util.async_http_get_json("https://api.guildwars2.com/v2/commerce/exchange/coins?quantity=1000000",
+                                                     ttl=GEM_PRICE_TTL)
         coins_per_gem = int(data["coins_per_gem"])
         return coins_per_gem * 100
@@ -15,6 +15,10 @@ DEFAULT_MAX_OVERLAP_RATIO = markovify.text.DEFAULT_MAX_OVERLAP_RATIO
 
 MAX_SENTENCE_COUNT = 50
 
+MANIFEST = {
+    "commands": [ "markov" ],
+}
+
 
 @dataclass
 class MarkovModel:
@@ -36,7 +40,7 @@ class Plugin(BotPlugin):
     # This plugin needs a custom reload function so that the default
     # example entry gets overwritten if the user wants to.
     async def reload(self):
-        self.cfg.load(self.get_default_config(), validate=False, create=True)
+        self.cfg.reload(self.get_default_config(), validate=False, create=True)
 
         for name, settings in self.cfg.data.items():
             name              = name.strip().lower()
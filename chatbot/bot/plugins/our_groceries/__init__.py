@@ -15,6 +15,10 @@ DEFAULT_NUM_SERVINGS = 4
 STORAGE_AUTH_KEY = "ourgroceries_login"
 MAX_RECIPE_NAME_RETRIES = 10
 
+MANIFEST = {
+    "commands": [ "ourgroceries" ],
+}
+
 
 SUPPORTED_PAGES: List[Callable[[str], datamodel.RecipeFetcher]] = [
     chefkoch_api.ChefkochFetcher,
@@ -137,7 +141,7 @@ class Plugin(bot.BotPlugin):
         self.storage.write()
 
     async def create_recipe_from_url(self, og: OurGroceries, fetcher: datamodel.RecipeFetcher, num_servings: int) -> None:
-        recipe = await fetcher.fetch_recipe()
+        recipe = await fetcher.fetch_recipe_shared()
 
         if not recipe:
             raise CommandError("Failed to fetch recipe")
@@ -1,3 +1,4 @@
+import copy
 import logging
 from dataclasses import dataclass, field
 from typing import List, Optional
@@ -7,6 +8,12 @@ import locale
 from chatbot import util
 from bs4 import BeautifulSoup
 
+# Seconds to reuse fetched recipe pages, e.g. when multiple users share the same link
+RECIPE_PAGE_TTL = 10 * 60
+
+# Recipes being fetched, keyed by (fetcher class, URL)
+_recipe_flights = util.SingleFlight()
+
 # Only includes sensible fractions, e.g. not 7/8, 3/8, 1/7, etc.
 REVERSE_FRACTION_TRANSLATION = (
     ("½", 0.5),
@@ -104,6 +111,14 @@ class RecipeFetcher:
     async def fetch_recipe(self) -> Optional[Recipe]:
         raise NotImplementedError
 
+    async def fetch_recipe_shared(self) -> Optional[Recipe]:
+        """Same as fetch_recipe() but concurrent calls for the same URL share a single fetch.
+
+        Returns a copy, so it can be modified safely.
+        """
+        recipe = await _recipe_flights.do((type(self), self._url), self.fetch_recipe)
+        return copy.deepcopy(recipe)
+
     async def supports_url(self) -> bool:
         raise NotImplementedError
 
@@ -122,6 +137,6 @@ class RecipeFetcher:
         Uses the given URL if not empty, otherwise the constructor URL.
         """
         url = url if url else self._url
-        content: str = await util.async_http_get_str(url)
+        content: str = await util.async_http_get_str(url, ttl=RECIPE_PAGE_TTL)
         soup = BeautifulSoup(content, "html.parser")
         return soup
@@ -2,13 +2,14 @@
 
 import random
 from chatbot.bot import BotPlugin, command
-from urllib import request
 from xml.etree import ElementTree
 from chatbot import api, util
 from typing import List, Set
 import logging
 import asyncio
 
+POST_COUNT_TTL = 10 * 60  # Seconds to reuse the total post count for picking random posts
+
 
 class Plugin(BotPlugin):
     def __init__(self, bot):
@@ -119,24 +120,24 @@ class Plugin(BotPlugin):
 
 
 async def get_shitpost_urls(num: int, rand: bool) -> List[str]:
-    def cb(rand: bool) -> List[str]:
-        start = random.randint(0, get_num_posts() - 1) if rand else 0
-        posts = query_tumblr_posts(num, start)
-        return extract_urls(posts)
+    start = random.randint(0, await get_num_posts() - 1) if rand else 0
+    posts = await query_tumblr_posts(num, start)
+    return extract_urls(posts)
 
-    return await util.run_in_thread(cb, rand)
 
+async def get_num_posts() -> int:
+    xml = await query_tumblr_posts(0, ttl=POST_COUNT_TTL)
+    return int(xml.find("posts").get("total"))
 
-def get_num_posts() -> int:
-    xml = query_tumblr_posts(0)
-    return int(xml.getroot().find("posts").get("total"))
 
+def extract_urls(posts: ElementTree.Element) -> List[str]:
+    return [ i.find("photo-url").text for i in posts.find("posts") ]
 
-def extract_urls(posts: ElementTree.ElementTree) -> List[str]:
-    return [ i.find("photo-url").text for i in posts.getroot().find("posts") ]
 
+async def query_tumblr_posts(num=1, start=0, ttl=None) -> ElementTree.Element:
+    """Query for tumblr posts, by default top post.
 
-def query_tumblr_posts(num=1, start=0) -> ElementTree.ElementTree:
-    """Query for tumblr posts, by default top post."""
+    `ttl` is passed to the HTTP cache, see util.HTTPClient.get().
+    """
     requesturl = "https://shitpostbot5k.tumblr.com/api/read?type=photo&num={}&start={}".format(num, start)
-    return ElementTree.parse(request.urlopen(requesturl))
+    return ElementTree.fromstring(await util.async_http_get_str(requesturl, ttl=ttl))
@@ -14,7 +14,7 @@ class Plugin(BotPlugin):
     # This plugin actually needs a custom reload function so that the default
     # example entry gets overwritten if the user wants to.
     async def reload(self):
-        self.cfg.load(self.get_default_config(), validate=False, create=True)
+        self.cfg.reload(self.get_default_config(), validate=False, create=True)
 
     @staticmethod
     def get_default_config():
@@ -5,6 +5,10 @@ from chatbot.bot import BotPlugin
 from chatbot import util, api
 import random
 
+MANIFEST = {
+    "commands": [ "zalgo" ],
+}
+
 
 class Plugin(BotPlugin):
     def __init__(self, bot):
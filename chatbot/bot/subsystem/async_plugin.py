@@ -2,10 +2,15 @@
 
 import sys
 import os
+import ast
+import asyncio
+import hashlib
+import time
 import importlib.util
 import importlib.machinery
 import logging
-from typing import Callable, Dict, Iterable, Tuple, Any, Optional
+from types import CodeType, ModuleType
+from typing import Callable, Dict, Iterable, List, Set, Tuple, Any, Optional
 from dataclasses import dataclass
 from pathlib import Path
 from inspect import getfile
@@ -15,7 +20,13 @@ ExceptionCallback = Callable[[str, Exception], bool]
 
 
 class BasePlugin:
-    """Base class for plugins."""
+    """Base class for plugins.
+
+    `dependencies` lists names of plugins whose init() must have finished
+    before this plugin's init() is called by PluginManager.mount_all().
+    """
+
+    dependencies: Tuple[str, ...] = ()
 
     def __init__(self):
         # Auto-deduce the plugin name.
@@ -39,6 +50,13 @@ class BasePlugin:
         """Will be called when a plugin is unmounted."""
         raise NotImplementedError
 
+    def abort(self) -> None:
+        """Will be called when init() failed, timed out or was cancelled.
+
+        The plugin is not mounted and quit() will not be called, hence
+        everything set up by __init__() or init() should be undone here.
+        """
+
     @property
     def name(self) -> str:
         """Name of the plugin."""
@@ -62,14 +80,46 @@ class PluginHandle:
         return self.plugin is not None and self.module is not None
 
 
+@dataclass
+class PluginManifest:
+    """Describes when a plugin has to be loaded in lazy mode.
+
+    Plugins provide it as a module level dict literal named `MANIFEST`
+    with the same keys, e.g.
+        MANIFEST = { "commands": [ "foo" ], "admin_commands": [ "bar" ], "events": [ "Message" ] }
+    It is read without importing the module, hence it must not contain
+    anything but literals.
+    """
+    commands: Tuple[str, ...] = ()
+    admin_commands: Tuple[str, ...] = ()
+    events: Tuple[str, ...] = ()
+
+
+@dataclass
+class MountTiming:
+    """Seconds spent mounting a plugin."""
+    load: float = 0.0  # Importing and instantiating
+    imports: float = 0.0  # Importing only, part of `load`
+    cached: bool = False  # The module was reused because its source did not change
+    wait: float = 0.0  # Waiting for dependencies
+    init: float = 0.0  # Running init()
+
+    @property
+    def total(self) -> float:
+        return self.load + self.wait + self.init
+
+
 class PluginManager:
-    def __init__(self, searchpath: str, whitelist: Iterable[str] = None, blacklist: Iterable[str] = None):
+    def __init__(self, searchpath: str, whitelist: Iterable[str] = None, blacklist: Iterable[str] = None,
+                 init_timeout: Optional[float] = None, lazy: bool = False):
         """Constructor.
 
         Args:
             searchpath: Plugin searchpath.
             blacklist: Exclude certain plugins from autoloading.
             whitelist: Only load the specified plugins.
+            init_timeout: Max. seconds a plugin's init() may take, None for unlimited.
+            lazy: Defer loading plugins with a manifest until activate() is called.
 
         If neither blacklist nor whitelist contains entries, none of them
         have effect and all plugins will be autoloaded.
@@ -79,7 +129,13 @@ class PluginManager:
         self._searchpath = Path(searchpath)
         self.blacklist = set(blacklist if blacklist else [])
         self.whitelist = set(whitelist if whitelist else [])
+        self.init_timeout = init_timeout
+        self.lazy = lazy
         self._plugins: Dict[str, PluginHandle] = {}
+        self._deferred: Dict[str, Tuple[PluginManifest, tuple, dict]] = {}  # name -> (manifest, args, kwargs)
+        self._activating: Dict[str, asyncio.Task] = {}
+        self._module_cache = ModuleCache()
+        self._timings: Dict[str, MountTiming] = {}
         os.makedirs(searchpath, exist_ok=True)
 
     async def mount_plugin(self, name: str, *args, **kwargs):
@@ -97,16 +153,13 @@ class PluginManager:
         If an exception occurs during the loading process, the plugin is
         guaranteed to be removed from the system.
         """
-        oldplugin = None
-
-        if old_handle := self._plugins.get(name, None):
-            oldplugin = old_handle.plugin
-            await self.unmount_plugin(name)
-
-        new_handle = self._load_plugin(name, *args, **kwargs)
-        await new_handle.plugin.init(oldplugin)
-        self._plugins[name] = new_handle
-        logging.info("Plugin (re-)mounted: %s", name)
+        self._deferred.pop(name, None)
+        timing = MountTiming()
+        start = time.perf_counter()
+        oldplugin = await self._unmount_for_remount(name)
+        new_handle = self._load_plugin(name, timing, *args, **kwargs)
+        timing.load = time.perf_counter() - start
+        await self._init_plugin(name, new_handle, oldplugin, timing)
 
     async def unmount_plugin(self, name: str):
         """Unmount a plugin.
@@ -144,39 +197,100 @@ class PluginManager:
 
         No matter if the exception was caught or re-raised, the responsible
         plugin will be skipped.
-        """
-        for i in self._searchpath.iterdir():
-            # Filter hidden files
-            if i.name.startswith("_") or i.name.startswith("."):
-                continue
-
-            # Filter unrelated files
-            if not i.name.endswith(".py") and not i.is_dir():
-                continue
 
-            plugin_name = i.name[:-3] if i.name.endswith(".py") else i.name
+        Plugins are imported and instantiated one after another, but their
+        init() functions run concurrently. A plugin's init() is only called
+        after the init() of all its `dependencies` succeeded, otherwise the
+        plugin fails, too. If an exception is re-raised, plugins that are
+        still initializing are cancelled and not mounted.
+        Timings are logged and available through get_mount_timings().
 
-            if self.whitelist:
-                if plugin_name not in self.whitelist:
-                    logging.debug("Plugin not whitelisted, skipping: %s", plugin_name)
-                    continue
-            elif self.blacklist:
-                if plugin_name in self.blacklist:
-                    logging.debug("Plugin blacklisted, skipping: %s", plugin_name)
+        In lazy mode, plugins providing a manifest (see PluginManifest) are
+        neither imported nor initialized. Use iter_deferred() to get their
+        manifests and activate() to mount them on first use.
+        """
+        start = time.perf_counter()
+        handles: Dict[str, Tuple[PluginHandle, Optional[BasePlugin], MountTiming]] = {}
+
+        for plugin_name in self._find_plugins():
+            if self.lazy and plugin_name not in self._plugins:
+                try:
+                    manifest = self.read_manifest(plugin_name)
+                except Exception as e:
+                    if exception_handler and exception_handler(plugin_name, e):
+                        continue
+                    raise
+
+                if manifest is not None:
+                    self._deferred[plugin_name] = (manifest, args, kwargs)
+                    logging.debug("Deferring plugin until first use: %s", plugin_name)
                     continue
 
+            timing = MountTiming()
+            t = time.perf_counter()
             try:
-                await self.mount_plugin(plugin_name, *args, **kwargs)
+                oldplugin = await self._unmount_for_remount(plugin_name)
+                handles[plugin_name] = (self._load_plugin(plugin_name, timing, *args, **kwargs), oldplugin, timing)
+                timing.load = time.perf_counter() - t
             except Exception as e:
                 if exception_handler and exception_handler(plugin_name, e):
                     continue
                 raise
 
+        tasks: Dict[str, asyncio.Task] = {}
+        cycles = self._find_dependency_cycles({ k: v[0].plugin.dependencies for k, v in handles.items() })
+
+        async def init(name: str) -> Optional[Exception]:
+            handle, oldplugin, timing = handles[name]
+            try:
+                if name in cycles:
+                    raise ImportError(f"Circular plugin dependency: {name}")
+
+                t = time.perf_counter()
+                for dep in handle.plugin.dependencies:
+                    if dep in tasks:
+                        await asyncio.wait([ tasks[dep] ])
+                    if dep not in self._plugins:
+                        raise ImportError(f"Plugin dependency not mounted: {dep}")
+                timing.wait = time.perf_counter() - t
+
+                await self._init_plugin(name, handle, oldplugin, timing)
+            except Exception as e:
+                return e
+            return None
+
+        for name in handles:
+            tasks[name] = asyncio.create_task(init(name))
+
+        pending = set(tasks.values())
+        names = { v: k for k, v in tasks.items() }
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if (e := task.result()) is not None:
+                        if not (exception_handler and exception_handler(names[task], e)):
+                            raise e
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        logging.info("Mounted %s plugins in %.3fs, %s deferred", len(handles), time.perf_counter() - start, len(self._deferred))
+        for name, timing in sorted(self._timings.items(), key=lambda x: x[1].total, reverse=True):
+            if name in handles:
+                logging.info("  %-16s %7.3fs (load %.3fs, import %.3fs%s, wait %.3fs, init %.3fs)",
+                             name, timing.total, timing.load, timing.imports, " cached" if timing.cached else "",
+                             timing.wait, timing.init)
+
     async def unmount_all(self, exception_handler: ExceptionCallback):
         """Unmount all plugins.
 
+        Deferred plugins are discarded.
         See mount_all() on how to use exception_handler.
         """
+        self._deferred.clear()
+
         # Create a copy so the source dict doesn't change while iterating
         for i in list(self._plugins):
             try:
@@ -195,6 +309,49 @@ class PluginManager:
         for k, v in self._plugins.items():
             yield (k, v.plugin)
 
+    def iter_deferred(self) -> Iterable[Tuple[str, PluginManifest]]:
+        """Iterate through plugins that were deferred by mount_all() and are not yet activated."""
+        for k, v in self._deferred.items():
+            yield (k, v[0])
+
+    def is_deferred(self, name: str) -> bool:
+        return name in self._deferred
+
+    async def activate(self, name: str) -> Optional[BasePlugin]:
+        """Mount a deferred plugin and return it.
+
+        Returns the plugin if it is already mounted or None if it is neither
+        mounted nor deferred. Concurrent calls for the same plugin mount it
+        only once. Exceptions are re-raised and the plugin is no longer
+        deferred afterwards.
+        """
+        if entry := self._deferred.pop(name, None):
+            logging.info("Activating deferred plugin: %s", name)
+            _, args, kwargs = entry
+            task = self._activating[name] = asyncio.create_task(self.mount_plugin(name, *args, **kwargs))
+            task.add_done_callback(lambda _: self._activating.pop(name, None))
+
+        if task := self._activating.get(name, None):
+            # Don't abort mounting if one of the callers is cancelled
+            await asyncio.shield(task)
+        return self.get_plugin(name)
+
+    def read_manifest(self, name: str) -> Optional[PluginManifest]:
+        """Reads the plugin's manifest without importing it. Returns None if it has none."""
+        fname = self._get_plugin_file(name)
+        tree = ast.parse(fname.read_bytes(), str(fname))
+
+        for node in tree.body:
+            if (isinstance(node, ast.Assign) and len(node.targets) == 1
+                    and isinstance(node.targets[0], ast.Name) and node.targets[0].id == "MANIFEST"):
+                data = ast.literal_eval(node.value)
+                return PluginManifest(**{ k: tuple(v) for k, v in data.items() })
+        return None
+
+    def get_mount_timings(self) -> Dict[str, MountTiming]:
+        """Returns how long mounting each currently mounted plugin took."""
+        return { k: v for k, v in self._timings.items() if k in self._plugins }
+
     def plugin_exists(self, name: str):
         return name in self._plugins
 
@@ -204,21 +361,100 @@ class PluginManager:
             return handle.plugin
         return None
 
-    def _load_plugin(self, name: str, *args, **kwargs) -> PluginHandle:
-        """Loads a module from the plugin search path and instantiates it."""
+    def _find_plugins(self) -> List[str]:
+        """Returns names of plugins in searchpath to mount, while regarding black/whitelists."""
+        names = []
+        for i in sorted(self._searchpath.iterdir()):
+            # Filter hidden files
+            if i.name.startswith("_") or i.name.startswith("."):
+                continue
+
+            # Filter unrelated files
+            if not i.name.endswith(".py") and not i.is_dir():
+                continue
+
+            plugin_name = i.name[:-3] if i.name.endswith(".py") else i.name
+
+            if self.whitelist:
+                if plugin_name not in self.whitelist:
+                    logging.debug("Plugin not whitelisted, skipping: %s", plugin_name)
+                    continue
+            elif self.blacklist:
+                if plugin_name in self.blacklist:
+                    logging.debug("Plugin blacklisted, skipping: %s", plugin_name)
+                    continue
+
+            names.append(plugin_name)
+        return names
+
+    @staticmethod
+    def _find_dependency_cycles(dependencies: Dict[str, Iterable[str]]) -> Set[str]:
+        """Returns names of plugins that (indirectly) depend on themselves."""
+        cycles: Set[str] = set()
+
+        def visit(name: str, path: List[str]) -> None:
+            if name in path:
+                cycles.update(path[path.index(name):])
+                return
+            path.append(name)
+            for dep in dependencies.get(name, ()):
+                visit(dep, path)
+            path.pop()
+
+        for name in dependencies:
+            visit(name, [])
+        return cycles
+
+    async def _unmount_for_remount(self, name: str) -> Optional[BasePlugin]:
+        """Unmounts the plugin if it is mounted and returns the old instance."""
+        if old_handle := self._plugins.get(name, None):
+            await self.unmount_plugin(name)
+            return old_handle.plugin
+        return None
 
+    async def _init_plugin(self, name: str, handle: PluginHandle, oldplugin: Optional[BasePlugin],
+                           timing: MountTiming) -> None:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(handle.plugin.init(oldplugin), self.init_timeout)
+        except asyncio.TimeoutError as e:
+            self._abort_plugin(name, handle)
+            raise TimeoutError(f"Plugin init() timed out after {self.init_timeout}s: {name}") from e
+        except BaseException:
+            self._abort_plugin(name, handle)
+            raise
+        finally:
+            timing.init = time.perf_counter() - start
+
+        self._plugins[name] = handle
+        self._timings[name] = timing
+        logging.info("Plugin (re-)mounted: %s", name)
+
+    @staticmethod
+    def _abort_plugin(name: str, handle: PluginHandle) -> None:
+        try:
+            handle.plugin.abort()
+        except Exception:
+            logging.exception("Failed to abort plugin: %s", name)
+
+    def _get_plugin_file(self, name: str) -> Path:
         dir_path = self._searchpath / name
         py_path = dir_path.with_suffix(".py")
 
         if py_path.is_file():
-            fname = py_path
-        elif dir_path.is_dir():
-            fname = dir_path / "__init__.py"
-        else:
-            raise ImportError("Plugin not found")
+            return py_path
+        if dir_path.is_dir():
+            return dir_path / "__init__.py"
+        raise ImportError("Plugin not found")
+
+    def _load_plugin(self, name: str, timing: MountTiming, *args, **kwargs) -> PluginHandle:
+        """Loads a module from the plugin search path and instantiates it."""
+        fname = self._get_plugin_file(name)
 
-        logging.debug("Loading module: %s", fname)
-        module = load_source(name, str(fname))
+        start = time.perf_counter()
+        module, timing.cached = self._module_cache.load(name, str(fname))
+        timing.imports = time.perf_counter() - start
+        logging.debug("Loaded module %s in %.3fs%s", fname, timing.imports, " (unchanged)" if timing.cached else "")
 
         logging.debug("Creating plugin instance: %s", name)
         plugin: BasePlugin = module.Plugin(*args, **kwargs)
@@ -226,11 +462,85 @@ class PluginManager:
         return PluginHandle(plugin, module)
 
 
+class _CachingLoader(importlib.machinery.SourceFileLoader):
+    """SourceFileLoader that keeps compiled code objects in memory, keyed by a hash of the source.
+
+    Bytecode is read from and written to __pycache__ as usual when the
+    code object is not cached.
+    """
+    def __init__(self, fullname: str, path: str, cache: Dict[str, Tuple[str, CodeType]]):
+        super().__init__(fullname, path)
+        self._cache = cache
+
+    def get_code(self, fullname: str) -> CodeType:
+        source = self.get_data(self.path)
+        digest = hashlib.sha256(source).hexdigest()
+        cached = self._cache.get(self.path, None)
+        if cached and cached[0] == digest:
+            return cached[1]
+
+        if cached:
+            # The .pyc is validated by mtime and size only, which might not have changed
+            code = self.source_to_code(source, self.path)
+        else:
+            code = super().get_code(fullname)
+        self._cache[self.path] = (digest, code)
+        return code
+
+
+class ModuleCache:
+    """Caches plugin modules by a hash of their source files.
+
+    load() only executes a module again if its source, or any source file
+    inside a package's directory, has changed since it was last loaded.
+    """
+    def __init__(self):
+        self._modules: Dict[str, Tuple[str, ModuleType]] = {}  # filename -> (digest, module)
+        self._code: Dict[str, Tuple[str, CodeType]] = {}  # filename -> (digest, code)
+
+    def load(self, modname: str, filename: str) -> Tuple[ModuleType, bool]:
+        """Returns the module and whether it was reused without executing it."""
+        digest = self._get_digest(filename)
+        cached = self._modules.get(filename, None)
+        if cached and cached[0] == digest and sys.modules.get(modname, None) is cached[1]:
+            return cached[1], True
+
+        # Ensure changed submodules of packages are executed again, too
+        for i in [ k for k in sys.modules if k.startswith(modname + ".") ]:
+            del sys.modules[i]
+
+        module = self.exec_module(modname, filename)
+        self._modules[filename] = (digest, module)
+        return module, False
+
+    def exec_module(self, modname: str, filename: str) -> ModuleType:
+        """Executes the module, using cached code if the source did not change, and registers it in sys.modules."""
+        loader = _CachingLoader(modname, filename, self._code)
+        spec = importlib.util.spec_from_file_location(modname, filename, loader=loader, submodule_search_locations=[])
+        module = importlib.util.module_from_spec(spec)  # type: ignore[arg-type]
+        sys.modules[module.__name__] = module  # Register the module to cache it and to make it work with the inspect module.
+        try:
+            loader.exec_module(module)
+        except BaseException:
+            del sys.modules[module.__name__]
+            raise
+        return module
+
+    @staticmethod
+    def _get_digest(filename: str) -> str:
+        path = Path(filename)
+        files = sorted(path.parent.rglob("*.py")) if path.name == "__init__.py" else [ path ]
+        digest = hashlib.sha256()
+        for i in files:
+            if "__pycache__" not in i.parts:
+                digest.update(str(i).encode())
+                digest.update(i.read_bytes())
+        return digest.hexdigest()
+
+
 def load_source(modname: str, filename: str) -> Any:
-    """Replacement for imp.load_source() for Python 3.12 compatibility. See also https://docs.python.org/3/whatsnew/3.12.html#imp."""
-    loader = importlib.machinery.SourceFileLoader(modname, filename)
-    spec = importlib.util.spec_from_file_location(modname, filename, loader=loader, submodule_search_locations=[])
-    module = importlib.util.module_from_spec(spec)
-    sys.modules[module.__name__] = module  # Register the module to cache it and to make it work with the inspect module.
-    loader.exec_module(module)
-    return module
+    """Replacement for imp.load_source() for Python 3.12 compatibility. See also https://docs.python.org/3/whatsnew/3.12.html#imp.
+
+    The module is always executed. Use ModuleCache to skip unchanged modules.
+    """
+    return ModuleCache().exec_module(modname, filename)
@@ -5,10 +5,45 @@ import textwrap
 import asyncio
 import enum
 import logging
-import shlex
 import re
-from typing import Callable, List, Iterable, Dict, Tuple, Any
+import time
+from collections import OrderedDict
+from typing import Callable, List, Iterable, Dict, Tuple, Any, Optional, Pattern, Union
 from chatbot.api import MessageType, ChatMessage
+from chatbot.util import tracing
+
+# Same characters as shlex uses
+TOKEN_WHITESPACE = " \t\r\n"
+TOKEN_WHITESPACE_PATTERN = re.compile(r"[ \t\r\n]*")
+TOKEN_PLAIN_PATTERN = re.compile(r"[^ \t\r\n'\"\\]+")
+TOKEN_DOUBLE_QUOTED_PATTERN = re.compile(r'[^"\\]+')
+
+
+@dataclass(frozen=True)
+class CommandPredicate:
+    """Cheap conditions a command text must fulfill to be passed to a command-missing-handler.
+
+    The command text is the message text without prefix, e.g. "foo bar?"
+    for "!foo bar?". Empty conditions are ignored.
+
+    Args:
+        suffix: The last argument must end with this string, e.g. "bar?"
+                for "!foo bar?" or "!foo 'bar?'".
+        pattern: A regex that must be found in the command text.
+    """
+    suffix: str = ""
+    pattern: Union[str, Pattern, None] = None
+
+    def __post_init__(self):
+        if isinstance(self.pattern, str):
+            object.__setattr__(self, "pattern", re.compile(self.pattern))
+
+    def matches(self, text: str, last_arg: str) -> bool:
+        if self.suffix and not last_arg.endswith(self.suffix):
+            return False
+        if self.pattern is not None and not self.pattern.search(text):  # type: ignore[union-attr]
+            return False
+        return True
 
 
 @dataclass
@@ -17,6 +52,7 @@ class CommandHandle:
     argc: int
     flags: int
     types: Tuple
+    predicate: Optional[CommandPredicate] = None
 
 
 class CommandFlag(enum.IntFlag):
@@ -38,6 +74,12 @@ class CommandFlag(enum.IntFlag):
     """
     Missing = 8
 
+    """Placeholder for a command that is not loaded yet.
+    The callback receives only the command name and is expected to register
+    the actual command, which is then executed instead.
+    """
+    Deferred = 16
+
 
 class CommandError(Exception):
     def __init__(self, msg="An error occurred", command=""):
@@ -66,34 +108,182 @@ class CommandPermError(CommandError):
         super().__init__("Permission denied", command)
 
 
+class ReplayedMessage(ChatMessage):
+    """Wraps a message to run a different text in the context of that message.
+
+    Used to repeat commands from the command history.
+    """
+
+    def __init__(self, msg: ChatMessage, text: str):
+        self._msg = msg
+        self._text = text
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    @property
+    def author(self):
+        return self._msg.author
+
+    @property
+    def chat(self):
+        return self._msg.chat
+
+    @property
+    def type(self) -> MessageType:
+        return self._msg.type
+
+    @property
+    def is_editable(self) -> bool:
+        return self._msg.is_editable
+
+    async def edit(self, newstr: str) -> None:
+        await self._msg.edit(newstr)
+
+
 class CommandHistory:
-    def __init__(self, max_entries: int):
+    """Stores the recent command texts of each user in each chat.
+
+    Only the command text is stored, not the message object, so that no
+    platform objects are kept alive.
+    Histories of (user, chat) pairs that were not used for `ttl` seconds are
+    removed. If there are more than `max_keys` histories, the least recently
+    used ones are removed.
+    """
+
+    def __init__(self, max_entries: int, max_keys: int = 10000, ttl: float = 24 * 60 * 60):
         self._max_entries = max_entries
-        self._entries: Dict[Tuple[str, str], List[ChatMessage]] = {}
+        self._max_keys = max_keys
+        self._ttl = ttl
+        # Ordered by last use, least recently used first.
+        # Each history is an ordered set of texts, more recent entries last.
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, OrderedDict[str, None]]]" = OrderedDict()
 
     def add(self, msg: ChatMessage):
-        history = self.get_for_message(msg)
-
-        # Remove old entry from history, if it already exists
-        for i, othermsg in enumerate(history):
-            if othermsg.text == msg.text:
-                history.pop(i)
-                break
+        key = (msg.author.id, msg.chat.id)
+        now = time.monotonic()
+        entry = self._entries.pop(key, None)
+        history = entry[1] if entry else OrderedDict()
+        self._entries[key] = (now, history)
 
-        history.append(msg)
+        # Move existing entry to the end or append it
+        history.pop(msg.text, None)
+        history[msg.text] = None
 
         # Remove first element if overflowing
         if len(history) > self._max_entries:
-            history.pop(0)
+            history.popitem(last=False)
+
+        self._evict(now)
 
-    def get_for_message(self, msg: ChatMessage) -> List[ChatMessage]:
+    def get_for_message(self, msg: ChatMessage) -> List[str]:
         """Wrapper around get()."""
         return self.get(msg.author.id, msg.chat.id)
 
-    def get(self, userid: str, chatid: str) -> List[ChatMessage]:
-        """Returns a mutable list of recent commands of a given user in a given chat, with more recent entries last."""
-        # setdefault() returns the existing value at key or creates and returns it
-        return self._entries.setdefault((userid, chatid), [])
+    def get(self, userid: str, chatid: str) -> List[str]:
+        """Returns a list of recent command texts of a given user in a given chat, with more recent entries last."""
+        entry = self._entries.get((userid, chatid), None)
+        if entry is None or time.monotonic() - entry[0] > self._ttl:
+            return []
+        return list(entry[1])
+
+    def __len__(self):
+        """Returns the number of stored (user, chat) histories."""
+        return len(self._entries)
+
+    def _evict(self, now: float) -> None:
+        while self._entries:
+            last_used, _ = next(iter(self._entries.values()))
+            if len(self._entries) <= self._max_keys and now - last_used <= self._ttl:
+                break
+            self._entries.popitem(last=False)
+
+
+class ArgumentTokenizer:
+    """Lazily splits a command string into arguments.
+
+    Produces the same results as shlex.split(), i.e. POSIX shell-like quoting
+    and escaping, but only parses as many arguments as requested.
+    Malformed quoting or escaping raises a ValueError when the affected
+    argument is parsed.
+    """
+
+    def __init__(self, text: str):
+        self._text = text
+        self._pos = 0
+        self._args: List[str] = []
+        self._done = False
+
+    def get(self, num: int = -1) -> List[str]:
+        """Returns a new list containing the first `num` arguments or less if there are not enough.
+
+        If `num` is negative, all arguments are returned.
+        """
+        while (num < 0 or len(self._args) < num) and not self._done:
+            arg = self._next()
+            if arg is None:
+                self._done = True
+            else:
+                self._args.append(arg)
+        return self._args[:num] if num >= 0 else list(self._args)
+
+    def _next(self):
+        text = self._text
+        end = len(text)
+        pos = TOKEN_WHITESPACE_PATTERN.match(text, self._pos).end()
+
+        if pos >= end:
+            self._pos = end
+            return None
+
+        parts: List[str] = []
+
+        while pos < end:
+            c = text[pos]
+
+            if c in TOKEN_WHITESPACE:
+                break
+
+            if c == "'":
+                # No escapes inside single quotes
+                closing = text.find("'", pos + 1)
+                if closing == -1:
+                    raise ValueError("No closing quotation")
+                parts.append(text[pos + 1:closing])
+                pos = closing + 1
+
+            elif c == '"':
+                pos += 1
+                while True:
+                    if m := TOKEN_DOUBLE_QUOTED_PATTERN.match(text, pos):
+                        parts.append(m.group())
+                        pos = m.end()
+                    if pos >= end:
+                        raise ValueError("No closing quotation")
+                    if text[pos] == '"':
+                        pos += 1
+                        break
+                    # Backslash: only quotes and backslashes can be escaped inside double quotes
+                    if pos + 1 >= end:
+                        raise ValueError("No escaped character")
+                    escaped = text[pos + 1]
+                    parts.append(escaped if escaped in '"\\' else "\\" + escaped)
+                    pos += 2
+
+            elif c == "\\":
+                if pos + 1 >= end:
+                    raise ValueError("No escaped character")
+                parts.append(text[pos + 1])
+                pos += 2
+
+            else:
+                m = TOKEN_PLAIN_PATTERN.match(text, pos)
+                parts.append(m.group())
+                pos = m.end()
+
+        self._pos = pos
+        return "".join(parts)
 
 
 def get_argument_as_type(argument: str, type_):
@@ -121,20 +311,30 @@ def get_argument(argv: List[str], index: int, default=None, type=None) -> Any:
 
 
 class CommandHandler:
-    def __init__(self, prefix=("!",), admins=(), history_size: int = 5):
+    def __init__(self, prefix=("!",), admins=(), history_size: int = 5,  # pylint: disable=too-many-positional-arguments
+                 history_max_keys: int = 10000, history_ttl: float = 24 * 60 * 60):
         """CommandHandler constructor.
 
         Args:
             prefix: A collection of command prefixes used to mark messages as commands.
             admins: A collection of user ID strings of administrator users.
             history_size: The command history length for each user in each chat.
+            history_max_keys: Maximum amount of (user, chat) pairs to keep a history for.
+            history_ttl: Time in seconds after which unused histories are removed.
         """
         self._prefix = prefix
+        self._prefix_pattern = re.compile("|".join(re.escape(i) for i in prefix))
+        # First characters of all prefixes (and the repeat command) to reject non-commands without
+        # running a regex. None if there is an empty prefix, i.e. every message could be a command.
+        self._prefix_chars = None if not all(prefix) else frozenset(i[0] for i in prefix) | { "!" }
         self._repeat_cmd_pattern = re.compile(r"!!-?([0-9]+)?")
         self._admins = admins
-        self._history = CommandHistory(history_size)
+        self._history = CommandHistory(history_size, history_max_keys, history_ttl)
         self._cmds: Dict[str, CommandHandle] = {}
         self._missing_cmds: Dict[str, CommandHandle] = {}
+        # Missing-handlers indexed by the last character of their suffix predicate, "" for
+        # handlers without suffix. Rebuilt lazily when handlers change.
+        self._missing_index: Optional[Dict[str, Tuple[CommandHandle, ...]]] = None
         self.register("help", self._help, argc=0)
         self.register("list", self._list, argc=0)
         self.register("history", self._list_history, argc=0)
@@ -144,7 +344,8 @@ class CommandHandler:
     def admins(self) -> Iterable[str]:
         return self._admins
 
-    def register(self, name: str, callback: Callable, argc=1, flags=0, types=()):  # pylint: disable=too-many-positional-arguments
+    def register(self, name: str, callback: Callable, argc=1, flags=0, types=(),  # pylint: disable=too-many-positional-arguments
+                 predicate: CommandPredicate = None):
         """Register a chat command.
 
         Args:
@@ -156,6 +357,9 @@ class CommandHandler:
                   If there are less, a CommandArgcError is raised.
             flags: A list of flags or'ed together. See also `CommandFlag`.
             types: A tuple of types to automatically cast arguments to or error.
+            predicate: Only for command-missing-handlers. Conditions that
+                       must be fulfilled for the handler to be called.
+                       See `CommandPredicate`.
 
         The callback must have one of the following signatures
         (return values are ignored):
@@ -185,6 +389,9 @@ class CommandHandler:
 
         Throwing CommandNotFoundError or CommandArgcError inside a
         command-missing-handler will skip this handler and jump to the next one.
+        Command-missing-handlers are skipped without being called if there
+        are not enough arguments or if their predicate does not match. This is
+        faster than raising exceptions.
 
         When a CommandError was raised inside the command callback, it will
         be catched by the CommandHandler, edited to include the command's
@@ -194,9 +401,10 @@ class CommandHandler:
         assert asyncio.iscoroutinefunction(callback), "Callback must be a coroutine"
         group = self._missing_cmds if flags & CommandFlag.Missing else self._cmds
         name = name.lower()
-        if name in group:
+        if name in group and not group[name].flags & CommandFlag.Deferred:
             logging.warning("Overwriting existing command: %s", name)
-        group[name] = CommandHandle(callback, argc, flags, types)
+        group[name] = CommandHandle(callback, argc, flags, types, predicate)
+        self._missing_index = None
         logging.debug("Registered command: %s", name)
 
     def unregister(self, name):
@@ -209,6 +417,7 @@ class CommandHandler:
             except KeyError:
                 logging.warning("Trying to unregister non-existing command: %s", name)
                 return
+        self._missing_index = None
         logging.debug("Unregistered command: %s", name)
 
     def clear(self):
@@ -216,6 +425,7 @@ class CommandHandler:
         logging.debug("Clearning all commands")
         self._cmds.clear()
         self._missing_cmds.clear()
+        self._missing_index = None
         self.register("help", self._help, argc=0)
         self.register("list", self._list, argc=0)
 
@@ -230,57 +440,107 @@ class CommandHandler:
 
         text = msg.text.strip()
 
+        if self._prefix_chars is not None and (not text or text[0] not in self._prefix_chars):
+            return False
+
         if self._repeat_cmd_pattern and (m := self._repeat_cmd_pattern.match(text)):
             history = self._history.get_for_message(msg)
             if not history:
                 raise CommandError("No previous commands", command=text)
 
             num = max(1, min(int(m.group(1)), len(history))) if m.group(1) else 1
-            await self.execute(history[-num])
+            await self.execute(ReplayedMessage(msg, history[-num]))
             return True
 
-        argv: List[str] = []
+        cmdtext = self._strip_prefix(text)
 
-        # Check if the message is a command and fill argv with its arguments.
-        for i in self._prefix:
-            if text.startswith(i):
-                # Abort if the command is another prefix
-                if not text[len(i):].strip().startswith(i.strip()):
-                    argv = shlex.split(text[len(i):])
-                break
+        if not cmdtext:
+            return False
 
-        if not argv:
+        tokens = ArgumentTokenizer(cmdtext)
+        args = tokens.get(1)
+
+        if not args:
             return False
 
-        argv[0] = argv[0].lower()  # Case-insensitive command matching
+        name = args[0].lower()  # Case-insensitive command matching
         self._history.add(msg)  # It is a command, so add to history
 
-        if command := self._cmds.get(argv[0], None):
+        command = self._cmds.get(name, None)
+        if command and command.flags & CommandFlag.Deferred:
+            command = await self._load_deferred(name, command)
+
+        if command:
             try:
-                await self._exec_command(msg, command, argv)
+                await self._exec_command(msg, command, name, tokens)
                 return True
             except CommandNotFoundError:
                 pass
             except CommandError as e:
-                e.command = argv[0]
+                e.command = name
                 raise
 
         # Missing handlers
-        # It's important to make a copy of the list to avoid
-        # "dictionary changed size while iterating" errors
-        for i in list(self._missing_cmds.values()):
+        for i in self._get_missing_candidates(cmdtext, tokens):
+            if len(tokens.get(i.argc + 1)) <= i.argc:
+                continue
             try:
-                await self._exec_command(msg, i, argv)
+                await self._exec_command(msg, i, name, tokens)
                 return True
             except (CommandNotFoundError, CommandArgcError):
                 pass
             except CommandError as e:
-                e.command = argv[0]
+                e.command = name
                 raise
 
-        raise CommandNotFoundError(command=argv[0])
+        raise CommandNotFoundError(command=name)
+
+    async def _load_deferred(self, name: str, placeholder: CommandHandle) -> Optional[CommandHandle]:
+        """Loads a deferred command and returns the actual command or None if it was not registered."""
+        await placeholder.callback(name)
+        cmd = self._cmds.get(name, None)
+        if cmd and cmd.flags & CommandFlag.Deferred:
+            logging.warning("Deferred command was not registered after loading: %s", name)
+            return None
+        return cmd
+
+    def _get_missing_candidates(self, cmdtext: str, tokens: ArgumentTokenizer) -> Iterable[CommandHandle]:
+        """Returns the missing-handlers whose predicate matches the command text."""
+        if not self._missing_cmds:
+            return ()
+
+        # Unless it is quoted, the last argument ends like the command text, so parsing is not needed
+        last_arg = cmdtext
+        if cmdtext[-1:] in "'\"":
+            try:
+                last_arg = tokens.get()[-1]
+            except ValueError:
+                pass
+
+        if self._missing_index is None:
+            index: Dict[str, List[CommandHandle]] = {}
+            for i in self._missing_cmds.values():
+                index.setdefault(i.predicate.suffix[-1:] if i.predicate else "", []).append(i)
+            # Tuples are snapshots, so handlers can be (un)registered while iterating
+            self._missing_index = { k: tuple(v) for k, v in index.items() }
+
+        candidates = self._missing_index.get(last_arg[-1:], ()) + self._missing_index.get("", ())
+        return ( i for i in candidates if i.predicate is None or i.predicate.matches(cmdtext, last_arg) )
 
-    async def _exec_command(self, msg: ChatMessage, cmd: CommandHandle, argv: List[str]):
+    def _strip_prefix(self, text: str) -> Optional[str]:
+        """Returns the text following the command prefix or None if the text is not a command."""
+        m = self._prefix_pattern.match(text)
+        if not m:
+            return None
+
+        cmdtext = text[m.end():]
+
+        # Abort if the command is another prefix
+        if cmdtext.strip().startswith(m.group().strip()):
+            return None
+        return cmdtext
+
+    async def _exec_command(self, msg: ChatMessage, cmd: CommandHandle, name: str, tokens: ArgumentTokenizer):
         if not cmd:
             raise CommandNotFoundError
 
@@ -288,6 +548,14 @@ class CommandHandler:
             if msg.author.id not in self._admins:
                 raise CommandPermError
 
+        # Expanded callbacks only receive the first `argc` arguments, hence there is no need to
+        # parse the remaining ones, except for type checking.
+        if cmd.flags & CommandFlag.Expand:
+            argv = tokens.get(max(cmd.argc, len(cmd.types)) + 1)
+        else:
+            argv = tokens.get()
+        argv[0] = name
+
         if len(argv) <= cmd.argc:
             raise CommandArgcError
 
@@ -295,10 +563,14 @@ class CommandHandler:
             for i, (arg, t) in enumerate(zip(argv[1:], cmd.types), 1):
                 argv[i] = get_argument_as_type(arg, t)
 
-        if cmd.flags & CommandFlag.Expand:
-            await cmd.callback(msg, *argv[1:cmd.argc + 1])
-        else:
-            await cmd.callback(msg, argv)
+        # Separates matching and parsing the command from running the handler.
+        # Commands rejected above, e.g. missing-handler candidates, don't mark.
+        tracing.mark("command_match")
+        with tracing.span("command " + name):
+            if cmd.flags & CommandFlag.Expand:
+                await cmd.callback(msg, *argv[1:cmd.argc + 1])
+            else:
+                await cmd.callback(msg, argv)
 
     # Commands
     async def _help(self, msg: ChatMessage, argv: List[str]):
@@ -319,6 +591,8 @@ class CommandHandler:
         """
         helpcmd = argv[0] if len(argv) == 1 else argv[1]
         cmd = self._cmds.get(helpcmd, None)
+        if cmd and cmd.flags & CommandFlag.Deferred:
+            cmd = await self._load_deferred(helpcmd, cmd)
 
         if not cmd:
             # Use CommandError rather than CommandNotFoundError to avoid
@@ -354,7 +628,7 @@ class CommandHandler:
             await msg.reply("No previous commands")
         else:
             await msg.reply("\n".join(
-                [ "{}) {}".format(i, msg.text) for i, msg in enumerate(history[::-1], 1) ]
+                [ "{}) {}".format(i, text) for i, text in enumerate(history[::-1], 1) ]
             ))
 
     async def _echo(self, msg: ChatMessage, argv: List[str]):
@@ -1,16 +1,197 @@
 # -*- coding: utf-8 -*-
 
-from typing import Dict, Callable
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Coroutine, Deque, Dict, Callable, Hashable, Optional, Tuple
 from functools import partial
-from chatbot.util.event import Event
+from chatbot.api import OverflowPolicy
+from chatbot.util import tracing
+from chatbot.util.event import Event, HandlerStats, StatsRecorder
 
 ExceptionCallback = Callable[[str, Exception], bool]
+LaneKeyCallback = Callable[..., Hashable]
+
+DROP_LOG_INTERVAL = 10.0  # Seconds
+
+
+@dataclass
+class _Lane:
+    queue: Deque[Tuple[Coroutine, contextvars.Context]] = field(default_factory=deque)
+    # Callers waiting for room in the queue, see OverflowPolicy.Block
+    waiters: Deque[Tuple[asyncio.Future, Coroutine, contextvars.Context]] = field(default_factory=deque)
+
+    def pop(self) -> Tuple[Coroutine, contextvars.Context]:
+        """Remove the next queued coroutine and move the first waiting one into the queue."""
+        item = self.queue.popleft()
+        while self.waiters:
+            waiter, coro, context = self.waiters.popleft()
+            if not waiter.done():
+                self.queue.append((coro, context))
+                waiter.set_result(None)
+                break
+        return item
+
+    def clear(self) -> int:
+        """Close all queued and waiting coroutines and return their number."""
+        count = len(self.queue)
+        for coro, _ in self.queue:
+            coro.close()
+        for waiter, coro, _ in self.waiters:
+            if not waiter.done():
+                coro.close()
+                waiter.set_result(None)
+                count += 1
+        self.queue.clear()
+        self.waiters.clear()
+        return count
+
+
+class ExecutionLanes:
+    """Runs coroutines in keyed lanes.
+
+    Coroutines sharing the same key run strictly in the order they were
+    passed to run(). Coroutines with different keys run concurrently, limited
+    by a global worker cap.
+
+    The caller that finds a lane idle runs its coroutine and afterwards all
+    coroutines queued in the meantime. Other callers only queue their
+    coroutine and return immediately, so they don't occupy an event task,
+    i.e. a scheduler slot, while waiting for their turn. Queued coroutines
+    run in the context they were queued from.
+    Each lane queues at most `max_queue_size` coroutines, the
+    `OverflowPolicy` determines what happens to further ones. With
+    `OverflowPolicy.Block` the caller waits for room in the lane, keeping
+    its scheduler slot, so the back-pressure reaches the scheduler.
+    Lanes are created on demand and removed when they become idle.
+    """
+
+    def __init__(self, max_workers: int = 0, max_queue_size: int = 0,
+                 overflow_policy: OverflowPolicy = OverflowPolicy.Block):
+        """Constructor.
+
+        `max_workers` is the maximum number of lanes running at the same time.
+        `max_queue_size` is the maximum number of coroutines waiting in a
+        single lane.
+        A value <= 0 means unlimited.
+        """
+        self.max_queue_size = max_queue_size
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        self.dropped = 0
+        self._lanes: Dict[Hashable, _Lane] = {}
+        self._workers: Optional[asyncio.Semaphore] = asyncio.Semaphore(max_workers) if max_workers > 0 else None
+        self._unlogged_drops = 0
+        self._last_drop_log = float("-inf")
+
+    def __len__(self):
+        """Returns the number of active lanes."""
+        return len(self._lanes)
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of coroutines waiting in all lanes."""
+        return sum(len(i.queue) for i in self._lanes.values())
+
+    async def run(self, key: Hashable, coro: Coroutine) -> bool:
+        """Run `coro` after all coroutines previously passed with the same key.
+
+        Returns True if the lane was idle and `coro` and all coroutines
+        queued meanwhile were run, or False if `coro` was only queued or
+        discarded.
+        Exceptions raised by `coro` are re-raised, those of queued coroutines
+        are logged. If cancelled, queued coroutines are discarded and logged.
+        """
+        lane = self._lanes.get(key, None)
+        if lane is not None:
+            tracing.mark("lane queued")
+            if not 0 < self.max_queue_size <= len(lane.queue):
+                lane.queue.append((coro, contextvars.copy_context()))
+            elif self.overflow_policy == OverflowPolicy.DropOldest:
+                self._drop(lane.queue.popleft()[0])
+                lane.queue.append((coro, contextvars.copy_context()))
+            elif self.overflow_policy == OverflowPolicy.DropNewest:
+                self._drop(coro)
+            else:
+                # Moved to the queue by the lane once there is room, see _Lane.pop()
+                waiter = asyncio.get_running_loop().create_future()
+                lane.waiters.append((waiter, coro, contextvars.copy_context()))
+                try:
+                    await waiter
+                except asyncio.CancelledError:
+                    if waiter.cancelled():
+                        coro.close()
+                    raise
+            return False
+
+        lane = self._lanes[key] = _Lane()
+        try:
+            await self._run_one(coro)
+        except asyncio.CancelledError:
+            self._discard(key)
+            raise
+        except Exception:
+            await self._drain(key)
+            raise
+
+        await self._drain(key)
+        return True
+
+    async def _run_one(self, coro: Coroutine) -> None:
+        try:
+            if self._workers is None:
+                await coro
+            else:
+                async with self._workers:
+                    await coro
+        finally:
+            coro.close()  # Does nothing if it already finished
+
+    async def _drain(self, key: Hashable) -> None:
+        lane = self._lanes[key]
+        while lane.queue:
+            coro, context = lane.pop()
+            task = context.run(asyncio.create_task, self._run_one(coro))
+            try:
+                await asyncio.wait((task,))
+            except asyncio.CancelledError:
+                task.cancel()
+                self._discard(key)
+                raise
+
+            if not task.cancelled() and (exc := task.exception()):
+                logging.error("Exception in execution lane")
+                logging.exception(exc, exc_info=exc)
+
+        del self._lanes[key]
+
+    def _discard(self, key: Hashable) -> None:
+        discarded = self._lanes.pop(key).clear()
+        if discarded:
+            logging.warning("Execution lane cancelled -> discarded %s queued events", discarded)
+            self.dropped += discarded
+
+    def _drop(self, coro: Coroutine) -> None:
+        self.dropped += 1
+        coro.close()
+
+        # Log at most once per interval, overload tends to drop many events
+        self._unlogged_drops += 1
+        now = time.monotonic()
+        if now - self._last_drop_log >= DROP_LOG_INTERVAL:
+            logging.warning("Execution lane full (%s events) -> dropped %s event(s)",
+                            self.max_queue_size, self._unlogged_drops)
+            self._unlogged_drops = 0
+            self._last_drop_log = now
 
 
 class APIEventDispatcher:
     """Provides a dispatch system to allow multiple handlers per API event."""
 
-    def __init__(self, apiobj, exc_handler: ExceptionCallback = None):
+    def __init__(self, apiobj, exc_handler: ExceptionCallback = None, max_lane_workers: int = 0,  # pylint: disable=too-many-positional-arguments
+                 max_lane_queue_size: int = 0, lane_overflow_policy: OverflowPolicy = OverflowPolicy.Block):
         """Constructor
 
         `apiobj` is an API objects instance.
@@ -22,12 +203,20 @@ class APIEventDispatcher:
         or re-raise it: True -> caught, False -> re-raise.
         If exception_handler is None, exceptions will be re-raised
         immediately.
+        `max_lane_workers` limits how many execution lanes may run at the
+        same time. `max_lane_queue_size` and `lane_overflow_policy` limit how
+        many events may wait in a single lane. See set_lane_key() and
+        ExecutionLanes.
         """
         self._events: Dict[str, Event] = {}
         self._api = apiobj
         self._exc_handler = exc_handler
+        self._lanes = ExecutionLanes(max_lane_workers, max_lane_queue_size, lane_overflow_policy)
+        self._lane_keys: Dict[str, LaneKeyCallback] = {}
+        self._concurrent: Dict[str, Optional[float]] = {}  # Event -> handler timeout
+        self._stats_recorder: Optional[StatsRecorder] = None
 
-    def register(self, event, callback, nice=0):
+    def register(self, event, callback, nice=0, label=""):
         """Register an event handler and return a Handle to it.
 
         See util.event.Event.register for further information.
@@ -35,7 +224,7 @@ class APIEventDispatcher:
         ev = self._events.get(event, None)
         if ev is None:
             ev = self._setup_dispatch(event)
-        return ev.register(callback, nice)
+        return ev.register(callback, nice, label)
 
     @staticmethod
     def unregister(handle):
@@ -46,6 +235,76 @@ class APIEventDispatcher:
         """
         handle.unregister()
 
+    @property
+    def lanes(self) -> ExecutionLanes:
+        """The execution lanes, e.g. to inspect queue_depth and dropped events."""
+        return self._lanes
+
+    def set_lane_key(self, event: str, key_callback: Optional[LaneKeyCallback]) -> None:
+        """Dispatch the given event in keyed execution lanes.
+
+        `key_callback` receives the event arguments and returns a hashable
+        key, e.g. `lambda msg: msg.chat.id` for APIEvents.Message.
+        Events with the same key are dispatched strictly in order, i.e. an
+        event is dispatched after the previous one with the same key has been
+        handled completely. Events with different keys are dispatched
+        concurrently.
+        Pass None to dispatch events independently again (default).
+        """
+        if key_callback is None:
+            self._lane_keys.pop(event, None)
+        else:
+            self._lane_keys[event] = key_callback
+
+    def set_concurrent(self, event: str, concurrent: bool = True, handler_timeout: Optional[float] = None) -> None:
+        """Dispatch the given event concurrently.
+
+        All handlers are called, regardless of return values. Handlers with
+        the same priority run concurrently, see
+        util.event.Event.trigger_all_concurrent().
+        `handler_timeout` is the maximum time in seconds a single handler may
+        run, or None for no limit.
+        """
+        if concurrent:
+            self._concurrent[event] = handler_timeout
+        else:
+            self._concurrent.pop(event, None)
+
+        if ev := self._events.get(event, None):
+            ev.set_handler_timeout(handler_timeout if concurrent else None)
+
+    def enable_stats(self, enable: bool = True, slow_threshold: float = 0.0) -> None:
+        """Enable or disable recording timing statistics for every event handler.
+
+        Handlers taking longer than `slow_threshold` seconds are logged.
+        A threshold <= 0 disables logging.
+        Disabling discards existing statistics.
+        """
+        if not enable:
+            self._stats_recorder = None
+        elif self._stats_recorder is None:
+            self._stats_recorder = StatsRecorder(slow_threshold)
+        else:
+            self._stats_recorder.slow_threshold = slow_threshold
+
+        for name, ev in self._events.items():
+            ev.set_stats_recorder(self._stats_recorder, name)
+
+    @property
+    def stats_enabled(self) -> bool:
+        return self._stats_recorder is not None
+
+    def get_stats(self) -> Dict[Tuple[str, str], HandlerStats]:
+        """Returns a dict mapping (event, handle label) to HandlerStats.
+
+        Returns an empty dict if statistics are disabled. See enable_stats().
+        """
+        return self._stats_recorder.get_stats() if self._stats_recorder else {}
+
+    def reset_stats(self) -> None:
+        if self._stats_recorder:
+            self._stats_recorder.reset()
+
     def clear(self):
         for i in self._events:
             self._api.unregister_event_handler(i)
@@ -56,6 +315,8 @@ class APIEventDispatcher:
         self._api.register_event_handler(event, partial(self._dispatch_event, event))
         ev = self._events[event] = Event()
         ev.set_exception_handler(lambda e: self._handle_exc(event, e))
+        ev.set_handler_timeout(self._concurrent.get(event, None))
+        ev.set_stats_recorder(self._stats_recorder, event)
         return ev
 
     def _handle_exc(self, event: str, e: Exception) -> bool:
@@ -70,7 +331,12 @@ class APIEventDispatcher:
             return
 
         if len(ev) > 0:
-            await ev.trigger(*args, **kwargs)
+            trigger = ev.trigger_all_concurrent if event in self._concurrent else ev.trigger
+
+            if key_callback := self._lane_keys.get(event, None):
+                await self._lanes.run(key_callback(*args, **kwargs), self._trigger(event, trigger, *args, **kwargs))
+            else:
+                await self._trigger(event, trigger, *args, **kwargs)
         else:
             # Unregister if there are no callbacks left, so that debug stub
             # messages on unhandled events still come through.
@@ -83,3 +349,11 @@ class APIEventDispatcher:
             self._api.unregister_event_handler(event)
             # Trigger without anything registered (as it should have been)
             self._api._trigger(event, *args, **kwargs)
+
+    @staticmethod
+    async def _trigger(event, trigger, *args, **kwargs):
+        try:
+            with tracing.span("dispatch " + event):
+                await trigger(*args, **kwargs)
+        finally:
+            tracing.finish_trace(event)
@@ -1,4 +1,10 @@
 from .utils import *
-from . import event, testing, config, async_timer
+from . import event, testing, config, async_timer, tracing, http_client, http_cache, worker_pool, eval_pool
+from .http_client import HTTPClient, HTTPResponse
+from .http_cache import HTTPCache
+from .singleflight import SingleFlight
+from .worker_pool import WorkerPool, WorkerPools
+from .eval_pool import EvalPool
 from .Notifier import Notifier
-from .storage import Storage, StorageScope
+from .storage import Storage, StorageScope, StorageBackend, ConfigBackend, JournalBackend
+from .sqlite_storage import SQLiteStorage, SQLiteStorageScope, migrate_json_file
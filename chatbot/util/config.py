@@ -1,16 +1,74 @@
 # -*- coding: utf-8 -*-
 
 import os
+import asyncio
+import contextlib
 import errno
 import json
 import logging
-from typing import Dict, Any
-from chatbot.util import merge_dicts
+import tempfile
+from typing import Callable, Dict, Any, List, Optional, Set, Tuple
+from chatbot.util import merge_dicts, run_in_thread
 
 JsonDict = Dict[str, Any]
 
 
-class Config:
+def write_file_atomic(filename: str, text: str) -> None:
+    """Write text to a file atomically, creating missing directories as necessary.
+
+    The text is written to a temporary file in the same directory, flushed
+    to disk, and then renamed to `filename`. Hence, the file contains either
+    the old or the new content, even if the process crashes while writing.
+    """
+    dirname = os.path.dirname(filename)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+
+    fd, tmpname = tempfile.mkstemp(dir=dirname or ".", prefix=os.path.basename(filename) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+
+        try:
+            os.chmod(tmpname, os.stat(filename).st_mode)
+        except FileNotFoundError:
+            os.chmod(tmpname, 0o644)
+
+        os.replace(tmpname, filename)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmpname)
+        raise
+
+
+class Flushable:
+    """Interface of objects that can be written by a WriteBehindFlusher."""
+
+    @property
+    def filename(self) -> str:
+        """Identifies the object in the flusher."""
+        raise NotImplementedError
+
+    def prepare_write(self) -> Callable[[], None]:
+        """Returns a function that writes the current state, e.g. a serialized copy.
+
+        Called in the event loop, the returned function is called in a
+        background thread.
+        """
+        raise NotImplementedError
+
+    def finish_write(self) -> None:
+        """Called in the event loop after the function returned by prepare_write() succeeded."""
+
+    def write_now(self) -> None:
+        """Write immediately and synchronously."""
+        self.prepare_write()()
+        self.finish_write()
+
+
+class Config(Flushable):
     """Provides functionality for loading, saving, and accessing json configs.
 
     Does not load or create any files automatically, unless explicitly
@@ -19,9 +77,15 @@ class Config:
     Implements __len__, __setitem__, __getitem__, and __delitem__ to provide
     a simple wrapping around `dict`, e.g. Config["key"] = 4 .
     Use `Config.data` to access the json dict directly.
+
+    If a WriteBehindFlusher is set, write() only marks the config as dirty
+    and the flusher writes it in the background. See set_flusher().
     """
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, flusher: Optional["WriteBehindFlusher"] = None):
         self._filename: str = filename
+        self._flusher = flusher
+        self._loaded = False
+        self._mtime: Optional[int] = None  # mtime of the file after the last load or write
         self.data: JsonDict = {}
 
     @property
@@ -29,10 +93,36 @@ class Config:
         """The config filename."""
         return self._filename
 
+    @property
+    def flusher(self) -> Optional["WriteBehindFlusher"]:
+        return self._flusher
+
+    def set_flusher(self, flusher: Optional["WriteBehindFlusher"]) -> None:
+        """Set a WriteBehindFlusher to defer writes or None to write immediately.
+
+        Pending writes to the previous flusher are moved to the new one or
+        written immediately.
+        """
+        if self._flusher is not None and self._flusher.discard_pending(self):
+            if flusher is None or not flusher.mark_dirty(self):
+                self.write_now()
+        self._flusher = flusher
+
+    def discard_pending(self) -> bool:
+        """Discard a deferred write, e.g. to load changes made by someone else instead.
+
+        Returns True if there was a deferred write.
+        """
+        return self._flusher is not None and self._flusher.discard_pending(self)
+
     def exists(self) -> bool:
         """Returns whether the config file exists."""
         return os.path.exists(self.filename)
 
+    def is_modified_on_disk(self) -> bool:
+        """Returns whether the file was modified by someone else since it was last loaded or written."""
+        return self._get_file_mtime() != self._mtime
+
     def load(self, default: JsonDict = None, validate=True, write=False, create=False) -> "Config":
         """(Re-)Load the config file and returns itself.
 
@@ -44,28 +134,49 @@ class Config:
                with the loaded config (validated/default).
                Creates missing directories as necessary.
         create: Same as `write` but only if the file didn't exist before.
+
+        If the file can't be parsed and was loaded before, an error is
+        logged and the current data is kept.
+        If a deferred write is pending or running, the data in memory is
+        newer than the file and kept as well. Use discard_pending() before to
+        load the file anyway.
         """
+        if self._flusher is not None and self._flusher.is_pending(self):
+            logging.debug("Pending write, keeping the current config: %s", self.filename)
+            return self._apply_load_options(default, validate, write, create)
+
         logging.debug("Loading json file: %s", self.filename)
-        self.data = {}
+        mtime = self._get_file_mtime()
         try:
             with open(self.filename) as f:
-                self.data = json.load(f)
+                data = json.load(f)
         except IOError as e:
-            if e.errno == errno.ENOENT:  # file not found
-                validate = True  # Use default
-                logging.debug("File not found -> using default")
-            else:
+            if e.errno != errno.ENOENT:  # file not found
+                raise
+            data = {}
+            validate = True  # Use default
+            logging.debug("File not found -> using default")
+        except ValueError as e:
+            # E.g. a half-edited file, keep using the previous config
+            if not self._loaded:
                 raise
+            logging.error("Failed to parse json file, keeping the current config: %s: %s", self.filename, e)
+            return self
 
-        if validate and default:
-            merge_dicts(self.data, default)
+        self.data = data
+        self._mtime = mtime
+        self._loaded = True
+        return self._apply_load_options(default, validate, write, create)
 
-        if write:
-            self.write()
-        elif create:
-            self.create()
+    def reload(self, default: JsonDict = None, validate=True, write=False, create=False) -> "Config":
+        """Same as load() but only reads the file if it was not loaded yet or if it was modified on disk.
 
-        return self
+        Otherwise, the data in memory is kept and only validated against
+        `default`.
+        """
+        if not self._loaded or self.is_modified_on_disk():
+            return self.load(default, validate, write, create)
+        return self._apply_load_options(default, validate, write, create)
 
     def create(self):
         """Write config only if the file does not yet exist, creating missing directories as necessary."""
@@ -73,15 +184,47 @@ class Config:
             self.write()
 
     def write(self):
-        """Write config to a file, creating missing directories as necessary."""
-        logging.debug("Writing json file: %s", self.filename)
+        """Write config to a file, creating missing directories as necessary.
+
+        If a flusher is set and an event loop is running, the write is
+        deferred and coalesced with other writes. Otherwise, see write_now().
+        """
+        if self._flusher is not None and self._flusher.mark_dirty(self):
+            return
+        self.write_now()
+
+    def prepare_write(self) -> Callable[[], None]:
+        text = self.serialize()
+        filename = self.filename
+
+        def write():
+            logging.debug("Writing json file: %s", filename)
+            write_file_atomic(filename, text)
+        return write
+
+    def finish_write(self) -> None:
+        self._mtime = self._get_file_mtime()
 
-        dirname = os.path.dirname(self.filename)
-        if dirname:
-            os.makedirs(dirname, exist_ok=True)
+    def serialize(self) -> str:
+        """Returns the config as json string, as it is written to the file."""
+        return json.dumps(self.data, indent=4)
 
-        with open(self.filename, "w") as f:
-            json.dump(self.data, f, indent=4)
+    def _apply_load_options(self, default: Optional[JsonDict], validate: bool, write: bool, create: bool) -> "Config":
+        if validate and default:
+            merge_dicts(self.data, default)
+
+        if write:
+            self.write()
+        elif create:
+            self.create()
+
+        return self
+
+    def _get_file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.filename).st_mtime_ns
+        except FileNotFoundError:
+            return None
 
     def __contains__(self, item: str) -> bool:
         return item in self.data
@@ -99,6 +242,148 @@ class Config:
         del self.data[key]
 
 
+class WriteBehindFlusher:
+    """Defers and coalesces config writes.
+
+    Configs passed to mark_dirty() are written after `delay` seconds in a
+    background thread. All writes to a config within this window result in
+    a single file write. Files are written atomically, see
+    write_file_atomic().
+
+    The configs are serialized in the event loop, so they can be modified
+    safely while the files are written. Call close() or flush() on shutdown
+    to write pending changes.
+
+    Besides configs, any Flushable can be written, e.g. storage backends.
+    """
+
+    def __init__(self, delay: float = 1.0):
+        self.delay = delay
+        self.writes = 0  # Number of files written
+        self._dirty: Dict[str, Flushable] = {}
+        self._writing: Set[str] = set()  # Files currently written by the background thread
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def pending(self) -> int:
+        """Number of configs waiting to be written."""
+        return len(self._dirty)
+
+    def mark_dirty(self, cfg: Flushable) -> bool:
+        """Schedule a config to be written.
+
+        Returns False if no event loop is running. In this case the config
+        must be written synchronously by the caller.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+
+        self._dirty[cfg.filename] = cfg
+        if self._task is None:
+            self._task = loop.create_task(self._flush_later())
+        return True
+
+    def is_pending(self, cfg: Flushable) -> bool:
+        """Returns whether the config is waiting to be written or currently written."""
+        return self._dirty.get(cfg.filename, None) is cfg or cfg.filename in self._writing
+
+    async def write_pending(self, cfg: Flushable) -> None:
+        """Write the config now if it is waiting to be written.
+
+        If the file is currently written in the background, waits until the
+        write finished, so the older data can't overwrite the newer one.
+        """
+        if not self.is_pending(cfg):
+            return
+
+        async with self._get_lock():
+            if self._dirty.get(cfg.filename, None) is cfg:
+                await self._write({ cfg.filename: self._dirty.pop(cfg.filename) })
+
+    def discard_pending(self, cfg: Flushable) -> bool:
+        """Remove the config from the configs waiting to be written. Returns True if it was waiting."""
+        if self._dirty.get(cfg.filename, None) is cfg:
+            del self._dirty[cfg.filename]
+            return True
+        return False
+
+    async def flush(self) -> None:
+        """Write all pending configs now."""
+        # Ensure files are written in order if flush() is called while a flush is running
+        async with self._get_lock():
+            if self._dirty:
+                configs = self._dirty
+                self._dirty = {}
+                await self._write(configs)
+
+    async def close(self) -> None:
+        """Stop the background flusher and write all pending configs."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _flush_later(self) -> None:
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self._task = None
+
+        # Nobody awaits this task
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.exception(e)
+
+    def _get_lock(self) -> asyncio.Lock:
+        # Created lazily, so the flusher can be created without a running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _write(self, configs: Dict[str, Flushable]) -> None:
+        """Write the given configs in a background thread. The lock must be held."""
+        jobs = []
+        for filename, cfg in configs.items():
+            try:
+                jobs.append((filename, cfg.prepare_write()))
+            except Exception as e:
+                # Keep it dirty, it might be serializable next time
+                logging.error("Failed to serialize %s: %s", filename, e)
+                self._dirty.setdefault(filename, cfg)
+
+        self._writing.update(filename for filename, _ in jobs)
+        try:
+            failed = await run_in_thread(self._write_files, jobs)
+        finally:
+            self._writing.clear()
+        self.writes += len(jobs) - len(failed)
+
+        for filename, _ in jobs:
+            if filename not in failed:
+                configs[filename].finish_write()
+
+        # Keep failed configs dirty, so the next flush can retry
+        for filename in failed:
+            logging.error("Failed to write %s", filename)
+            self._dirty.setdefault(filename, configs[filename])
+
+    @staticmethod
+    def _write_files(jobs: List[Tuple[str, Callable[[], None]]]) -> List[str]:
+        """Runs the given (filename, write function) pairs and returns the filenames that failed."""
+        failed = []
+        for filename, write in jobs:
+            try:
+                write()
+            except Exception as e:
+                logging.exception(e)
+                failed.append(filename)
+        return failed
+
+
 class ConfigManager:
     """Provides functionality for loading and saving configs as json.
 
@@ -106,8 +391,9 @@ class ConfigManager:
     retrieve configs from a specific searchpath.
     """
 
-    def __init__(self, searchpath: str):
+    def __init__(self, searchpath: str, flusher: Optional[WriteBehindFlusher] = None):
         self._searchpath = "."
+        self.flusher = flusher
         self.set_searchpath(searchpath)
 
     def set_searchpath(self, searchpath: str):
@@ -127,4 +413,4 @@ class ConfigManager:
         Only returns the object, but does not load it.
         `basename` is not a path but the base-filename, optionally with .json extension.
         """
-        return Config(self.get_file(basename if basename.endswith(".json") else basename + ".json"))
+        return Config(self.get_file(basename if basename.endswith(".json") else basename + ".json"), self.flusher)
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import math
+import multiprocessing
+import signal
+from collections import OrderedDict
+from multiprocessing.connection import Connection
+from typing import List, Optional
+from .singleflight import SingleFlight
+
+MAX_RESULT_LENGTH = 256
+TIMEOUT_RESULT = "Expression took too long to evaluate."
+
+
+def evaluate_math(expr: str) -> str:
+    """Evaluates a Python expression with access to the math module only and returns the result or error as string."""
+    names = { k: v for k, v in math.__dict__.items() if not k.startswith("_") }
+    try:
+        result = str(eval(expr, { "__builtins__": None }, names))  # pylint: disable=eval-used
+    except Exception as e:
+        result = "Error: " + str(e)
+    return result[:MAX_RESULT_LENGTH]
+
+
+def _worker_main(conn: Connection, parent_conn: Connection) -> None:
+    # The parent's end is inherited when forking, close it to notice when the parent exits
+    parent_conn.close()
+    # Ctrl+C is handled by the bot
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    while True:
+        try:
+            expr = conn.recv()
+        except (EOFError, OSError):
+            break
+        conn.send(evaluate_math(expr))
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, self.conn), name="eval-worker", daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class EvalPool:
+    """A pool of pre-forked processes evaluating math expressions, see evaluate_math().
+
+    Expressions are sent to idle workers over a pipe. A worker that takes
+    longer than `timeout` seconds is killed and replaced, and the result is
+    TIMEOUT_RESULT. Results and errors are memoized in an LRU cache of
+    `cache_size` entries. Timeouts are not, as they may be caused by load.
+
+    Workers are started by start() and killed by close(). The event loop
+    must support add_reader(), i.e. not the Windows ProactorEventLoop.
+    """
+
+    def __init__(self, workers: int = 2, timeout: float = 3.0, cache_size: int = 256):
+        self.size = max(1, workers)
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.evaluations = 0  # Expressions sent to workers
+        self.cache_hits = 0
+        self.timeouts = 0
+        self.restarts = 0  # Workers replaced after a timeout or crash
+        self._ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+        self._workers: List[_Worker] = []
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._inflight = SingleFlight()
+        self._closed = True
+
+    def start(self) -> None:
+        if not self._closed:
+            return
+        self._closed = False
+        while not self._idle.empty():
+            self._idle.get_nowait()  # The sentinel put by close()
+        for _ in range(self.size):
+            self._add_worker()
+
+    async def close(self) -> None:
+        """Kill all workers. Running and waiting evaluations raise RuntimeError."""
+        if self._closed:
+            return
+        self._closed = True
+        while not self._idle.empty():
+            self._replace_worker(self._idle.get_nowait())
+        # Wakes evaluations waiting for a worker, each one passes it on to the next
+        self._idle.put_nowait(None)
+
+        # Busy workers are cleaned up by their evaluation once the pipe is closed
+        for i in self._workers:
+            if i.process.is_alive():
+                i.process.kill()
+
+    async def evaluate(self, expr: str) -> str:
+        """Returns the result of the given expression as string, see evaluate_math().
+
+        Identical expressions evaluated at the same time share one worker.
+        """
+        result = self._cache.get(expr, None)
+        if result is not None:
+            self._cache.move_to_end(expr)
+            self.cache_hits += 1
+            return result
+        return await self._inflight.do(expr, self._evaluate, expr)
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
+    async def _evaluate(self, expr: str) -> str:
+        if self._closed:
+            raise RuntimeError("Evaluator pool is closed")
+
+        worker: Optional[_Worker] = await self._idle.get()
+        if worker is None:
+            self._idle.put_nowait(None)
+            raise RuntimeError("Evaluator pool is closed")
+
+        self.evaluations += 1
+        try:
+            worker.conn.send(expr)
+            result = await asyncio.wait_for(self._recv(worker.conn), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._replace_worker(worker)
+            return TIMEOUT_RESULT
+        except (EOFError, OSError) as e:
+            self._replace_worker(worker)
+            if self._closed:
+                raise RuntimeError("Evaluator pool is closed") from e
+            logging.warning("Evaluator process died and was replaced: %s", repr(e))
+            return "Error: Evaluation failed"
+        except BaseException:
+            # E.g. cancelled, the worker may still be busy
+            self._replace_worker(worker)
+            raise
+        else:
+            if self._closed:
+                self._replace_worker(worker)
+            else:
+                self._idle.put_nowait(worker)
+
+        self._cache[expr] = result
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    @staticmethod
+    async def _recv(conn: Connection) -> str:
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        loop.add_reader(conn.fileno(), lambda: readable.done() or readable.set_result(None))
+        try:
+            await readable
+        finally:
+            loop.remove_reader(conn.fileno())
+        return conn.recv()
+
+    def _add_worker(self) -> None:
+        worker = _Worker(self._ctx)
+        self._workers.append(worker)
+        self._idle.put_nowait(worker)
+
+    def _replace_worker(self, worker: _Worker) -> None:
+        worker.kill()
+        self._workers.remove(worker)
+        if not self._closed:
+            self.restarts += 1
+            self._add_worker()
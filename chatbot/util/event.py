@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+import itertools
+import logging
+import time
+from collections import deque
 from sortedcontainers import SortedList
-from typing import Callable
+from typing import Callable, Deque, Dict, Optional, Tuple
+from . import tracing
 
 ExceptionCallback = Callable[[Exception], bool]
 
@@ -19,17 +24,91 @@ EVENT_POST      = 1000
 EVENT_POST_POST = 2000
 
 
+class HandlerStats:
+    """Timing statistics of an event handler.
+
+    Times are measured in seconds. Percentiles are computed from the most
+    recent `max_samples` calls.
+    """
+
+    def __init__(self, max_samples: int = 1000):
+        self.calls = 0
+        self.exceptions = 0
+        self.total_time = 0.0
+        self._samples: Deque[float] = deque(maxlen=max_samples)
+
+    def record(self, duration: float, failed: bool) -> None:
+        self.calls += 1
+        self.total_time += duration
+        self._samples.append(duration)
+        if failed:
+            self.exceptions += 1
+
+    def percentile(self, percent: float) -> float:
+        """Returns the given percentile (0-100) of recent call durations."""
+        if not self._samples:
+            return 0.0
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+    @property
+    def p50(self) -> float:
+        return self.percentile(50)
+
+    @property
+    def p99(self) -> float:
+        return self.percentile(99)
+
+    def __str__(self):
+        return "calls: {}, exceptions: {}, total: {:.3f}s, p50: {:.3f}s, p99: {:.3f}s".format(
+            self.calls, self.exceptions, self.total_time, self.p50, self.p99)
+
+
+class StatsRecorder:
+    """Collects HandlerStats for handlers of one or more events.
+
+    Stats are keyed by (event name, handle label). Handlers taking longer than
+    `slow_threshold` seconds are logged. A threshold <= 0 disables logging.
+    """
+
+    def __init__(self, slow_threshold: float = 0.0):
+        self.slow_threshold = slow_threshold
+        self._stats: Dict[Tuple[str, str], HandlerStats] = {}
+
+    def record(self, event_name: str, label: str, duration: float, failed: bool) -> None:
+        stats = self._stats.get((event_name, label), None)
+        if stats is None:
+            stats = self._stats[(event_name, label)] = HandlerStats()
+        stats.record(duration, failed)
+
+        if 0 < self.slow_threshold < duration:
+            logging.warning("Slow event handler: %s in event %s took %.3fs", label, event_name, duration)
+
+    def get_stats(self) -> Dict[Tuple[str, str], HandlerStats]:
+        """Returns a dict mapping (event name, handle label) to HandlerStats."""
+        return dict(self._stats)
+
+    def reset(self) -> None:
+        self._stats.clear()
+
+
 class Handle:
-    def __init__(self, event, callback, nice):
+    def __init__(self, event, callback, nice, label=""):
         self._event = event
         self._callback = callback
         self._remove = False
         self._nice = nice
+        self._label = label or getattr(callback, "__qualname__", "") or repr(callback)
+
+    @property
+    def label(self) -> str:
+        """A name describing who registered the handler, by default the callback's name."""
+        return self._label
 
     def unregister(self):
         if not self._remove:
             self._remove = True
-            self._event._dirty += 1
+            self._event._remove(self)
             # Avoid preventing garbage collection
             self._callback = None
             self._event = None
@@ -55,7 +134,8 @@ class Event:
     """Contains a list of callbacks and calls them when the event is trigger()ed.
 
     It's safe to remove/unregister a callback during the trigger() loop
-    (unregistering a callback inside a callback).
+    (unregistering a callback inside a callback), and to trigger the same
+    event multiple times concurrently.
 
     Callbacks can return a value to determine whether the event execution
     should be continued or stopped. This might be useful when certain events
@@ -65,14 +145,37 @@ class Event:
 
     To guarantee that every handler will be called, regardless of return
     values, use the trigger_all() function.
+    trigger_all_concurrent() additionally runs handlers with the same priority
+    concurrently.
     """
 
     def __init__(self):
         self._handlers = SortedList(key=lambda x: x._nice)
-        self._waiting = []  # Callbacks waiting to get inserted
-        self._dirty = 0     # counts how many handlers need to be removed
-        self._running = False   # Whether or not trigger() is currently executed
+        # Immutable copy of _handlers used by trigger(). It is rebuilt lazily
+        # after handlers were added or removed, so that triggers can iterate
+        # without copying and are not affected by changes during execution.
+        self._snapshot: Optional[Tuple[Handle, ...]] = ()
         self._exception_handler: ExceptionCallback = None
+        self._handler_timeout: Optional[float] = None
+        self._stats_recorder: Optional[StatsRecorder] = None
+        self._name = ""
+
+    def set_stats_recorder(self, recorder: Optional[StatsRecorder], name: str = ""):
+        """Record timing statistics of every handler call in the given StatsRecorder under the given event name.
+
+        Pass None to disable recording (default).
+        """
+        self._stats_recorder = recorder
+        self._name = name
+
+    def set_handler_timeout(self, timeout: Optional[float]):
+        """Set the maximum time in seconds a single handler may run, or None for no limit (default).
+
+        Handlers that take longer are cancelled and an asyncio.TimeoutError is
+        raised, which is passed to the exception handler like any other
+        exception.
+        """
+        self._handler_timeout = timeout
 
     def set_exception_handler(self, exception_handler: ExceptionCallback):
         """Register a callback function that will be called when an exception occurs during event chain execution.
@@ -85,7 +188,7 @@ class Event:
         """
         self._exception_handler = exception_handler
 
-    def register(self, callback, nice=EVENT_NORMAL):
+    def register(self, callback, nice=EVENT_NORMAL, label=""):
         """Adds a callback that will be called when the event is triggered.
 
         Returns a handle that can be used to unregister.
@@ -98,21 +201,22 @@ class Event:
             EVENT_NORMAL = 0
             EVENT_POST   = 1000
         If `nice` is not specified, EVENT_NORMAL is used.
+        Callbacks with the same priority are called in order of registration.
+        `label` is used to identify the handler in statistics, e.g. the name
+        of the plugin that registered it. Defaults to the callback's name.
 
         The callback may return EVENT_HANDLED to abort the event
         execution early. (See also class docstring)
         """
         assert asyncio.iscoroutinefunction(callback), "Callback must be a coroutine"
 
-        hnd = Handle(self, callback, nice)
-        if not self._running:
-            self._handlers.add(hnd)
-        else:
-            # Event handlers that have been registered inside another
-            # callback must not be called inside the same trigger()-loop
-            # (e.g. reloading could cause an infinite loop).
-            # Therefore they need to be buffered.
-            self._waiting.append(hnd)
+        # Event handlers that have been registered inside another callback
+        # will not be called inside the same trigger()-loop (e.g. reloading
+        # could cause an infinite loop), because running triggers keep
+        # iterating their snapshot.
+        hnd = Handle(self, callback, nice, label)
+        self._handlers.add(hnd)
+        self._snapshot = None
         return hnd
 
     @staticmethod
@@ -121,16 +225,14 @@ class Event:
 
         Same as calling Handle.unregister() directly.
         """
-        # To prevent interference with the loop inside trigger(), the
-        # callback won't be removed immediately (but also won't be called
-        # anymore). The actual removal is done at the end of every trigger()
-        # call.
-        # The len() function will report a size not including inactive handlers.
+        # Running trigger() loops still iterate their snapshot that includes
+        # the handle, but won't call it anymore, because it is marked as
+        # removed.
         handle.unregister()
 
     def clear(self):
         """Remove all event handlers."""
-        for i in self._handlers:
+        for i in self._get_snapshot():
             i.unregister()
 
     async def trigger(self, *args, **kwargs):
@@ -145,32 +247,77 @@ class Event:
         """The same as trigger() but calls every handler, regardless of return values."""
         await self._execute(args, kwargs, trigger_all=True)
 
+    async def trigger_all_concurrent(self, *args, **kwargs):
+        """The same as trigger_all() but runs handlers with the same priority concurrently.
+
+        Handlers with a lower nice value still finish before handlers with a
+        higher nice value are started.
+        Exceptions are passed to the exception handler after all handlers of
+        the respective priority finished. The first exception that is not
+        caught is re-raised.
+        """
+        for _, level in itertools.groupby(self._get_snapshot(), key=lambda x: x._nice):
+            handles = [ i for i in level if i ]
+
+            if len(handles) == 1:
+                await self._execute_handle(handles[0], args, kwargs)
+                continue
+
+            results = await asyncio.gather(
+                *( self._call(i, args, kwargs) for i in handles ), return_exceptions=True)
+
+            for i in results:
+                if isinstance(i, BaseException):
+                    self._handle_exception(i)
+
     async def _execute(self, args, kwargs, trigger_all=False):
-        self._running = True
-        for i in self._handlers:
-            try:
-                if i and await i(*args, **kwargs) == EVENT_HANDLED and not trigger_all:
-                    break
-            except Exception as e:
-                if self._exception_handler and self._exception_handler(e):
-                    continue
-                raise
-        self._running = False
-        self._update()
-
-    def _update(self):
-        if not self._running:
-            # Remove every handler that was marked for removal.
-            if self._dirty > 0:
-                self._handlers = SortedList(
-                    [ i for i in self._handlers if i ], key=lambda x: x._nice)
-                self._waiting = [ i for i in self._waiting if i ]
-                self._dirty = 0
-
-            # Insert pending callbacks
-            if len(self._waiting) > 0:
-                self._handlers.update(self._waiting)
-                self._waiting = []
+        for i in self._get_snapshot():
+            if i and await self._execute_handle(i, args, kwargs) == EVENT_HANDLED and not trigger_all:
+                break
+
+    async def _execute_handle(self, handle: Handle, args, kwargs):
+        """Call a handler and pass exceptions to the exception handler. Returns the handler's return value or None."""
+        try:
+            return await self._call(handle, args, kwargs)
+        except Exception as e:
+            self._handle_exception(e)
+        return None
+
+    async def _call(self, handle: Handle, args, kwargs):
+        with tracing.span(handle.label or "handler"):
+            return await self._call_recorded(handle, args, kwargs)
+
+    async def _call_recorded(self, handle: Handle, args, kwargs):
+        if self._stats_recorder is None:
+            return await self._call_with_timeout(handle, args, kwargs)
+
+        failed = True
+        start = time.perf_counter()
+        try:
+            result = await self._call_with_timeout(handle, args, kwargs)
+            failed = False
+            return result
+        finally:
+            self._stats_recorder.record(self._name, handle.label, time.perf_counter() - start, failed)
+
+    async def _call_with_timeout(self, handle: Handle, args, kwargs):
+        if self._handler_timeout is None:
+            return await handle(*args, **kwargs)
+        return await asyncio.wait_for(handle(*args, **kwargs), self._handler_timeout)
+
+    def _handle_exception(self, e: BaseException):
+        """Re-raises the exception if it is not caught by the exception handler."""
+        if not isinstance(e, Exception) or not self._exception_handler or not self._exception_handler(e):
+            raise e
+
+    def _get_snapshot(self) -> Tuple[Handle, ...]:
+        if self._snapshot is None:
+            self._snapshot = tuple(self._handlers)
+        return self._snapshot
+
+    def _remove(self, handle: Handle):
+        self._handlers.discard(handle)
+        self._snapshot = None
 
     def __len__(self):
-        return len(self._handlers) + len(self._waiting) - self._dirty
+        return len(self._handlers)
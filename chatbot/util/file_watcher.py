@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import sys
+from typing import Any, Callable, Dict, Optional, Set
+from .utils import call_maybe_async
+
+FileCallback = Callable[[str], Any]
+
+# See inotify(7)
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_Q_OVERFLOW = 0x00004000
+_IN_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class FileWatcher:
+    """Watches a directory for modified files.
+
+    The callback is called with the path of a file after it was written or
+    moved into the directory. Changes are debounced: the callback is called
+    once `debounce` seconds after the last change to a file.
+    The callback may be a coroutine function.
+
+    Uses inotify on Linux and falls back to polling file modification times
+    every `poll_interval` seconds on other systems or if inotify is not
+    available.
+    Subdirectories are not watched.
+    """
+
+    def __init__(self, directory: str, callback: FileCallback, debounce: float = 0.5,
+                 poll_interval: float = 2.0, use_inotify: bool = True):
+        self._directory = directory
+        self._callback = callback
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self._use_inotify = use_inotify
+        self._fd: Optional[int] = None
+        self._poll_task: Optional[asyncio.Task] = None
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._mtimes: Dict[str, int] = {}
+
+    @property
+    def backend(self) -> str:
+        """Returns "inotify", "polling", or "" if not running."""
+        if self._fd is not None:
+            return "inotify"
+        if self._poll_task is not None:
+            return "polling"
+        return ""
+
+    def start(self) -> None:
+        """Start watching. Must be called from within a running event loop."""
+        if self.backend:
+            return
+
+        os.makedirs(self._directory, exist_ok=True)
+
+        if self._use_inotify and self._start_inotify():
+            logging.debug("Watching %s using inotify", self._directory)
+            return
+
+        logging.debug("Watching %s using polling", self._directory)
+        self._mtimes = self._scan()
+        self._poll_task = asyncio.create_task(self._poll())
+
+    async def stop(self) -> None:
+        """Stop watching and discard pending changes."""
+        if self._fd is not None:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            await asyncio.gather(self._poll_task, return_exceptions=True)
+            self._poll_task = None
+
+        for i in self._timers.values():
+            i.cancel()
+        self._timers.clear()
+
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _on_change(self, path: str) -> None:
+        if timer := self._timers.get(path, None):
+            timer.cancel()
+        self._timers[path] = asyncio.get_running_loop().call_later(self.debounce, self._fire, path)
+
+    def _fire(self, path: str) -> None:
+        self._timers.pop(path, None)
+        task = asyncio.create_task(self._run_callback(path))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_callback(self, path: str) -> None:
+        try:
+            await call_maybe_async(self._callback, path)
+        except Exception as e:
+            logging.error("Exception in file watcher callback for %s", path)
+            logging.exception(e)
+
+    # inotify
+    def _start_inotify(self) -> bool:
+        if not sys.platform.startswith("linux"):
+            return False
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1() failed")
+
+            if libc.inotify_add_watch(fd, os.fsencode(self._directory), _IN_CLOSE_WRITE | _IN_MOVED_TO) < 0:
+                errno = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(errno, "inotify_add_watch() failed")
+        except (OSError, AttributeError) as e:
+            logging.warning("inotify not available, falling back to polling: %s", e)
+            return False
+
+        self._fd = fd
+        asyncio.get_running_loop().add_reader(fd, self._read_inotify)
+        return True
+
+    def _read_inotify(self) -> None:
+        try:
+            data = os.read(self._fd, 64 * 1024)  # type: ignore[arg-type]
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset + _IN_EVENT_HEADER.size <= len(data):
+            _, mask, _, namelen = _IN_EVENT_HEADER.unpack_from(data, offset)
+            offset += _IN_EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + namelen].rstrip(b"\0"))
+            offset += namelen
+
+            if mask & _IN_Q_OVERFLOW:
+                logging.warning("inotify event queue overflow, some changes in %s might be missed", self._directory)
+            elif name:
+                self._on_change(os.path.join(self._directory, name))
+
+    # Polling
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            mtimes = self._scan()
+            for path, mtime in mtimes.items():
+                if self._mtimes.get(path, None) != mtime:
+                    self._on_change(path)
+            self._mtimes = mtimes
+
+    def _scan(self) -> Dict[str, int]:
+        mtimes = {}
+        try:
+            with os.scandir(self._directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file():
+                            mtimes[entry.path] = entry.stat().st_mtime_ns
+                    except FileNotFoundError:
+                        pass
+        except FileNotFoundError:
+            pass
+        return mtimes
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from multidict import CIMultiDict
+from .config import write_file_atomic
+from .http_client import HTTPClient, HTTPResponse
+from .utils import run_in_thread
+
+# Only responses with these status codes are cached
+CACHEABLE_STATUS = frozenset((200, 203, 300, 301, 410))
+
+# Arguments of HTTPClient.request() that don't affect the response, other ones bypass the cache
+URL_ONLY_ARGS = frozenset(("timeout", "retries"))
+
+# Response headers stored with cached entries
+STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Expires", "Date")
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0  # Served from cache without a request
+    revalidated: int = 0  # Served from cache after a 304 Not Modified response
+    misses: int = 0  # Fetched from the server
+    stores: int = 0
+    evictions: int = 0  # Entries removed from memory
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.revalidated + self.misses
+        return (self.hits + self.revalidated) / total if total else 0.0
+
+    def __str__(self):
+        return "hits: {}, revalidated: {}, misses: {}, hit rate: {:.1%}, stores: {}, evictions: {}".format(
+            self.hits, self.revalidated, self.misses, self.hit_rate, self.stores, self.evictions)
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+    encoding: str
+    stored: float  # Timestamp of the last response from the server
+    expires: float  # Timestamp until the entry is fresh according to the response headers
+    size: int = field(init=False)
+
+    def __post_init__(self):
+        self.size = len(self.body)
+
+    def is_fresh(self, now: float, ttl: Optional[float] = None) -> bool:
+        """Returns whether the entry can be used without revalidation. `ttl` overrides the response headers."""
+        if ttl is not None:
+            return now < self.stored + ttl
+        return now < self.expires
+
+    def get_validators(self) -> Dict[str, str]:
+        """Returns headers for a conditional request."""
+        headers = {}
+        if etag := self.headers.get("ETag", None):
+            headers["If-None-Match"] = etag
+        if modified := self.headers.get("Last-Modified", None):
+            headers["If-Modified-Since"] = modified
+        return headers
+
+    def to_response(self) -> HTTPResponse:
+        return HTTPResponse(self.url, self.status, CIMultiDict(self.headers), self.body, self.encoding)
+
+
+class HTTPCache:
+    """Caches GET responses in memory and optionally on disk.
+
+    Freshness is determined by the Cache-Control (no-store, no-cache,
+    max-age) and Expires response headers, or by a per-call TTL. Responses
+    without freshness information are fresh for `default_ttl` seconds.
+    Stale entries with an ETag or Last-Modified header are revalidated using
+    a conditional request.
+
+    The memory cache holds at most `max_entries` responses and `max_size`
+    bytes, evicting the least recently used ones. If `directory` is given,
+    responses are also stored there, limited to `max_disk_entries` files,
+    and survive restarts.
+    Vary and request headers are not considered, hence only responses that
+    depend on the URL alone should be cached.
+    """
+
+    def __init__(self, max_entries: int = 256, max_size: int = 32 * 2**20,  # pylint: disable=too-many-positional-arguments
+                 directory: Optional[str] = None, max_disk_entries: int = 1024, default_ttl: float = 0.0):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.max_disk_entries = max_disk_entries
+        self.default_ttl = default_ttl
+        self.stats = CacheStats()
+        self._directory = directory
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._size = 0
+        self._disk_writes = 0
+
+    async def get(self, client: HTTPClient, url: str, ttl: Optional[float] = None, **kwargs) -> HTTPResponse:
+        """Returns the cached response for a GET request of `url` or fetches it using `client`.
+
+        `ttl` overrides how many seconds a response is considered fresh,
+        e.g. 0 to always revalidate. Additional arguments are passed to
+        client.request(). Since entries are keyed by URL only, requests with
+        arguments that may change the response, e.g. `params` or `headers`,
+        bypass the cache. See URL_ONLY_ARGS.
+        """
+        if not kwargs.keys() <= URL_ONLY_ARGS:
+            return await client.request("GET", url, **kwargs)
+
+        now = time.time()
+        entry = await self._lookup(url)
+
+        if entry is not None and entry.is_fresh(now, ttl):
+            self.stats.hits += 1
+            return entry.to_response()
+
+        headers = entry.get_validators() if entry is not None else {}
+        response = await client.request("GET", url, headers=headers, **kwargs)
+        now = time.time()
+
+        if entry is not None and response.status == 304:
+            self.stats.revalidated += 1
+            entry.headers.update(self._get_stored_headers(response.headers))
+            entry.stored = now
+            entry.expires = self._get_expiry(entry.headers, now) or now
+            await self._store(entry)
+            return entry.to_response()
+
+        self.stats.misses += 1
+        if response.status in CACHEABLE_STATUS:
+            stored_headers = self._get_stored_headers(response.headers)
+            expires = self._get_expiry(stored_headers, now)
+            if expires is not None and self._is_url_only(response.headers):
+                await self._store(CacheEntry(url, response.status, stored_headers, response.body, response.encoding,
+                                             now, expires))
+        return response
+
+    async def invalidate(self, url: str) -> None:
+        self._remove(url)
+        if self._directory is not None:
+            await run_in_thread(self._remove_file, url)
+
+    def clear(self) -> None:
+        """Clear the memory cache."""
+        self._entries.clear()
+        self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._entries
+
+    # Freshness
+    def _get_expiry(self, headers: Dict[str, str], now: float) -> Optional[float]:
+        """Returns the timestamp until a response is fresh or None if it must not be stored."""
+        directives = {}
+        for i in headers.get("Cache-Control", "").lower().split(","):
+            key, _, value = i.strip().partition("=")
+            directives[key] = value.strip('"')
+
+        if "no-store" in directives:
+            return None
+        if "no-cache" in directives:
+            return now
+
+        if "max-age" in directives:
+            try:
+                return now + max(0, int(directives["max-age"]))
+            except ValueError:
+                return now
+
+        if expires := headers.get("Expires", None):
+            try:
+                # Use the server's clock if possible
+                date = parsedate_to_datetime(headers["Date"]).timestamp() if "Date" in headers else now
+                return now + parsedate_to_datetime(expires).timestamp() - date
+            except (TypeError, ValueError):
+                return now  # Invalid dates mean "already expired"
+
+        return now + self.default_ttl
+
+    @staticmethod
+    def _is_url_only(headers) -> bool:
+        """Returns whether the response depends on the URL only, according to the Vary header."""
+        # The client always sends the same Accept-Encoding header
+        return all(i.strip().lower() in ("", "accept-encoding") for i in headers.get("Vary", "").split(","))
+
+    @staticmethod
+    def _get_stored_headers(headers) -> Dict[str, str]:
+        return { k: headers[k] for k in STORED_HEADERS if k in headers }
+
+    # Memory
+    async def _lookup(self, url: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(url, None)
+        if entry is not None:
+            self._entries.move_to_end(url)
+            return entry
+
+        if self._directory is not None:
+            entry = await run_in_thread(self._read_file, url)
+            if entry is not None:
+                self._put(entry)
+        return entry
+
+    async def _store(self, entry: CacheEntry) -> None:
+        self.stats.stores += 1
+        self._put(entry)
+
+        if self._directory is not None:
+            self._disk_writes += 1
+            prune = self._disk_writes % 64 == 0
+            await run_in_thread(self._write_file, entry, prune)
+
+    def _put(self, entry: CacheEntry) -> None:
+        self._remove(entry.url)
+        if entry.size > self.max_size:
+            return
+
+        self._entries[entry.url] = entry
+        self._size += entry.size
+
+        while len(self._entries) > self.max_entries or self._size > self.max_size:
+            _, old = self._entries.popitem(last=False)
+            self._size -= old.size
+            self.stats.evictions += 1
+
+    def _remove(self, url: str) -> None:
+        if old := self._entries.pop(url, None):
+            self._size -= old.size
+
+    # Disk
+    def _get_filename(self, url: str) -> str:
+        return os.path.join(self._directory, hashlib.sha256(url.encode()).hexdigest())  # type: ignore[arg-type]
+
+    def _read_file(self, url: str) -> Optional[CacheEntry]:
+        filename = self._get_filename(url)
+        try:
+            with open(filename + ".json", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(filename + ".body", "rb") as f:
+                body = f.read()
+            if meta["url"] != url or meta["size"] != len(body):
+                return None
+            return CacheEntry(url, meta["status"], meta["headers"], body, meta["encoding"], meta["stored"], meta["expires"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning("Failed to read HTTP cache entry for %s: %s", url, e)
+            return None
+
+    def _write_file(self, entry: CacheEntry, prune: bool) -> None:
+        filename = self._get_filename(entry.url)
+        try:
+            os.makedirs(self._directory, exist_ok=True)  # type: ignore[arg-type]
+            # The body is written first, the size in the metadata detects mismatching pairs
+            tmpname = filename + ".body.tmp"
+            with open(tmpname, "wb") as f:
+                f.write(entry.body)
+            os.replace(tmpname, filename + ".body")
+            write_file_atomic(filename + ".json", json.dumps({
+                "url": entry.url,
+                "status": entry.status,
+                "headers": entry.headers,
+                "encoding": entry.encoding,
+                "stored": entry.stored,
+                "expires": entry.expires,
+                "size": entry.size,
+            }))
+        except OSError as e:
+            logging.warning("Failed to write HTTP cache entry for %s: %s", entry.url, e)
+
+        if prune:
+            self._prune_files()
+
+    def _remove_file(self, url: str) -> None:
+        filename = self._get_filename(url)
+        for i in (filename + ".json", filename + ".body"):
+            try:
+                os.remove(i)
+            except FileNotFoundError:
+                pass
+
+    def _prune_files(self) -> None:
+        """Removes the least recently written entries exceeding max_disk_entries."""
+        try:
+            with os.scandir(self._directory) as it:
+                files = [ (i.stat().st_mtime, i.path) for i in it if i.name.endswith(".json") ]
+        except OSError:
+            return
+
+        files.sort()
+        for _, path in files[:max(0, len(files) - self.max_disk_entries)]:
+            for i in (path, path[:-len(".json")] + ".body"):
+                try:
+                    os.remove(i)
+                except OSError:
+                    pass
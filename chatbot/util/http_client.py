@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Optional, TYPE_CHECKING
+import aiohttp
+from .singleflight import SingleFlight
+
+if TYPE_CHECKING:
+    from .http_cache import HTTPCache
+
+# Status codes that indicate a temporary server-side problem worth retrying
+RETRY_STATUS = frozenset((429, 502, 503, 504))
+
+# Methods that can safely be sent again, other ones are only retried if the caller asks for it
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+
+
+@dataclass
+class HTTPResponse:
+    """A fully read HTTP response."""
+    url: str
+    status: int
+    headers: Mapping[str, str]
+    body: bytes
+    encoding: str = "utf-8"
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+    def text(self) -> str:
+        return self.body.decode(self.encoding, errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.text()) if self.body else None
+
+
+class HTTPClient:
+    """Shared HTTP client with a persistent connection pool.
+
+    Connections are kept alive and reused across requests, DNS lookups are
+    cached and the number of connections is limited in total and per host.
+    Requests are retried on connection errors, timeouts and status codes in
+    RETRY_STATUS, with exponential backoff. By default, only methods in
+    IDEMPOTENT_METHODS are retried.
+
+    If `cache` is set, get() requests are served from and stored in the
+    given HTTPCache. Concurrent get() requests of the same URL without
+    additional arguments are coalesced into one request, see SingleFlight.
+
+    The underlying aiohttp session is created on first use and recreated if
+    it is used from a different event loop. Call close() when done.
+    """
+
+    def __init__(self, timeout: float = 30.0, connect_timeout: float = 10.0,  # pylint: disable=too-many-positional-arguments
+                 retries: int = 2, retry_delay: float = 0.5, limit: int = 100, limit_per_host: int = 8,
+                 keepalive_timeout: float = 30.0, dns_cache_ttl: int = 300, user_agent: str = "",
+                 cache: Optional["HTTPCache"] = None):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.requests = 0  # Total requests sent, including retries
+        self.cache = cache
+        self.inflight = SingleFlight()
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._dns_cache_ttl = dns_cache_ttl
+        self._headers = { "User-Agent": user_agent } if user_agent else {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Returns the aiohttp session, creating it if necessary. Must be called from within a running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            # A session can't be used nor properly closed outside the loop it was created in
+            if self._session is not None and not self._session.closed and self._loop is not None and not self._loop.is_closed():
+                logging.warning("HTTP client used from another event loop, creating a new session")
+
+            self._loop = loop
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self._limit,
+                    limit_per_host=self._limit_per_host,
+                    keepalive_timeout=self._keepalive_timeout,
+                    ttl_dns_cache=self._dns_cache_ttl,
+                    use_dns_cache=self._dns_cache_ttl > 0),
+                timeout=aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout),
+                headers=self._headers)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            if not self._session.closed and self._loop is asyncio.get_running_loop():
+                await self._session.close()
+            self._session = None
+            self._loop = None
+
+    async def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None,  # pylint: disable=too-many-positional-arguments
+                      timeout: Optional[float] = None, retries: Optional[int] = None, **kwargs) -> HTTPResponse:
+        """Sends a request and returns the fully read response.
+
+        `timeout` and `retries` override the client's defaults for this call.
+        Methods not in IDEMPOTENT_METHODS, e.g. POST, are only retried if
+        `retries` is given explicitly, as the server might have processed a
+        failed attempt already.
+        Additional keyword arguments are passed to aiohttp.ClientSession.request().
+        Raises aiohttp.ClientError or asyncio.TimeoutError if all attempts
+        fail. Responses with error status codes are returned, not raised.
+        """
+        if retries is None:
+            retries = self.retries if method.upper() in IDEMPOTENT_METHODS else 0
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout, connect=min(timeout, self.connect_timeout))
+
+        attempt = 0
+        while True:
+            self.requests += 1
+            try:
+                async with self.session.request(method, url, headers=headers, **kwargs) as r:
+                    body = await r.read()
+                    response = HTTPResponse(str(r.url), r.status, r.headers, body, r.get_encoding() if body else "utf-8")
+                if response.status not in RETRY_STATUS or attempt >= retries:
+                    return response
+                logging.debug("HTTP %s %s returned %s, retrying", method, url, response.status)
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                if attempt >= retries:
+                    raise
+                logging.debug("HTTP %s %s failed, retrying: %s", method, url, repr(e))
+
+            await asyncio.sleep(self.retry_delay * 2**attempt)
+            attempt += 1
+
+    async def get(self, url: str, ttl: Optional[float] = None, use_cache: bool = True, **kwargs) -> HTTPResponse:
+        """Sends a GET request, using the cache if available.
+
+        `ttl` overrides for how many seconds a cached response is considered
+        fresh. See HTTPCache.get() and request().
+        Callers of coalesced requests share the response object.
+        """
+        if kwargs:
+            return await self._get(url, ttl, use_cache, **kwargs)
+        return await self.inflight.do((url, ttl, use_cache), self._get, url, ttl, use_cache)
+
+    async def _get(self, url: str, ttl: Optional[float], use_cache: bool, **kwargs) -> HTTPResponse:
+        if self.cache is not None and use_cache:
+            return await self.cache.get(self, url, ttl, **kwargs)
+        return await self.request("GET", url, **kwargs)
+
+    async def get_str(self, url: str, **kwargs) -> str:
+        return (await self.get(url, **kwargs)).text()
+
+    async def get_json(self, url: str, **kwargs) -> Any:
+        return (await self.get(url, **kwargs)).json()
+
+
+_default_client: Optional[HTTPClient] = None
+
+
+def get_default_client() -> HTTPClient:
+    """Returns the client used by util.async_http_get_*(), creating one with default settings if necessary."""
+    global _default_client  # pylint: disable=global-statement
+    if _default_client is None:
+        _default_client = HTTPClient()
+    return _default_client
+
+
+def set_default_client(client: Optional[HTTPClient]) -> None:
+    """Set the client used by util.async_http_get_*(). None resets it to default settings on next use."""
+    global _default_client  # pylint: disable=global-statement
+    _default_client = client
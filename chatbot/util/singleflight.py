@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """Deduplicates concurrent async calls by key.
+
+    While a call for a key is in flight, further calls with the same key do
+    not start another one, but wait for the running call and receive the
+    same result or exception. Results are not cached, the next call after
+    completion starts a new one.
+
+    Callers share the result object, hence it should not be modified.
+    Cancelling one caller does not cancel the shared call for the others.
+    """
+
+    def __init__(self):
+        self.calls = 0  # Calls that were actually started
+        self.shared = 0  # Calls that joined an in-flight call
+        self._flights: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, callback: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Run `callback(*args, **kwargs)` unless a call with the same key is in flight and return its result."""
+        task = self._flights.get(key, None)
+
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(callback(*args, **kwargs))
+            self._flights[key] = task
+            task.add_done_callback(lambda _: self._done(key, task))
+        else:
+            self.shared += 1
+
+        return await asyncio.shield(task)
+
+    def __len__(self):
+        """Returns the number of calls in flight."""
+        return len(self._flights)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._flights
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._flights.get(key, None) is task:
+            del self._flights[key]
+
+        # Avoid "exception was never retrieved" warnings if all callers were cancelled
+        if not task.cancelled():
+            task.exception()
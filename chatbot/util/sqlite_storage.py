@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import functools
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from chatbot.api import User, Chat
+from chatbot.util import run_in_thread
+from .config import Flushable, WriteBehindFlusher
+from .storage import Storage, StorageScope, UserReference, ChatReference
+
+# (scope type, user id, chat id, key)
+RowKey = Tuple[str, str, str, str]
+
+SCOPE_GLOBAL = "g"
+SCOPE_USER = "u"
+SCOPE_CHAT = "c"
+SCOPE_USER_CHAT = "uc"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS storage (
+    scope TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (scope, user_id, chat_id, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS storage_user ON storage (user_id);
+CREATE INDEX IF NOT EXISTS storage_chat ON storage (chat_id);
+"""
+
+# Keys of json storage files, see Storage._build_storage_key().
+# IDs are assumed to not contain dashes, except for a leading minus.
+_JSON_KEY_PATTERNS = (
+    (SCOPE_USER_CHAT, re.compile(r"uc-(-?[^-]+)-(-?[^-]+)-(.*)", re.DOTALL)),
+    (SCOPE_USER, re.compile(r"u-(-?[^-]+)-(.*)", re.DOTALL)),
+    (SCOPE_CHAT, re.compile(r"c-(-?[^-]+)-(.*)", re.DOTALL)),
+    (SCOPE_GLOBAL, re.compile(r"g--(.*)", re.DOTALL)),
+)
+
+_ERASED = object()
+_MISSING = object()
+
+# Max. number of keys per SELECT query, each key takes 4 SQL variables
+_QUERY_BATCH_SIZE = 200
+
+
+@functools.lru_cache(maxsize=4096)
+def get_fallback_scopes(userid: str, chatid: str) -> Tuple[Tuple[str, str, str], ...]:
+    """Returns the (scope type, user id, chat id) of the given scope followed by its fallback scopes.
+
+    See Storage.get_with_fallback() for the fallback order.
+    """
+    if userid and chatid:
+        return ((SCOPE_USER_CHAT, userid, chatid), (SCOPE_CHAT, "", chatid), (SCOPE_USER, userid, ""), (SCOPE_GLOBAL, "", ""))
+    if userid:
+        return ((SCOPE_USER, userid, ""), (SCOPE_GLOBAL, "", ""))
+    if chatid:
+        return ((SCOPE_CHAT, "", chatid), (SCOPE_GLOBAL, "", ""))
+    return ((SCOPE_GLOBAL, "", ""),)
+
+
+class SQLiteStorage(Storage, Flushable):  # pylint: disable=super-init-not-called
+    """Storage using an SQLite database.
+
+    Entries are indexed by (scope type, user id, chat id, key), which allows
+    to efficiently list or erase all entries of a scope, user, or chat.
+    See iter_scope(), erase_scope(), erase_user_data(), and
+    erase_chat_data().
+
+    Reads are synchronous like the Storage interface and query the database
+    directly in the calling thread, which is fast for indexed lookups.
+    set() and erase() are buffered and committed in a single transaction by
+    write(). Reads take buffered changes into account.
+    If a WriteBehindFlusher is given, write() only schedules the commit and
+    the flusher commits in a background thread using a separate connection.
+    Otherwise write() commits synchronously.
+    Bulk operations, i.e. erasing scopes and migrating json files, are
+    coroutines and run in a background thread.
+
+    Keys known to be absent are cached, so that repeated lookups of missing
+    keys, e.g. by get_with_fallback(), don't hit the database.
+    get_with_fallback() and get_many() query all required keys at once.
+    """
+
+    def __init__(self, filename: str, max_absent_keys: int = 10000, flusher: Optional[WriteBehindFlusher] = None):
+        self._filename = filename
+        self._flusher = flusher
+        self._pending: Dict[RowKey, Any] = {}
+        self._prepared: Dict[RowKey, Any] = {}  # Changes of the last prepare_write()
+        self._absent: Set[RowKey] = set()
+        self._max_absent_keys = max_absent_keys
+        self._conn: Optional[sqlite3.Connection] = None  # Used for reads
+        self._write_conn: Optional[sqlite3.Connection] = None  # Used for writes, possibly from another thread
+        self._write_lock = threading.Lock()  # Serializes transactions on _write_conn
+        self._connect()
+
+    @property
+    def filename(self) -> str:
+        return self._filename
+
+    def get(self, key: str, user: UserReference, chat: ChatReference) -> Optional[Any]:
+        rowkey = self._build_row_key(key, user, chat)
+        return self._fetch([ rowkey ]).get(rowkey, None)
+
+    def get_with_fallback(self, key: str, user: UserReference, chat: ChatReference) -> Optional[Any]:
+        """Return the value of key. If the key does not exist in the specified scope, it falls back to chat-scope, then user-scope, then global-scope."""
+        rowkeys = self._build_fallback_row_keys(key, user, chat)
+        values = self._fetch(rowkeys)
+        return self._resolve_fallback(rowkeys, values)
+
+    def get_many(self, keys: Iterable[str], user: UserReference, chat: ChatReference, fallback: bool = False) -> Dict[str, Optional[Any]]:
+        """Return a dict mapping the given keys to their values using a single database query.
+
+        If `fallback` is True, values are looked up like in get_with_fallback().
+        """
+        if fallback:
+            chains = { k: self._build_fallback_row_keys(k, user, chat) for k in keys }
+            values = self._fetch([ rowkey for chain in chains.values() for rowkey in chain ])
+            return { k: self._resolve_fallback(chain, values) for k, chain in chains.items() }
+
+        rowkeys = { k: self._build_row_key(k, user, chat) for k in keys }
+        values = self._fetch(list(rowkeys.values()))
+        return { k: values.get(rowkey, None) for k, rowkey in rowkeys.items() }
+
+    def set(self, key: str, value: Any, user: UserReference, chat: ChatReference) -> None:
+        rowkey = self._build_row_key(key, user, chat)
+        self._pending[rowkey] = value
+        self._absent.discard(rowkey)
+
+    def erase(self, key: str, user: UserReference, chat: ChatReference) -> None:
+        """Removes the given entry from storage. Does nothing when the key does not exist."""
+        rowkey = self._build_row_key(key, user, chat)
+        self._pending[rowkey] = _ERASED
+        self._absent.discard(rowkey)
+
+    def load(self):
+        """Discard unwritten changes and cached lookups."""
+        if self._flusher is not None:
+            self._flusher.discard_pending(self)
+        self._pending.clear()
+        self._absent.clear()
+
+    def write(self):
+        """Commit all changes in a single transaction, deferred if a flusher is set."""
+        if not self._pending:
+            return
+        if self._flusher is not None and self._flusher.mark_dirty(self):
+            return
+        self.write_now()
+
+    def prepare_write(self) -> Callable[[], None]:
+        self._prepared = dict(self._pending)
+        updates = [ (*k, json.dumps(v)) for k, v in self._prepared.items() if v is not _ERASED ]
+        erased = [ k for k, v in self._prepared.items() if v is _ERASED ]
+        return lambda: self._write_rows(updates, erased)
+
+    def finish_write(self) -> None:
+        # Keep changes made while writing
+        for k, v in self._prepared.items():
+            if self._pending.get(k, _MISSING) is v:
+                del self._pending[k]
+        self._prepared = {}
+
+    def close(self) -> None:
+        """Write pending changes and close the database."""
+        if self._conn is None:
+            return
+        self._write_pending()
+        for conn in (self._conn, self._write_conn):
+            conn.close()  # type: ignore[union-attr]
+        self._conn = None
+        self._write_conn = None
+
+    def is_modified_on_disk(self) -> bool:
+        """Always False, the database is queried directly.
+
+        Use load() to discard cached absent keys if another process modified
+        the database.
+        """
+        return False
+
+    def scope(self, user: UserReference, chat: ChatReference) -> "SQLiteStorageScope":
+        return SQLiteStorageScope(self, user, chat)
+
+    def iter_scope(self, user: UserReference, chat: ChatReference) -> Iterator[Tuple[str, Any]]:
+        """Iterate over all (key, value) pairs of the given scope, including unwritten changes."""
+        scope, userid, chatid, _ = self._build_row_key("", user, chat)
+        rows = self._conn.execute("SELECT key, value FROM storage WHERE scope = ? AND user_id = ? AND chat_id = ?",  # type: ignore[union-attr]
+                                  (scope, userid, chatid)).fetchall()
+        pending = { k[3]: v for k, v in self._pending.items() if k[:3] == (scope, userid, chatid) }
+
+        for key, value in rows:
+            if key not in pending:
+                yield key, json.loads(value)
+
+        for key, value in pending.items():
+            if value is not _ERASED:
+                yield key, value
+
+    async def erase_scope(self, user: UserReference, chat: ChatReference) -> int:
+        """Erase all entries of the given scope and return how many were erased.
+
+        This does not include entries of other scopes of the same user or chat,
+        e.g. erase_scope(user, None) keeps the user's entries in user+chat
+        scopes. See erase_user_data() and erase_chat_data().
+        """
+        scope, userid, chatid, _ = self._build_row_key("", user, chat)
+        return await self._delete("DELETE FROM storage WHERE scope = ? AND user_id = ? AND chat_id = ?", (scope, userid, chatid))
+
+    async def erase_user_data(self, user: UserReference) -> int:
+        """Erase all entries of the given user in all scopes and return how many were erased."""
+        _, userid, _, _ = self._build_row_key("", user, None)
+        return await self._delete("DELETE FROM storage WHERE user_id = ? AND scope IN (?, ?)", (userid, SCOPE_USER, SCOPE_USER_CHAT))
+
+    async def erase_chat_data(self, chat: ChatReference) -> int:
+        """Erase all entries of the given chat in all scopes and return how many were erased."""
+        _, _, chatid, _ = self._build_row_key("", None, chat)
+        return await self._delete("DELETE FROM storage WHERE chat_id = ? AND scope IN (?, ?)", (chatid, SCOPE_CHAT, SCOPE_USER_CHAT))
+
+    async def migrate_from_json(self, filename: str) -> List[str]:
+        """Import all entries of a json storage file.
+
+        Existing entries with the same keys are overwritten.
+        Returns a list of keys that could not be imported because they don't
+        have a known scope prefix.
+        User and chat IDs must not contain dashes, except for a leading minus,
+        otherwise the scope is determined incorrectly.
+        See also migrate_json_file().
+        """
+        await self._commit_pending()
+        skipped = await run_in_thread(self._import_json, filename)
+        self._absent.clear()
+        return skipped
+
+    def _fetch(self, rowkeys: List[RowKey]) -> Dict[RowKey, Any]:
+        """Returns a dict mapping the given row keys to their values, omitting absent keys.
+
+        Takes unwritten changes and the absent keys cache into account and
+        queries remaining keys in as few queries as possible.
+        """
+        result: Dict[RowKey, Any] = {}
+        query: List[RowKey] = []
+
+        for rowkey in rowkeys:
+            value = self._pending.get(rowkey, _MISSING)
+            if value is _MISSING:
+                if rowkey not in self._absent:
+                    query.append(rowkey)
+            elif value is not _ERASED:
+                result[rowkey] = value
+
+        if query:
+            query = list(dict.fromkeys(query))  # Remove duplicates
+            rows = self._fetch_rows(query)
+            for row in rows:
+                result[row[:4]] = json.loads(row[4])
+
+            if len(self._absent) > self._max_absent_keys:
+                self._absent.clear()
+            self._absent.update(rowkey for rowkey in query if rowkey not in result)
+
+        return result
+
+    @staticmethod
+    def _resolve_fallback(rowkeys: List[RowKey], values: Dict[RowKey, Any]) -> Optional[Any]:
+        data = None
+        for rowkey in rowkeys:
+            data = values.get(rowkey, None)
+            if data:
+                return data
+        return data
+
+    @staticmethod
+    def _build_fallback_row_keys(key: str, user: UserReference, chat: ChatReference) -> List[RowKey]:
+        _, userid, chatid, _ = SQLiteStorage._build_row_key(key, user, chat)
+        return [ (*scope, key) for scope in get_fallback_scopes(userid, chatid) ]  # type: ignore[misc]
+
+    @staticmethod
+    def _parse_json_key(jsonkey: str) -> Optional[RowKey]:
+        for scope, pattern in _JSON_KEY_PATTERNS:
+            if m := pattern.fullmatch(jsonkey):
+                if scope == SCOPE_USER_CHAT:
+                    return scope, m.group(1), m.group(2), m.group(3)
+                if scope == SCOPE_USER:
+                    return scope, m.group(1), "", m.group(2)
+                if scope == SCOPE_CHAT:
+                    return scope, "", m.group(1), m.group(2)
+                return scope, "", "", m.group(1)
+        return None
+
+    @staticmethod
+    def _build_row_key(key: str, user: UserReference, chat: ChatReference) -> RowKey:
+        userid = str(user.id if isinstance(user, User) else user or "")
+        chatid = str(chat.id if isinstance(chat, Chat) else chat or "")
+
+        if userid and chatid:
+            scope = SCOPE_USER_CHAT
+        elif userid:
+            scope = SCOPE_USER
+        elif chatid:
+            scope = SCOPE_CHAT
+        else:
+            scope = SCOPE_GLOBAL
+
+        return scope, userid, chatid, key
+
+    def _write_pending(self) -> None:
+        """Commit pending changes synchronously, including those a background commit is writing."""
+        if self._flusher is not None:
+            self._flusher.discard_pending(self)
+        if self._pending:
+            self.write_now()
+
+    async def _commit_pending(self) -> None:
+        """Commit pending changes in a background thread, after a commit running in the background finished."""
+        if self._flusher is not None:
+            if self._pending:
+                self._flusher.mark_dirty(self)
+            await self._flusher.write_pending(self)
+        elif self._pending:
+            await run_in_thread(self.prepare_write())
+            self.finish_write()
+
+    async def _delete(self, query: str, params: tuple) -> int:
+        """Commit pending changes, then run the given DELETE query and return the number of deleted rows."""
+        await self._commit_pending()
+        return await run_in_thread(self._execute_delete, query, params)
+
+    def _execute_delete(self, query: str, params: tuple) -> int:
+        with self._write_lock, self._write_conn:  # type: ignore[union-attr]
+            return self._write_conn.execute(query, params).rowcount  # type: ignore[union-attr]
+
+    def _import_json(self, filename: str) -> List[str]:
+        """Commits all entries of a json storage file and returns the skipped keys, see migrate_from_json()."""
+        with open(filename) as f:
+            data = json.load(f)
+
+        updates = []
+        skipped = []
+        for jsonkey, value in data.items():
+            rowkey = self._parse_json_key(jsonkey)
+            if rowkey is None:
+                skipped.append(jsonkey)
+            else:
+                updates.append((*rowkey, json.dumps(value)))
+
+        self._write_rows(updates, [])
+        logging.info("Migrated %s storage entries from %s to %s", len(updates), filename, self._filename)
+        if skipped:
+            logging.warning("Skipped storage entries with unknown key format: %s", skipped)
+        return skipped
+
+    def _connect(self) -> None:
+        dirname = os.path.dirname(self._filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        # WAL mode allows reading while the other connection writes
+        self._write_conn = sqlite3.connect(self._filename, check_same_thread=False)
+        self._write_conn.execute("PRAGMA journal_mode=WAL")
+        self._write_conn.executescript(_SCHEMA)
+        self._write_conn.commit()
+        self._conn = sqlite3.connect(self._filename)
+
+    def _fetch_rows(self, rowkeys: List[RowKey]) -> List[tuple]:
+        rows = []
+        for i in range(0, len(rowkeys), _QUERY_BATCH_SIZE):
+            batch = rowkeys[i:i + _QUERY_BATCH_SIZE]
+            condition = " OR ".join([ "(scope = ? AND user_id = ? AND chat_id = ? AND key = ?)" ] * len(batch))
+            params = [ param for rowkey in batch for param in rowkey ]
+            rows.extend(self._conn.execute(  # type: ignore[union-attr]
+                "SELECT scope, user_id, chat_id, key, value FROM storage WHERE " + condition, params).fetchall())
+        return rows
+
+    def _write_rows(self, updates: List[tuple], erased: List[RowKey]) -> None:
+        """Commits the given changes, possibly in a background thread."""
+        with self._write_lock, self._write_conn:  # type: ignore[union-attr]
+            if updates:
+                self._write_conn.executemany("INSERT OR REPLACE INTO storage (scope, user_id, chat_id, key, value) VALUES (?, ?, ?, ?, ?)",  # type: ignore[union-attr]
+                                             updates)
+            if erased:
+                self._write_conn.executemany("DELETE FROM storage WHERE scope = ? AND user_id = ? AND chat_id = ? AND key = ?", erased)  # type: ignore[union-attr]
+
+
+class SQLiteStorageScope(StorageScope):
+    _storage: SQLiteStorage
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """Iterate over all (key, value) pairs in this scope."""
+        return self._storage.iter_scope(self._user, self._chat)
+
+    async def clear(self) -> int:
+        """Erase all entries in this scope. See SQLiteStorage.erase_scope()."""
+        return await self._storage.erase_scope(self._user, self._chat)
+
+
+def migrate_json_file(jsonfile: str, dbfile: str) -> List[str]:
+    """Create an SQLite storage database from a json storage file, see SQLiteStorage.migrate_from_json().
+
+    The database is created under a temporary name and renamed when the
+    migration is complete. Hence, if `dbfile` exists, the migration was
+    complete, and a failed migration is retried next time.
+    Blocks until finished, use run_in_thread() in the event loop.
+    """
+    tmpfile = dbfile + ".tmp"
+    for i in (tmpfile, tmpfile + "-wal", tmpfile + "-shm"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(i)
+
+    storage = SQLiteStorage(tmpfile)
+    try:
+        skipped = storage._import_json(jsonfile)  # pylint: disable=protected-access
+    finally:
+        storage.close()
+    os.replace(tmpfile, dbfile)
+    return skipped
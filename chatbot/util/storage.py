@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from typing import Any, Optional, Union
+import functools
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 from chatbot.api import User, Chat
 from chatbot.util import config
 
@@ -9,74 +13,317 @@ ChatReference = Union[Chat, str, None]
 UserReference = Union[User, str, None]
 
 
-class Storage:
-    def __init__(self, cfg: config.Config) -> None:
+@functools.lru_cache(maxsize=4096)
+def get_fallback_prefixes(userid: Optional[str], chatid: Optional[str]) -> Tuple[str, ...]:
+    """Returns the key prefix of the given scope followed by the prefixes of its fallback scopes.
+
+    See Storage.get_with_fallback() for the fallback order.
+    """
+    if userid and chatid:
+        return (f"uc-{userid}-{chatid}-", f"c-{chatid}-", f"u-{userid}-", "g--")
+    if userid:
+        return (f"u-{userid}-", "g--")
+    if chatid:
+        return (f"c-{chatid}-", "g--")
+    return ("g--",)
+
+
+class StorageBackend:
+    """Key/value store used by Storage.
+
+    Keys are strings, values must be json serializable.
+    Changes are only guaranteed to be persistent after calling write().
+    """
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def erase(self, key: str) -> None:
+        """Removes the given entry. Does nothing when the key does not exist."""
+        raise NotImplementedError
+
+    def load(self) -> None:
+        """(Re-)Load data, discarding unwritten changes."""
+        raise NotImplementedError
+
+    def write(self) -> None:
+        raise NotImplementedError
+
+    def is_modified_on_disk(self) -> bool:
+        """Returns whether the data was modified by someone else since it was last loaded or written."""
+        return False
+
+
+class ConfigBackend(StorageBackend):
+    """Stores all data in a json Config.
+
+    Every write() rewrites the whole file.
+    """
+
+    def __init__(self, cfg: config.Config):
         self._cfg = cfg
 
+    @property
+    def config(self) -> config.Config:
+        return self._cfg
+
+    def get(self, key: str) -> Optional[Any]:
+        return self._cfg.data.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        self._cfg[key] = value
+
+    def erase(self, key: str) -> None:
+        if key in self._cfg:
+            del self._cfg[key]
+
+    def load(self) -> None:
+        self._cfg.load()
+
+    def write(self) -> None:
+        self._cfg.write()
+
+    def is_modified_on_disk(self) -> bool:
+        return self._cfg.is_modified_on_disk()
+
+
+class JournalBackend(StorageBackend, config.Flushable):
+    """Stores data in a json snapshot and an append-only journal of changes.
+
+    set() and erase() record the change and write() appends the recorded
+    changes to `<filename>.journal`. Hence, the cost of write() depends on
+    the number of changes rather than on the total amount of data.
+    When the journal contains more than `compact_threshold` records, it is
+    compacted into the snapshot file.
+    load() reads the snapshot and replays the journal.
+
+    The snapshot has the same format as a json storage file, so existing
+    storage files can be used as snapshot and vice versa after compact().
+
+    Values are serialized when set() is called. Modifying a value in place
+    afterwards requires calling set() again.
+
+    If a WriteBehindFlusher is given, write() only schedules the recorded
+    changes and the flusher appends them in a background thread.
+    """
+
+    JOURNAL_SUFFIX = ".journal"
+
+    def __init__(self, filename: str, compact_threshold: int = 1000, fsync: bool = True,
+                 flusher: Optional[config.WriteBehindFlusher] = None):
+        """Constructor.
+
+        If `fsync` is True, every journal write waits until the records are
+        written to disk, so they survive a crash of the OS or a power loss.
+        Disabling it makes writes faster, but recent records may be lost then.
+        """
+        self._filename = filename
+        self._journal_filename = filename + self.JOURNAL_SUFFIX
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+        self._flusher = flusher
+        self._data: Dict[str, Any] = {}
+        self._pending: List[str] = []
+        self._prepared = (0, False, 0)  # (Number of pending records, compact, generation) of the last prepare_write()
+        self._generation = 0  # Incremented by load(), which invalidates records being written
+        self._journal_size = 0  # Number of records in the journal file
+
+    @property
+    def filename(self) -> str:
+        return self._filename
+
+    @property
+    def journal_filename(self) -> str:
+        return self._journal_filename
+
+    @property
+    def journal_size(self) -> int:
+        """Number of records written to the journal since the last compaction."""
+        return self._journal_size
+
+    def get(self, key: str) -> Optional[Any]:
+        return self._data.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        self._pending.append(json.dumps({ "op": "set", "key": key, "value": value }))
+        self._data[key] = value
+
+    def erase(self, key: str) -> None:
+        if key in self._data:
+            del self._data[key]
+            self._pending.append(json.dumps({ "op": "erase", "key": key }))
+
+    def load(self) -> None:
+        logging.debug("Loading storage snapshot: %s", self._filename)
+        self._pending.clear()
+        self._generation += 1
+        self._journal_size = 0
+        try:
+            with open(self._filename) as f:
+                self._data = json.load(f)
+        except FileNotFoundError:
+            self._data = {}
+
+        if self._replay_journal():
+            # The journal ends with a broken record, probably due to a crash while writing.
+            # Compact it, so that new records are not appended to the broken one.
+            self.compact()
+
+    def write(self) -> None:
+        if not self._pending:
+            return
+        if self._flusher is not None and self._flusher.mark_dirty(self):
+            return
+        self.write_now()
+
+    def prepare_write(self) -> Callable[[], None]:
+        records = list(self._pending)
+        compact = self._journal_size + len(records) > self.compact_threshold
+        self._prepared = (len(records), compact, self._generation)
+
+        if compact:
+            snapshot = json.dumps(self._data, indent=4)
+            return lambda: self._write_snapshot(snapshot)
+        return lambda: self._append_journal(records)
+
+    def finish_write(self) -> None:
+        # Records added while writing stay pending. If load() was called meanwhile, all
+        # pending records were recorded afterwards.
+        count, compact, generation = self._prepared
+        if generation != self._generation:
+            return
+        del self._pending[:count]
+        self._journal_size = 0 if compact else self._journal_size + count
+
+    def compact(self) -> None:
+        """Write all data to the snapshot and remove the journal."""
+        self._write_snapshot(json.dumps(self._data, indent=4))
+        self._pending.clear()
+        self._journal_size = 0
+
+    def _write_snapshot(self, snapshot: str) -> None:
+        logging.debug("Compacting storage journal: %s", self._journal_filename)
+        config.write_file_atomic(self._filename, snapshot)
+
+        # If the process crashes before the journal is removed, the journal is
+        # replayed on top of the new snapshot next time, which has no effect.
+        try:
+            os.remove(self._journal_filename)
+        except FileNotFoundError:
+            pass
+
+    def _append_journal(self, records: List[str]) -> None:
+        if not records:
+            return
+
+        dirname = os.path.dirname(self._journal_filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        with open(self._journal_filename, "a") as f:
+            f.write("\n".join(records))
+            f.write("\n")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def _replay_journal(self) -> bool:
+        """Applies the journal to the loaded data and returns True if a broken record was found."""
+        try:
+            f = open(self._journal_filename)
+        except FileNotFoundError:
+            return False
+
+        broken = False
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    if record["op"] == "set":
+                        self._data[record["key"]] = record["value"]
+                    elif record["op"] == "erase":
+                        self._data.pop(record["key"], None)
+                    else:
+                        raise ValueError("Unknown operation: " + str(record["op"]))
+                except (ValueError, KeyError, TypeError):
+                    logging.warning("Skipping broken storage journal record in %s: %s", self._journal_filename, line.rstrip())
+                    broken = True
+                    continue
+                self._journal_size += 1
+        return broken
+
+
+class Storage:
+    def __init__(self, backend: Union[config.Config, StorageBackend]) -> None:
+        """Constructor.
+
+        `backend` is either a StorageBackend or a Config, which is wrapped
+        in a ConfigBackend.
+        """
+        self._backend: StorageBackend = ConfigBackend(backend) if isinstance(backend, config.Config) else backend
+
+    @property
+    def backend(self) -> StorageBackend:
+        return self._backend
+
     def get(self, key: str, user: UserReference, chat: ChatReference) -> Optional[Any]:
-        return self._cfg.data.get(self._build_storage_key(key, user, chat))
+        return self._backend.get(self._build_storage_key(key, user, chat))
 
     def get_with_fallback(self, key: str, user: UserReference, chat: ChatReference) -> Optional[Any]:
         """Return the value of key. If the key does not exist in the specified scope, it falls back to chat-scope, then user-scope, then global-scope."""
-        # First try requested scope
-        data = self.get(key, user, chat)
-        if data:
-            return data
-
-        # Global scope, there is nothing more to fall back
-        if not user and not chat:
-            return None
-
-        # If requested user+chat scope, first try chat, then fallback to user storage
-        if user and chat:
-            data = self.get(key, None, chat)
+        data = None
+        for prefix in self._get_prefixes(user, chat):
+            data = self._backend.get(prefix + key)
             if data:
                 return data
+        return data
 
-            data = self.get(key, user, None)
-            if data:
-                return data
+    def get_many(self, keys: Iterable[str], user: UserReference, chat: ChatReference, fallback: bool = False) -> Dict[str, Optional[Any]]:
+        """Return a dict mapping the given keys to their values.
 
-        # If nothing found, use global storage or return None
-        data = self.get(key, None, None)
-        return data
+        If `fallback` is True, values are looked up like in get_with_fallback().
+        """
+        if fallback:
+            return { k: self.get_with_fallback(k, user, chat) for k in keys }
+        prefix = self._get_prefixes(user, chat)[0]
+        return { k: self._backend.get(prefix + k) for k in keys }
 
     def set(self, key: str, value: Any, user: UserReference, chat: ChatReference) -> None:
-        self._cfg[self._build_storage_key(key, user, chat)] = value
+        self._backend.set(self._build_storage_key(key, user, chat), value)
 
     def erase(self, key: str, user: UserReference, chat: ChatReference) -> None:
         """Removes the given entry from storage. Does nothing when the key does not exist."""
-        key = self._build_storage_key(key, user, chat)
-
-        if key in self._cfg:
-            del self._cfg[key]
+        self._backend.erase(self._build_storage_key(key, user, chat))
 
     def load(self):
-        """Reload storage file. See also config.Config.load()."""
-        self._cfg.load()
+        """Reload storage. See also StorageBackend.load()."""
+        self._backend.load()
 
     def write(self):
-        """Write to file. See also config.Config.write()."""
-        self._cfg.write()
+        """Write changes. See also StorageBackend.write()."""
+        self._backend.write()
+
+    def close(self) -> None:
+        """Release resources when the storage is no longer used."""
+
+    def is_modified_on_disk(self) -> bool:
+        """See StorageBackend.is_modified_on_disk()."""
+        return self._backend.is_modified_on_disk()
 
     def scope(self, user: UserReference, chat: ChatReference) -> "StorageScope":
         return StorageScope(self, user, chat)
 
     @staticmethod
     def _build_storage_key(key: str, user: UserReference, chat: ChatReference) -> str:
-        userid: Optional[str] = user.id if isinstance(user, User) else user
-        chatid: Optional[str] = chat.id if isinstance(chat, Chat) else chat
-
-        if userid and chatid:
-            prefix = f"uc-{userid}-{chatid}"
-        elif userid and not chatid:
-            prefix = f"u-{userid}"
-        elif not userid and chatid:
-            prefix = f"c-{chatid}"
-        else:
-            prefix = "g-"
+        return Storage._get_prefixes(user, chat)[0] + key
 
-        return f"{prefix}-{key}"
+    @staticmethod
+    def _get_prefixes(user: UserReference, chat: ChatReference) -> Tuple[str, ...]:
+        return get_fallback_prefixes(user.id if isinstance(user, User) else user,
+                                     chat.id if isinstance(chat, Chat) else chat)
 
 
 class StorageScope:
@@ -91,6 +338,9 @@ class StorageScope:
     def get_with_fallback(self, key: str) -> Optional[Any]:
         return self._storage.get_with_fallback(key, self._user, self._chat)
 
+    def get_many(self, keys: Iterable[str], fallback: bool = False) -> Dict[str, Optional[Any]]:
+        return self._storage.get_many(keys, self._user, self._chat, fallback)
+
     def set(self, key: str, value: Any) -> None:
         return self._storage.set(key, value, self._user, self._chat)
 
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+"""Lightweight latency tracing for incoming events.
+
+A trace is started by the API adapter when an event (usually a message)
+arrives. It is stored in a context variable, so it follows the event through
+the scheduler, the dispatcher, command execution, event handlers and
+outgoing send_message() calls, even across tasks.
+Every stage opens a span, resulting in a span tree per event:
+
+    MessageReceived 12.31ms
+      +0.00ms received
+      +0.41ms dispatch MessageReceived 11.80ms
+        +0.45ms commands 11.70ms
+          +0.52ms command echo 11.52ms
+            +0.60ms send_message 10.93ms
+
+Tracing is disabled by default. When disabled or when an event is not
+sampled, span() and mark() only perform a single context variable lookup.
+"""
+
+import contextvars
+import logging
+import random
+import time
+from collections import deque
+from typing import Callable, Deque, List, Optional
+
+TraceCallback = Callable[["Trace"], None]
+
+
+class Span:
+    """A named, timed section of a trace.
+
+    Times are perf_counter() values in seconds. Marks are spans with zero
+    duration.
+    """
+    __slots__ = ("name", "start", "end", "children")
+
+    def __init__(self, name: str, start: float):
+        self.name = name
+        self.start = start
+        self.end: Optional[float] = None
+        self.children: List["Span"] = []
+
+    @property
+    def duration(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+    def find(self, name: str) -> Optional["Span"]:
+        """Returns the first span with the given name in this subtree (depth-first) or None."""
+        if self.name == name:
+            return self
+        for i in self.children:
+            if (span := i.find(name)) is not None:
+                return span
+        return None
+
+
+class Trace:
+    """The span tree of a single event."""
+
+    def __init__(self, name: str):
+        self.root = Span(name, time.perf_counter())
+        self.finished = False
+
+    @property
+    def name(self) -> str:
+        return self.root.name
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.root.duration
+
+    def find(self, name: str) -> Optional[Span]:
+        return self.root.find(name)
+
+    def format(self) -> str:
+        """Returns the span tree as human readable text.
+
+        Each line shows the offset to the trace start and the duration in
+        milliseconds.
+        """
+        lines = [ f"{self.root.name} {_format_duration(self.root)}" ]
+        self._format_children(self.root, 1, lines)
+        return "\n".join(lines)
+
+    def _format_children(self, span: Span, depth: int, lines: List[str]) -> None:
+        for i in span.children:
+            offset = (i.start - self.root.start) * 1000
+            duration = "" if i.end == i.start else " " + _format_duration(i)
+            lines.append(f"{'  ' * depth}+{offset:.2f}ms {i.name}{duration}")
+            self._format_children(i, depth + 1, lines)
+
+
+class Tracer:
+    """Decides which events are traced and collects finished traces."""
+
+    def __init__(self, sample_rate: float = 0.0, max_traces: int = 100, log: bool = False):
+        """Constructor.
+
+        `sample_rate` is the fraction of events to trace, from 0.0 (off) to
+        1.0 (all).
+        The last `max_traces` finished traces are kept, see traces.
+        If `log` is True, finished traces are logged at debug level.
+        """
+        self.sample_rate = sample_rate
+        self.log = log
+        self._traces: Deque[Trace] = deque(maxlen=max_traces)
+        self._callbacks: List[TraceCallback] = []
+
+    @property
+    def traces(self) -> List[Trace]:
+        """Recently finished traces, oldest first."""
+        return list(self._traces)
+
+    def clear(self) -> None:
+        self._traces.clear()
+
+    def add_callback(self, callback: TraceCallback) -> None:
+        """Register a function that is called with every finished trace."""
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback: TraceCallback) -> None:
+        self._callbacks.remove(callback)
+
+    def should_sample(self) -> bool:
+        return self.sample_rate >= 1.0 or (self.sample_rate > 0.0 and random.random() < self.sample_rate)
+
+    def _finish(self, trace: Trace) -> None:
+        self._traces.append(trace)
+        if self.log and logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Trace:\n%s", trace.format())
+        for i in self._callbacks:
+            i(trace)
+
+
+class _NullContext:
+    """Returned when there is nothing to trace."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return False
+
+
+class _SpanContext:
+    __slots__ = ("_trace", "_span", "_token")
+
+    def __init__(self, trace: Trace, parent: Span, name: str):
+        self._trace = trace
+        self._span = Span(name, time.perf_counter())
+        self._token: Optional[contextvars.Token] = None
+        if not trace.finished:
+            parent.children.append(self._span)
+
+    def __enter__(self) -> Span:
+        self._token = _current.set((self._trace, self._span))
+        return self._span
+
+    def __exit__(self, *args):
+        self._span.end = time.perf_counter()
+        if self._token is not None:
+            _current.reset(self._token)
+        return False
+
+
+class _TraceContext:
+    __slots__ = ("_trace", "_token")
+
+    def __init__(self, trace: Trace):
+        self._trace = trace
+        self._token: Optional[contextvars.Token] = None
+
+    def __enter__(self) -> Trace:
+        self._token = _current.set((self._trace, self._trace.root))
+        return self._trace
+
+    def __exit__(self, *args):
+        if self._token is not None:
+            _current.reset(self._token)
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+_tracer = Tracer()
+_current: contextvars.ContextVar = contextvars.ContextVar("chatbot_trace", default=None)
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def configure(sample_rate: float = 0.0, max_traces: int = 100, log: bool = False) -> Tracer:
+    """Replace the global tracer with a new one using the given settings and return it."""
+    global _tracer  # pylint: disable=global-statement
+    _tracer = Tracer(sample_rate, max_traces, log)
+    return _tracer
+
+
+def start_trace(name: str, received: Optional[float] = None):
+    """Start a new trace if the event is sampled.
+
+    Returns a context manager. Everything that is started within the
+    context, including tasks, belongs to the trace. It does not finish the
+    trace, see finish_trace().
+    `received` is an optional perf_counter() timestamp of when the event
+    arrived, in case it was received before the trace could be started.
+    """
+    if _tracer.sample_rate <= 0.0 or not _tracer.should_sample():
+        return _NULL_CONTEXT
+
+    trace = Trace(name)
+    if received is not None:
+        trace.root.start = received
+    mark_span = Span("received", trace.root.start)
+    mark_span.end = mark_span.start
+    trace.root.children.append(mark_span)
+    return _TraceContext(trace)
+
+
+def finish_trace(name: str) -> None:
+    """Finish the current trace if it was started with the given name.
+
+    Further spans are not recorded in a finished trace.
+    """
+    current = _current.get()
+    if current is None:
+        return
+
+    trace: Trace = current[0]
+    if trace.finished or trace.name != name:
+        return
+
+    trace.finished = True
+    trace.root.end = time.perf_counter()
+    _tracer._finish(trace)
+
+
+def span(name: str):
+    """Returns a context manager that records a span in the current trace, if any."""
+    current = _current.get()
+    if current is None:
+        return _NULL_CONTEXT
+    return _SpanContext(current[0], current[1], name)
+
+
+def mark(name: str) -> None:
+    """Record a point in time in the current trace, if any."""
+    current = _current.get()
+    if current is None or current[0].finished:
+        return
+    s = Span(name, time.perf_counter())
+    s.end = s.start
+    current[1].children.append(s)
+
+
+def current_trace() -> Optional[Trace]:
+    current = _current.get()
+    return None if current is None else current[0]
+
+
+def _format_duration(span_: Span) -> str:
+    duration = span_.duration
+    return "(running)" if duration is None else f"{duration * 1000:.2f}ms"
@@ -2,10 +2,10 @@
 
 import logging
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 from chatbot import api
 from typing import Callable, List, Any, Iterable
-import aiohttp
+from .http_client import get_default_client
+from .worker_pool import get_default_pools
 
 
 def merge_dicts(srcdict: dict, mergedict: dict, overwrite=False):
@@ -81,33 +81,35 @@ async def wait_until_api_ready(apiobj: api.APIBase):
 
 
 async def run_in_thread(callback, *args):
-    """Spawn a new thread, run a callback in it, and wait until it returns.
+    """Run a blocking callback in the shared I/O thread pool and wait until it returns.
 
     Returns what the callback returns.
+    See worker_pool.get_default_pools().
     """
-    loop = asyncio.get_running_loop()
-    with ThreadPoolExecutor(max_workers=1) as pool:
-        return await loop.run_in_executor(pool, callback, *args)
+    return await get_default_pools().io.run(callback, *args)
 
 
-async def async_http_get_str(url: str) -> str:
-    """Asynchronously creates a HTTP request using aiohttp and returns the response content as string.
+async def run_cpu_bound(callback, *args):
+    """Same as run_in_thread() but uses the CPU thread pool, which has one thread per CPU by default."""
+    return await get_default_pools().cpu.run(callback, *args)
 
-    When more than one request is made, aiohttp should be used directly for efficiency.
+
+async def async_http_get_str(url: str, **kwargs) -> str:
+    """Asynchronously creates a HTTP GET request and returns the response content as string.
+
+    Uses the shared client, see http_client.get_default_client(). Keyword
+    arguments are passed to HTTPClient.request().
     """
-    async with aiohttp.ClientSession() as sess:
-        async with sess.get(url) as r:
-            return await r.text()
+    return await get_default_client().get_str(url, **kwargs)
 
 
-async def async_http_get_json(url: str) -> Any:
-    """Asynchronously creates a HTTP request using aiohttp and returns the response content as JSON dict.
+async def async_http_get_json(url: str, **kwargs) -> Any:
+    """Asynchronously creates a HTTP GET request and returns the response content as JSON dict.
 
-    When more than one request is made, aiohttp should be used directly for efficiency.
+    Uses the shared client, see http_client.get_default_client(). Keyword
+    arguments are passed to HTTPClient.request().
     """
-    async with aiohttp.ClientSession() as sess:
-        async with sess.get(url) as r:
-            return await r.json()
+    return await get_default_client().get_json(url, **kwargs)
 
 
 async def wait_until_true(callback: Callable, *args, **kwargs):
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+
+@dataclass
+class PoolStats:
+    name: str
+    max_workers: int
+    threads: int  # Threads started so far, they are started on demand
+    active: int  # Tasks currently running
+    queued: int  # Tasks waiting for a free thread
+    completed: int
+    busy_time: float  # Total seconds spent running tasks
+
+    @property
+    def utilization(self) -> float:
+        """Fraction of workers currently busy."""
+        return self.active / self.max_workers
+
+    def __str__(self):
+        return "{}: {}/{} busy ({:.0%}), {} queued, {} completed, {} threads, {:.2f}s busy".format(
+            self.name, self.active, self.max_workers, self.utilization, self.queued, self.completed,
+            self.threads, self.busy_time)
+
+
+class WorkerPool:
+    """A named, persistent thread pool that keeps usage statistics.
+
+    Threads are started on demand up to `max_workers` and reused afterwards.
+    If the pool was shut down, it is restarted on next use.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._busy_time = 0.0
+
+    async def run(self, callback: Callable, *args) -> Any:
+        """Run a callback in the pool and wait until it returns.
+
+        Returns what the callback returns. Cancelling does not interrupt a
+        callback that is already running.
+        """
+        with self._lock:
+            self._queued += 1
+        future = self._get_executor().submit(self._call, callback, args)
+        future.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(future)
+
+    def get_stats(self) -> PoolStats:
+        with self._lock:
+            executor = self._executor
+            return PoolStats(
+                name=self.name,
+                max_workers=self.max_workers,
+                threads=len(executor._threads) if executor is not None else 0,  # pylint: disable=protected-access
+                active=self._active,
+                queued=self._queued,
+                completed=self._completed,
+                busy_time=self._busy_time)
+
+    async def shutdown(self, timeout: Optional[float] = None) -> bool:
+        """Cancel queued tasks and wait at most `timeout` seconds for running tasks to finish.
+
+        Returns False if the timeout expired. The remaining threads are
+        then left running until their task finishes.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is None:
+            return True
+
+        executor.shutdown(wait=False, cancel_futures=True)
+        if timeout is not None and timeout <= 0:
+            return self.get_stats().active == 0
+
+        # Join the threads from a helper thread to not block the event loop
+        joiner = asyncio.get_running_loop().run_in_executor(None, executor.shutdown, True)
+        try:
+            await asyncio.wait_for(joiner, timeout)
+            return True
+        except asyncio.TimeoutError:
+            logging.warning("Worker pool %s: tasks still running after shutdown", self.name)
+            return False
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+            return self._executor
+
+    def _call(self, callback: Callable, args) -> Any:
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+        start = time.perf_counter()
+        try:
+            return callback(*args)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+                self._busy_time += time.perf_counter() - start
+
+    def _on_done(self, future) -> None:
+        # Tasks cancelled before they started, e.g. by shutdown()
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+
+class WorkerPools:
+    """Separate pools for blocking I/O and for CPU-bound work.
+
+    `cpu_workers` <= 0 means the number of CPUs.
+    """
+
+    def __init__(self, io_workers: int = 16, cpu_workers: int = 0):
+        self.io = WorkerPool("io-worker", max(1, io_workers))
+        self.cpu = WorkerPool("cpu-worker", cpu_workers if cpu_workers > 0 else os.cpu_count() or 1)
+
+    async def shutdown(self, timeout: Optional[float] = None) -> bool:
+        """Shutdown both pools, see WorkerPool.shutdown()."""
+        results = await asyncio.gather(self.io.shutdown(timeout), self.cpu.shutdown(timeout))
+        return all(results)
+
+    def __str__(self):
+        return f"{self.io.get_stats()}\n{self.cpu.get_stats()}"
+
+
+_default_pools: Optional[WorkerPools] = None
+
+
+def get_default_pools() -> WorkerPools:
+    """Returns the pools used by util.run_in_thread() and util.run_cpu_bound(), creating them if necessary."""
+    global _default_pools  # pylint: disable=global-statement
+    if _default_pools is None:
+        _default_pools = WorkerPools()
+    return _default_pools
+
+
+def set_default_pools(pools: Optional[WorkerPools]) -> None:
+    """Set the pools used by util.run_in_thread() and util.run_cpu_bound(). None resets them to default settings on next use."""
+    global _default_pools  # pylint: disable=global-statement
+    _default_pools = pools
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Load generator and throughput benchmark for a full Bot running on the test API.
+
+Injects a configurable mix of messages from multiple simulated users and
+chats, either at a target rate or as fast as possible, and reports
+throughput, end-to-end latency percentiles and RSS growth for each plugin
+set.
+
+Example:
+    python bench_bot.py -n 5000 --users 50 --chats 10 --plugins none --plugins tags,8ball
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import resource
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+from context import bot
+from chatbot.util import tracing
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(bot.__file__)), "plugins")
+
+# Message kind -> texts to choose from
+MESSAGES: Dict[str, Tuple[str, ...]] = {
+    "chatter": (
+        "just some normal chat message without any command in it",
+        "lol",
+        "Did anyone see the game yesterday? It was unbelievable.",
+    ),
+    "command": (
+        "!echo foo \"bar baz\" 42",
+        "!help echo",
+        "!list",
+    ),
+    "tag": (
+        "look at this [lenny]",
+        "[lenny] [lenny] [unknown]",
+    ),
+    "missing": (
+        "!will this benchmark finish in time?",
+        "!doesnotexist foo bar",
+    ),
+}
+
+DEFAULT_MIX = "chatter=60,command=20,tag=10,missing=10"
+
+
+@dataclass
+class Result:
+    plugins: str
+    messages: int
+    traced: int
+    elapsed: float
+    latencies: List[float]
+    rss_before: int
+    rss_after: int
+
+    @property
+    def rate(self) -> float:
+        return self.messages / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        values = sorted(self.latencies)
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def get_rss() -> int:
+    """Returns the current resident set size in bytes."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Peak RSS, in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def list_plugins() -> List[str]:
+    return [ i[:-3] if i.endswith(".py") else i for i in os.listdir(PLUGIN_DIR)
+             if not i.startswith(("_", ".")) and (i.endswith(".py") or os.path.isdir(os.path.join(PLUGIN_DIR, i))) ]
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for entry in text.split(","):
+        kind, _, weight = entry.partition("=")
+        kind = kind.strip()
+        if kind not in MESSAGES:
+            raise ValueError(f"Unknown message kind: {kind}")
+        mix[kind] = float(weight) if weight else 1.0
+    return mix
+
+
+async def run_benchmark(plugins: str, args: argparse.Namespace, mix: Dict[str, float]) -> Result:
+    plugin_set = [ i.strip() for i in plugins.split(",") if i.strip() and i.strip() != "none" ]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        profile = bot.BotProfileManager(tmpdir).load_or_create("bench", "test")
+        apicfg = profile.get_api_config().load()
+        apicfg["interactive"] = False
+        apicfg.write()
+        botcfg = profile.get_bot_config().load()
+        botcfg["plugin_blacklist"] = [ i for i in list_plugins() if i not in plugin_set ]
+        botcfg["trace_sample_rate"] = args.sample_rate
+        botcfg.write()
+
+        b = bot.Bot(profile)
+        await b.init()
+        runner = asyncio.create_task(b.run())
+        while not b.api.is_ready:
+            await asyncio.sleep(0.01)
+
+        testapi = b.api
+        chats = [ testapi.create_chat() for _ in range(args.chats) ]
+        # Each user writes in one chat
+        users = [ (testapi.create_user(f"user{i}", chat=chats[i % len(chats)]), chats[i % len(chats)]) for i in range(args.users) ]
+        kinds = list(mix)
+        weights = list(mix.values())
+        rng = random.Random(args.seed)
+
+        latencies: List[float] = []
+        tracing.get_tracer().add_callback(lambda trace: latencies.append(trace.duration))
+
+        rss_before = get_rss()
+        start = time.perf_counter()
+
+        for i in range(args.num):
+            if args.rate > 0:
+                delay = start + i / args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            user, chat = rng.choice(users)
+            text = rng.choice(MESSAGES[rng.choices(kinds, weights)[0]])
+            await testapi.trigger_receive_async(text, author=user, chat=chat)
+
+        await testapi.scheduler.join()
+        elapsed = time.perf_counter() - start
+        rss_after = get_rss()
+
+        await b.close()
+        await runner
+
+    return Result(plugins or "none", args.num, len(latencies), elapsed, latencies, rss_before, rss_after)
+
+
+def print_result(result: Result) -> None:
+    print(f"plugins: {result.plugins}")
+    print(f"  {result.messages} messages in {result.elapsed:.2f}s: {result.rate:,.0f} msgs/s")
+    print(f"  latency ({result.traced} traced): "
+          f"p50 {result.percentile(50) * 1000:.2f}ms, "
+          f"p95 {result.percentile(95) * 1000:.2f}ms, "
+          f"p99 {result.percentile(99) * 1000:.2f}ms")
+    print(f"  RSS: {result.rss_before / 2**20:.1f} MiB -> {result.rss_after / 2**20:.1f} MiB "
+          f"({(result.rss_after - result.rss_before) / 2**20:+.1f} MiB)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Bot load generator and throughput benchmark")
+    parser.add_argument("-n", "--num", help="Messages per run", type=int, default=2000)
+    parser.add_argument("-r", "--rate", help="Target messages per second, 0 = as fast as possible", type=float, default=0)
+    parser.add_argument("-u", "--users", help="Number of simulated users", type=int, default=20)
+    parser.add_argument("-c", "--chats", help="Number of simulated chats", type=int, default=5)
+    parser.add_argument("-m", "--mix", help=f"Message mix as kind=weight list, kinds: {', '.join(MESSAGES)}", default=DEFAULT_MIX)
+    parser.add_argument("-p", "--plugins", help="Comma separated plugin set, can be given multiple times, 'none' for no plugins",
+                        action="append")
+    parser.add_argument("-s", "--sample-rate", help="Fraction of messages to measure latency for", type=float, default=1.0)
+    parser.add_argument("--seed", help="Random seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    mix = parse_mix(args.mix)
+
+    for plugins in args.plugins or [ "none", "tags,8ball" ]:
+        print_result(await run_benchmark(plugins, args, mix))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Microbenchmark for CommandHandler.execute().
+
+Prints how many messages per second are processed for different kinds of
+traffic.
+"""
+
+import asyncio
+import time
+import argparse
+import logging
+from context import create_test_api
+from chatbot.bot.subsystem import command
+from chatbot.api.test import TestAPI
+
+MESSAGES = {
+    "chatter": "just some normal chat message without any command in it",
+    "command": "!bench foo \"bar baz\" 42",
+    "unknown command": "!doesnotexist foo bar",
+}
+
+
+async def bench(handler: command.CommandHandler, msg: TestAPI.TestingMessage, num: int) -> float:
+    """Returns messages per second."""
+    start = time.perf_counter()
+    for _ in range(num):
+        try:
+            await handler.execute(msg)
+        except command.CommandError:
+            pass
+    return num / (time.perf_counter() - start)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="CommandHandler microbenchmark")
+    parser.add_argument("-n", "--num", help="Messages per run", type=int, default=100000)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    apiobj = create_test_api({ "interactive": False })
+    chat = TestAPI.TestChat(apiobj)
+    user = TestAPI.User("user", "", chat)
+    handler = command.CommandHandler(prefix=[ "!bot", "@bot", "!" ])
+
+    async def cmd_bench(_msg, _argv):
+        pass
+
+    handler.register("bench", cmd_bench)
+
+    for name, text in MESSAGES.items():
+        rate = await bench(handler, TestAPI.TestingMessage(user, text, chat), args.num)
+        print(f"{name:>20}: {rate:>12,.0f} msgs/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""Local HTTP server for testing HTTP clients offline.
+
+Example:
+    async with StubServer() as server:
+        server.add_route("/foo", text="bar")
+        await client.get_str(server.url("/foo"))
+        assert server.hits["/foo"] == 1
+"""
+
+import asyncio
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from aiohttp import web
+
+
+class StubServer:
+    """Serves configured responses on 127.0.0.1 with a random port.
+
+    Records the number of requests per path, the request headers and the
+    client ports, i.e. connections, requests were received from.
+    """
+
+    def __init__(self):
+        self.hits: Counter = Counter()
+        self.requests: List[web.Request] = []
+        self.connections: Set[Tuple[str, int]] = set()
+        self._routes: Dict[str, Callable] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self._port = 0
+
+    def add_route(self, path: str, text: str = "", status: int = 200, headers: Dict[str, str] = None,  # pylint: disable=too-many-positional-arguments
+                  delay: float = 0.0, handler: Callable = None):
+        """Respond to requests of `path` with any method.
+
+        If `handler` is given, it is called with the aiohttp request and must
+        return a web.Response, otherwise the given text, status and headers
+        are returned after waiting `delay` seconds.
+        """
+        async def respond(request: web.Request) -> web.Response:
+            if delay:
+                await asyncio.sleep(delay)
+            if handler is not None:
+                return handler(request)
+            return web.Response(text=text, status=status, headers=headers)
+
+        self._routes[path] = respond
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self._port}{path}"
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self._port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.hits[request.path] += 1
+        self.requests.append(request)
+        if request.transport is not None:
+            self.connections.add(request.transport.get_extra_info("peername"))
+
+        respond = self._routes.get(request.path, None)
+        if respond is None:
+            return web.Response(status=404, text="Not found")
+        return await respond(request)
+
+    async def __aenter__(self) -> "StubServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_args) -> None:
+        await self.stop()
@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import asyncio
+import random
+import shlex
 import unittest
+from unittest import mock
 from context import create_test_api
 from chatbot.bot.subsystem import command
 from chatbot.bot.subsystem.command import CommandFlag
@@ -67,6 +71,26 @@ class Test(unittest.IsolatedAsyncioTestCase):
         with self.assertRaises(command.CommandNotFoundError):
             await self._run_command("!missing_command")
 
+    async def test_prefix(self):
+        async def test_cmd(_msg, _argv):
+            self._echostring += "A"
+
+        self.cmd.register("test", test_cmd, argc=0)
+
+        await self._run_command("@bot test")
+        await self._run_command("  !test  ")
+        self.assertEqual(self._echostring, "AA")
+
+        # A prefix followed by another prefix is not a command
+        await self._run_command("@bot @bot test")
+        await self._run_command("!")
+        self.assertEqual(self._echostring, "AA")
+
+    async def test_not_found_without_parsing(self):
+        # Unknown commands should be rejected before parsing arguments
+        with self.assertRaises(command.CommandNotFoundError):
+            await self._run_command("!missing_command \"unclosed quote")
+
     async def test_repeat(self):
         async def test_cmd(_msg, _argv):
             self._echostring += "A"
@@ -81,6 +105,37 @@ class Test(unittest.IsolatedAsyncioTestCase):
         with self.assertRaises(command.CommandNotFoundError):
             await self._run_command("!missing_command")
 
+    async def test_history(self):
+        history = command.CommandHistory(max_entries=2, max_keys=2, ttl=60)
+        chat = TestAPI.TestChat(self._api)
+
+        def add(author, text):
+            history.add(TestAPI.TestingMessage(TestAPI.User(author, "", None), text, chat))
+
+        add("a", "!foo")
+        add("a", "!bar")
+        add("a", "!foo")  # Should move to the end instead of adding a duplicate
+        self.assertEqual(history.get("a", chat.id), [ "!bar", "!foo" ])
+
+        add("a", "!baz")
+        self.assertEqual(history.get("a", chat.id), [ "!foo", "!baz" ])
+
+        # Least recently used histories should be removed
+        add("b", "!foo")
+        add("a", "!foo")
+        add("c", "!foo")
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history.get("b", chat.id), [])
+        self.assertEqual(history.get("a", chat.id), [ "!baz", "!foo" ])
+
+        # Expired histories should be removed
+        history = command.CommandHistory(max_entries=2, ttl=0.01)
+        add("a", "!foo")
+        await asyncio.sleep(0.02)
+        self.assertEqual(history.get("a", chat.id), [])
+        add("b", "!foo")
+        self.assertEqual(len(history), 1)
+
     async def test_missing_handlers(self):
         async def cmd_missing(_msg, _a, _b, _c):
             self._echostring += "A"
@@ -110,6 +165,114 @@ class Test(unittest.IsolatedAsyncioTestCase):
         await self._run_command("!missing foo bar")
         self.assertEqual(self._echostring, "CB")
 
+    async def test_lazy_arguments(self):
+        async def cmd_expand(_msg, arg1):
+            self._echostring = arg1
+
+        self.cmd.register("expand", cmd_expand, argc=1, flags=CommandFlag.Expand)
+
+        # The malformed quote is never parsed, because only one argument is needed
+        await self._run_command("!expand foo bar \"unclosed")
+        self.assertEqual(self._echostring, "foo")
+
+    async def test_builtin_echo(self):
+        msg = TestAPI.TestingMessage(TestAPI.User("user", "", None), "!echo foo  \"bar baz\"", self._chat)
+        with mock.patch.object(msg, "reply") as reply:
+            await self.cmd.execute(msg)
+        reply.assert_called_once_with("foo bar baz")
+
+    def test_tokenizer(self):
+        tokens = command.ArgumentTokenizer("foo 'bar baz'   \"unclosed")
+        self.assertEqual(tokens.get(2), [ "foo", "bar baz" ])
+
+        with self.assertRaises(ValueError):
+            tokens.get()
+
+    def test_tokenizer_shlex(self):
+        """Compare ArgumentTokenizer with shlex.split()."""
+        samples = [
+            "", "   ", "foo", "foo bar", " foo\tbar\nbaz\r ",
+            "'single quoted' \"double quoted\"", "a\"b c\"d", "''", "\"\"", "a '' b",
+            "esc\\ aped", "\\\\", "'no \\ escape'", "\"\\\" \\\\ \\a\"",
+            "\"unclosed", "'unclosed", "trailing\\", "\"trailing\\", "#no comment",
+            "unicode\u00a0space ümlaut", "\\'", "\"it's\"", "'say \"hi\"'",
+        ]
+
+        rng = random.Random(42)
+        alphabet = "ab '\"\\\t\n#"
+        samples.extend("".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12))) for _ in range(5000))
+
+        for text in samples:
+            try:
+                expected = shlex.split(text)
+            except ValueError:
+                with self.assertRaises(ValueError, msg=repr(text)):
+                    command.ArgumentTokenizer(text).get()
+                continue
+
+            self.assertEqual(command.ArgumentTokenizer(text).get(), expected, repr(text))
+
+            # Incremental parsing should produce the same result
+            tokens = command.ArgumentTokenizer(text)
+            for i in range(1, len(expected) + 1):
+                self.assertEqual(tokens.get(i), expected[:i], repr(text))
+
+    async def test_missing_handler_predicates(self):
+        async def cmd_question(_msg, _argv):
+            self._echostring += "Q"
+
+        async def cmd_pattern(_msg, _argv):
+            self._echostring += "P"
+
+        self.cmd.register("missing_question", cmd_question, argc=0, flags=CommandFlag.Missing,
+                          predicate=command.CommandPredicate(suffix="?"))
+        self.cmd.register("missing_pattern", cmd_pattern, argc=0, flags=CommandFlag.Missing,
+                          predicate=command.CommandPredicate(pattern=r"^\d+$"))
+
+        await self._run_command("!is this a question?")
+        self.assertEqual(self._echostring, "Q")
+
+        await self._run_command("!42")
+        self.assertEqual(self._echostring, "QP")
+
+        # The suffix applies to the last argument, not the raw text
+        await self._run_command("!is it \"ok?\"")
+        self.assertEqual(self._echostring, "QPQ")
+
+        with self.assertRaises(command.CommandNotFoundError):
+            await self._run_command("!is it 'ok'")
+
+        with self.assertRaises(command.CommandNotFoundError):
+            await self._run_command("!not a question")
+
+        self.cmd.unregister("missing_question")
+        with self.assertRaises(command.CommandNotFoundError):
+            await self._run_command("!is this a question?")
+
+    async def test_deferred(self):
+        loaded = []
+
+        async def cmd_echo(_msg, argv):
+            self._echostring = " ".join(argv[1:])
+
+        async def load(name):
+            loaded.append(name)
+            self.cmd.register("deferred", cmd_echo)
+
+        async def load_nothing(name):
+            loaded.append(name)
+
+        self.cmd.register("deferred", load, argc=0, flags=CommandFlag.Deferred)
+        self.cmd.register("broken", load_nothing, argc=0, flags=CommandFlag.Deferred)
+
+        await self._run_command("!deferred foo bar")
+        await self._run_command("!deferred baz")
+        self.assertEqual(self._echostring, "baz")
+        self.assertEqual(loaded, [ "deferred" ])
+
+        with self.assertRaises(command.CommandNotFoundError):
+            await self._run_command("!broken")
+
     async def _run_command(self, cmdstring, author="user"):
         msg = TestAPI.TestingMessage(TestAPI.User(author, "", None), cmdstring, self._chat)
         await self.cmd.execute(msg)
@@ -1,8 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
+import json
+import os
+import tempfile
+import time
 import unittest
+from unittest import mock
 from context import util
+from chatbot.util import config
 
 
 class Test(unittest.TestCase):
@@ -85,5 +92,235 @@ class Test(unittest.TestCase):
                 self.assertEqual(v, srcval, "Keys have different values")
 
 
+
+class TestWriteBehind(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self._tmpdir.name, "sub", "test.json")
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def _read(self):
+        with open(self.filename) as f:
+            return json.load(f)
+
+    async def test_coalesce(self):
+        flusher = config.WriteBehindFlusher(0.05)
+        cfg = config.Config(self.filename, flusher)
+
+        for i in range(100):
+            cfg["value"] = i
+            cfg.write()
+
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertEqual(flusher.pending, 1)
+
+        await asyncio.sleep(0.2)
+        self.assertEqual(self._read(), { "value": 99 })
+        self.assertEqual(flusher.writes, 1)
+        self.assertEqual(flusher.pending, 0)
+
+    async def test_close_flushes(self):
+        flusher = config.WriteBehindFlusher(60)
+        cfg = config.Config(self.filename, flusher)
+        cfg["foo"] = "bar"
+        cfg.write()
+
+        await flusher.close()
+        self.assertEqual(self._read(), { "foo": "bar" })
+        self.assertEqual(os.listdir(os.path.dirname(self.filename)), [ "test.json" ])
+
+    async def test_load_keeps_pending_changes(self):
+        flusher = config.WriteBehindFlusher(60)
+        cfg = config.Config(self.filename, flusher)
+        cfg["foo"] = "bar"
+        cfg.write()
+        cfg.load()
+        self.assertEqual(cfg.data, { "foo": "bar" })
+
+        # Still written in the background
+        self.assertEqual(flusher.pending, 1)
+        await flusher.close()
+        self.assertEqual(self._read(), { "foo": "bar" })
+
+    async def test_serialize_error(self):
+        flusher = config.WriteBehindFlusher(60)
+        good = config.Config(os.path.join(self._tmpdir.name, "a.json"), flusher)
+        bad = config.Config(self.filename, flusher)
+        bad["foo"] = { 1, 2 }  # Not json serializable
+        bad.write()
+        good["foo"] = "bar"
+        good.write()
+
+        await flusher.flush()
+        self.assertTrue(os.path.exists(good.filename))
+        self.assertFalse(os.path.exists(bad.filename))
+        self.assertEqual(flusher.pending, 1)
+
+        # Written once it is fixed
+        bad["foo"] = [ 1, 2 ]
+        await flusher.close()
+        self.assertEqual(self._read(), { "foo": [ 1, 2 ] })
+
+    async def test_write_pending_waits_for_flush(self):
+        flusher = config.WriteBehindFlusher(60)
+        cfg = config.Config(self.filename, flusher)
+        write_file_atomic = config.write_file_atomic
+        calls = []
+
+        def slow_write(filename, text):
+            calls.append(text)
+            if len(calls) == 1:
+                time.sleep(0.2)
+            write_file_atomic(filename, text)
+
+        with mock.patch.object(config, "write_file_atomic", slow_write):
+            cfg["value"] = 1
+            cfg.write()
+            flush = asyncio.create_task(flusher.flush())
+            await asyncio.sleep(0.05)
+            self.assertTrue(flusher.is_pending(cfg))
+
+            # Neither blocks the event loop nor reads the older data being written
+            cfg["value"] = 2
+            cfg.write()
+            start = time.perf_counter()
+            cfg.load()
+            self.assertLess(time.perf_counter() - start, 0.1)
+            self.assertEqual(cfg.data, { "value": 2 })
+
+            # The older data being written must not land last
+            await flusher.write_pending(cfg)
+            self.assertTrue(flush.done())
+
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(flusher.is_pending(cfg))
+        self.assertEqual(self._read(), { "value": 2 })
+        self.assertFalse(cfg.is_modified_on_disk())
+
+    def test_load_invalid_file(self):
+        cfg = config.Config(self.filename)
+        cfg["foo"] = "bar"
+        cfg.write()
+        cfg.load()
+
+        with open(self.filename, "w") as f:
+            f.write('{ "foo": ')
+        cfg.load()
+        self.assertEqual(cfg.data, { "foo": "bar" })
+        self.assertTrue(cfg.is_modified_on_disk())
+
+        # Not loaded yet, there is nothing to keep
+        with self.assertRaises(ValueError):
+            config.Config(self.filename).load()
+
+    async def test_discard_pending(self):
+        flusher = config.WriteBehindFlusher(60)
+        cfg = config.Config(self.filename, flusher)
+        cfg["foo"] = "bar"
+        cfg.write()
+        self.assertTrue(cfg.discard_pending())
+        self.assertFalse(cfg.discard_pending())
+        await flusher.close()
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_without_event_loop(self):
+        cfg = config.Config(self.filename, config.WriteBehindFlusher(60))
+        cfg["foo"] = "bar"
+        cfg.write()
+        self.assertEqual(self._read(), { "foo": "bar" })
+
+    async def test_storage(self):
+        flusher = config.WriteBehindFlusher(60)
+        manager = config.ConfigManager(self._tmpdir.name, flusher)
+        storage = util.Storage(manager.get_config("storage"))
+        storage.set("key", 42, "user", None)
+        storage.write()
+        await flusher.flush()
+
+        storage = util.Storage(config.Config(os.path.join(self._tmpdir.name, "storage.json")))
+        storage.load()
+        self.assertEqual(storage.get("key", "user", None), 42)
+
+    async def test_journal_storage(self):
+        flusher = config.WriteBehindFlusher(60)
+        backend = util.JournalBackend(self.filename, flusher=flusher)
+        storage = util.Storage(backend)
+        storage.set("a", 1, None, None)
+        storage.write()
+        storage.set("b", 2, None, None)
+        storage.write()
+        self.assertFalse(os.path.exists(backend.journal_filename))
+        self.assertEqual(flusher.pending, 1)
+
+        # Changes made while writing are written by the next flush
+        flush = asyncio.create_task(flusher.flush())
+        await asyncio.sleep(0)
+        storage.set("c", 3, None, None)
+        storage.write()
+        await flush
+        self.assertEqual(backend.journal_size, 2)
+        await flusher.close()
+        self.assertEqual(backend.journal_size, 3)
+
+        storage = util.Storage(util.JournalBackend(self.filename))
+        storage.load()
+        self.assertEqual(storage.get_many([ "a", "b", "c" ], None, None), { "a": 1, "b": 2, "c": 3 })
+
+        # Records made after reloading during a write are not mistaken for the written ones
+        storage = util.Storage(util.JournalBackend(self.filename, flusher=flusher))
+        storage.load()
+        storage.set("d", 4, None, None)
+        storage.write()
+        flush = asyncio.create_task(flusher.flush())
+        await asyncio.sleep(0)
+        storage.load()
+        storage.set("f", 6, None, None)
+        storage.write()
+        await flush
+        await flusher.close()
+
+        storage = util.Storage(util.JournalBackend(self.filename))
+        storage.load()
+        self.assertEqual(storage.get("f", None, None), 6)
+
+    async def test_sqlite_storage(self):
+        flusher = config.WriteBehindFlusher(60)
+        dbfile = os.path.join(self._tmpdir.name, "storage.sqlite3")
+        storage = util.SQLiteStorage(dbfile, flusher=flusher)
+        other = util.SQLiteStorage(dbfile)
+
+        storage.set("a", 1, None, None)
+        storage.set("b", 2, "user", None)
+        storage.write()
+        self.assertEqual(flusher.pending, 1)
+        self.assertEqual(storage.get("a", None, None), 1)
+        self.assertIsNone(other.get("a", None, None))
+
+        # Changes made while committing are committed by the next flush
+        flush = asyncio.create_task(flusher.flush())
+        await asyncio.sleep(0)
+        storage.set("a", 3, None, None)
+        storage.write()
+        self.assertEqual(storage.get("a", None, None), 3)
+        await flush
+        other.load()
+        self.assertEqual(other.get("a", None, None), 1)
+        self.assertEqual(storage.get("a", None, None), 3)
+
+        # Deleting commits deferred changes first
+        storage.set("c", 4, "user", None)
+        storage.write()
+        self.assertEqual(await storage.erase_user_data("user"), 2)
+        self.assertEqual(flusher.pending, 0)
+
+        storage.close()
+        other.load()
+        self.assertEqual(other.get("a", None, None), 3)
+        self.assertIsNone(other.get("c", "user", None))
+        other.close()
+
+
 if __name__ == "__main__":
     unittest.main()
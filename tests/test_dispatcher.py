@@ -9,6 +9,7 @@ from context import create_test_api
 from chatbot import api
 from chatbot.util import event
 from chatbot.bot.subsystem import APIEventDispatcher
+from chatbot.bot.subsystem.dispatcher import ExecutionLanes
 
 
 class Test(unittest.IsolatedAsyncioTestCase):
@@ -61,6 +62,158 @@ class Test(unittest.IsolatedAsyncioTestCase):
         await asyncio.sleep(0.5)  # Wait a moment for the event to get handled
         event_func.assert_not_called()
 
+    async def test_lanes(self):
+        order = []
+
+        async def event_func(msg: api.ChatMessage):
+            # The first message of each chat takes longer, so it would finish
+            # last without lanes.
+            await asyncio.sleep(0.2 if msg.text.endswith("1") else 0.01)
+            order.append(msg.text)
+
+        self.dispatcher.set_lane_key(api.APIEvents.Message, lambda msg: msg.chat.id)
+        self.dispatcher.register(api.APIEvents.Message, event_func)
+
+        chat1 = self.api.create_chat()
+        chat2 = self.api.create_chat()
+        user = await self.api.get_user()
+
+        for text, chat in (("a1", chat1), ("b1", chat2), ("a2", chat1), ("b2", chat2)):
+            self.api._trigger(api.APIEvents.Message, self.api.create_message(user, text, chat))
+
+        start = asyncio.get_running_loop().time()
+        await self.api.scheduler.join()
+        self.assertEqual([ i for i in order if i.startswith("a") ], [ "a1", "a2" ])
+        self.assertEqual([ i for i in order if i.startswith("b") ], [ "b1", "b2" ])
+
+        # Both chats should have been handled concurrently
+        self.assertLess(asyncio.get_running_loop().time() - start, 0.4)
+
+    async def test_lanes_slot_usage(self):
+        # A burst from one chat must not occupy all scheduler slots while waiting for its turn
+        self.api.set_scheduler(api.EventScheduler(max_concurrency=2))
+        handled = {}
+
+        async def event_func(msg: api.ChatMessage):
+            await asyncio.sleep(0.05 if msg.text.startswith("a") else 0)
+            handled[msg.text] = asyncio.get_running_loop().time()
+
+        self.dispatcher.set_lane_key(api.APIEvents.Message, lambda msg: msg.chat.id)
+        self.dispatcher.register(api.APIEvents.Message, event_func)
+
+        chat1 = self.api.create_chat()
+        chat2 = self.api.create_chat()
+        user = await self.api.get_user()
+
+        start = asyncio.get_running_loop().time()
+        for i in range(10):
+            self.api._trigger(api.APIEvents.Message, self.api.create_message(user, f"a{i}", chat1))
+        self.api._trigger(api.APIEvents.Message, self.api.create_message(user, "b", chat2))
+
+        await self.api.scheduler.join()
+        self.assertEqual(len(handled), 11)
+        self.assertEqual(sorted((i for i in handled if i.startswith("a")), key=handled.get), [ f"a{i}" for i in range(10) ])
+        self.assertLess(handled["b"] - start, 0.05)
+        self.assertGreater(handled["a9"] - start, 0.45)
+
+    async def test_lanes_worker_cap(self):
+        lanes = ExecutionLanes(max_workers=1)
+        running = []
+        max_running = 0
+
+        async def job():
+            nonlocal max_running
+            running.append(None)
+            max_running = max(max_running, len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+        await asyncio.gather(*( lanes.run(i % 3, job()) for i in range(9) ))
+        self.assertEqual(max_running, 1)
+        self.assertEqual(len(lanes), 0)
+
+    async def test_lanes_overflow(self):
+        order = []
+
+        async def job(value):
+            await asyncio.sleep(0.01)
+            order.append(value)
+
+        # The first job runs, 2 are queued, the rest is dropped
+        lanes = ExecutionLanes(max_queue_size=2, overflow_policy=api.OverflowPolicy.DropNewest)
+        await asyncio.gather(*( lanes.run(0, job(i)) for i in range(5) ))
+        self.assertEqual(order, [ 0, 1, 2 ])
+        self.assertEqual(lanes.dropped, 2)
+
+        order.clear()
+        lanes = ExecutionLanes(max_queue_size=2, overflow_policy=api.OverflowPolicy.DropOldest)
+        await asyncio.gather(*( lanes.run(0, job(i)) for i in range(5) ))
+        self.assertEqual(order, [ 0, 3, 4 ])
+        self.assertEqual(lanes.dropped, 2)
+
+        # Blocked callers wait for room and keep their order
+        order.clear()
+        lanes = ExecutionLanes(max_queue_size=2, overflow_policy=api.OverflowPolicy.Block)
+        tasks = [ asyncio.create_task(lanes.run(0, job(i))) for i in range(6) ]
+        await asyncio.sleep(0)
+        self.assertEqual(lanes.queue_depth, 2)
+        self.assertEqual(sum(i.done() for i in tasks), 2)
+        await asyncio.gather(*tasks)
+        self.assertEqual(order, list(range(6)))
+        self.assertEqual(lanes.dropped, 0)
+
+    async def test_lanes_cancel(self):
+        lanes = ExecutionLanes(max_queue_size=1)
+        started = []
+
+        async def job(value):
+            started.append(value)
+            await asyncio.sleep(1)
+
+        tasks = [ asyncio.create_task(lanes.run(0, job(i))) for i in range(3) ]
+        await asyncio.sleep(0)
+        with self.assertLogs(level="WARNING") as logs:
+            tasks[0].cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.assertEqual(started, [ 0 ])
+        self.assertEqual(lanes.dropped, 2)
+        self.assertEqual(len(lanes), 0)
+        self.assertIn("discarded 2 queued events", logs.output[0])
+
+    async def test_stats(self):
+        async def slow_func(_msg):
+            await asyncio.sleep(0.05)
+
+        async def failing_func(_msg):
+            raise ValueError
+
+        self.dispatcher = APIEventDispatcher(self.api, lambda _ev, _e: True)
+        self.dispatcher.register(api.APIEvents.Message, slow_func, label="slowplugin")
+        self.assertFalse(self.dispatcher.stats_enabled)
+        self.dispatcher.enable_stats(slow_threshold=0.01)
+        self.assertTrue(self.dispatcher.stats_enabled)
+        self.dispatcher.register(api.APIEvents.Message, failing_func, label="failingplugin")
+
+        self.api.trigger_receive("foobar")
+        self.api.trigger_receive("foobar")
+        await self.api.scheduler.join()
+
+        stats = self.dispatcher.get_stats()
+        slow = stats[(api.APIEvents.Message, "slowplugin")]
+        self.assertEqual(slow.calls, 2)
+        self.assertEqual(slow.exceptions, 0)
+        self.assertGreaterEqual(slow.p50, 0.05)
+        self.assertGreaterEqual(slow.p99, slow.p50)
+
+        failing = stats[(api.APIEvents.Message, "failingplugin")]
+        self.assertEqual(failing.calls, 2)
+        self.assertEqual(failing.exceptions, 2)
+
+        self.dispatcher.enable_stats(False)
+        self.assertFalse(self.dispatcher.stats_enabled)
+        self.assertEqual(self.dispatcher.get_stats(), {})
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+import unittest
+from context import util
+from chatbot.util import eval_pool
+
+SLOW_EXPR = "comb(10000000, 5000000)"
+
+
+class Test(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.pool = util.EvalPool(workers=2, timeout=0.5, cache_size=2)
+        self.pool.start()
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+
+    async def test_evaluate(self):
+        self.assertEqual(await self.pool.evaluate("1 + 2 * 3"), "7")
+        self.assertEqual(await self.pool.evaluate("floor(pi)"), "3")
+        self.assertTrue((await self.pool.evaluate("1 / 0")).startswith("Error: "))
+
+        # No builtins
+        self.assertTrue((await self.pool.evaluate("open")).startswith("Error: "))
+        self.assertEqual(self.pool.evaluations, 4)
+
+    async def test_cache(self):
+        await self.pool.evaluate("1 + 1")
+        await self.pool.evaluate("1 + 1")
+        self.assertEqual((self.pool.evaluations, self.pool.cache_hits), (1, 1))
+
+        # Least recently used entries are evicted
+        await self.pool.evaluate("2 + 2")
+        await self.pool.evaluate("1 + 1")
+        await self.pool.evaluate("3 + 3")
+        await self.pool.evaluate("2 + 2")
+        self.assertEqual((self.pool.evaluations, self.pool.cache_hits), (4, 2))
+
+    async def test_concurrent(self):
+        results = await asyncio.gather(*[ self.pool.evaluate(f"{i} * 2") for i in range(10) ])
+        self.assertEqual(results, [ str(i * 2) for i in range(10) ])
+
+        # Workers are reused
+        self.assertEqual(self.pool.restarts, 0)
+
+    async def test_timeout(self):
+        pids = { i.process.pid for i in self.pool._workers }
+        start = time.monotonic()
+        results = await asyncio.gather(self.pool.evaluate(SLOW_EXPR), self.pool.evaluate("1 + 1"))
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(results, [ eval_pool.TIMEOUT_RESULT, "2" ])
+        self.assertEqual((self.pool.timeouts, self.pool.restarts), (1, 1))
+
+        # The slow worker was replaced
+        self.assertEqual(len(self.pool._workers), 2)
+        self.assertEqual(len(pids & { i.process.pid for i in self.pool._workers }), 1)
+        self.assertEqual(await self.pool.evaluate("2 + 2"), "4")
+
+        # Timeouts are not remembered, they may be caused by load
+        self.assertEqual(await self.pool.evaluate(SLOW_EXPR), eval_pool.TIMEOUT_RESULT)
+        self.assertEqual(self.pool.timeouts, 2)
+
+    async def test_close(self):
+        task = asyncio.create_task(self.pool.evaluate(SLOW_EXPR))
+        await asyncio.sleep(0.1)
+        processes = [ i.process for i in self.pool._workers ]
+        await self.pool.close()
+
+        with self.assertRaises(RuntimeError):
+            await task
+        for i in processes:
+            self.assertFalse(i.is_alive())
+        self.assertEqual(len(self.pool._workers), 0)
+
+    async def test_close_wakes_waiters(self):
+        pool = util.EvalPool(workers=1, timeout=5)
+        pool.start()
+        busy = asyncio.create_task(pool.evaluate(SLOW_EXPR))
+        waiting = [ asyncio.create_task(pool.evaluate(f"{i} + 1")) for i in range(2) ]
+        await asyncio.sleep(0.1)
+        await pool.close()
+
+        for i in (busy, *waiting):
+            with self.assertRaises(RuntimeError):
+                await asyncio.wait_for(i, 1)
+
+        # Usable again after restarting
+        pool.start()
+        self.assertEqual(await pool.evaluate("1 + 1"), "2")
+        await pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
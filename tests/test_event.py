@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import asyncio
 from functools import partial
 import unittest
 from unittest.mock import AsyncMock
@@ -47,6 +48,107 @@ class Test(unittest.IsolatedAsyncioTestCase):
         for i in range(len(order) - 1):
             self.assertLess(order[i], order[i + 1])
 
+    async def test_register_during_trigger(self):
+        event_func = AsyncMock()
+
+        async def register_func():
+            self.ev.register(event_func)
+
+        self.ev.register(register_func)
+        await self.ev.trigger()
+        event_func.assert_not_called()
+
+        await self.ev.trigger()
+        event_func.assert_called_once()
+
+    async def test_unregister_during_trigger(self):
+        event_func = AsyncMock()
+        handle = None
+
+        async def unregister_func():
+            handle.unregister()
+
+        self.ev.register(unregister_func, util.event.EVENT_PRE)
+        handle = self.ev.register(event_func)
+        await self.ev.trigger()
+        event_func.assert_not_called()
+        self.assertEqual(len(self.ev), 1)
+
+    async def test_concurrent_trigger(self):
+        calls = []
+        release = asyncio.Event()
+
+        async def slow_func(value):
+            await release.wait()
+            calls.append(value)
+
+        async def event_func(value):
+            calls.append(value)
+
+        self.ev.register(slow_func, util.event.EVENT_PRE)
+        self.ev.register(event_func)
+
+        first = asyncio.create_task(self.ev.trigger("a"))
+        second = asyncio.create_task(self.ev.trigger("b"))
+        await asyncio.sleep(0)
+
+        # Registering while triggers are running must not affect them
+        late_func = AsyncMock()
+        self.ev.register(late_func)
+
+        release.set()
+        await asyncio.gather(first, second)
+        self.assertEqual(sorted(calls), [ "a", "a", "b", "b" ])
+        late_func.assert_not_called()
+
+    async def test_trigger_all_concurrent(self):
+        order = []
+
+        async def slow_func(value):
+            await asyncio.sleep(0.1)
+            order.append(value)
+
+        async def fast_func(value):
+            order.append(value)
+            return util.event.EVENT_HANDLED  # Should be ignored
+
+        self.ev.register(partial(slow_func, "pre"), util.event.EVENT_PRE)
+        self.ev.register(partial(slow_func, "slow"))
+        self.ev.register(partial(fast_func, "fast"))
+        self.ev.register(partial(fast_func, "post"), util.event.EVENT_POST)
+
+        await self.ev.trigger_all_concurrent()
+        self.assertEqual(order, [ "pre", "fast", "slow", "post" ])
+
+    async def test_trigger_all_concurrent_exceptions(self):
+        exceptions = []
+        event_func = AsyncMock()
+
+        async def stuck_func():
+            await asyncio.sleep(10)
+
+        async def failing_func():
+            raise ValueError
+
+        def handle_exception(e):
+            exceptions.append(type(e))
+            return True
+
+        self.ev.set_exception_handler(handle_exception)
+        self.ev.set_handler_timeout(0.1)
+        self.ev.register(stuck_func)
+        self.ev.register(failing_func)
+        self.ev.register(event_func)
+
+        await self.ev.trigger_all_concurrent()
+        event_func.assert_called_once()
+        self.assertEqual(sorted(map(str, exceptions)), sorted(map(str, [ asyncio.TimeoutError, ValueError ])))
+
+        # Without exception handler, the first exception should be re-raised
+        self.ev.set_exception_handler(None)
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.ev.trigger_all_concurrent()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+from context import api
+from chatbot.api import EventScheduler, OverflowPolicy
+
+
+class Test(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.order = []
+        self.release = asyncio.Event()
+
+    async def _job(self, value: int):
+        await self.release.wait()
+        self.order.append(value)
+
+    async def test_concurrency_limit(self):
+        scheduler = EventScheduler(max_concurrency=2)
+        for i in range(5):
+            self.assertTrue(scheduler.submit_nowait(self._job(i)))
+
+        await asyncio.sleep(0)
+        self.assertEqual(scheduler.running, 2)
+        self.assertEqual(scheduler.queue_depth, 3)
+
+        self.release.set()
+        await scheduler.join()
+        self.assertEqual(self.order, [ 0, 1, 2, 3, 4 ])
+
+        stats = scheduler.stats()
+        self.assertEqual(stats.submitted, 5)
+        self.assertEqual(stats.completed, 5)
+        self.assertEqual(stats.queue_depth, 0)
+        self.assertGreater(stats.wait_max, 0)
+
+    async def test_drop_newest(self):
+        scheduler = EventScheduler(1, 1, OverflowPolicy.DropNewest)
+        self.assertTrue(scheduler.submit_nowait(self._job(0)))
+        self.assertTrue(scheduler.submit_nowait(self._job(1)))
+        self.assertFalse(scheduler.submit_nowait(self._job(2)))
+
+        self.release.set()
+        await scheduler.join()
+        self.assertEqual(self.order, [ 0, 1 ])
+        self.assertEqual(scheduler.stats().dropped, 1)
+
+    async def test_drop_oldest(self):
+        scheduler = EventScheduler(1, 1, OverflowPolicy.DropOldest)
+        self.assertTrue(scheduler.submit_nowait(self._job(0)))
+        self.assertTrue(scheduler.submit_nowait(self._job(1)))
+        self.assertTrue(scheduler.submit_nowait(self._job(2)))
+
+        self.release.set()
+        await scheduler.join()
+        self.assertEqual(self.order, [ 0, 2 ])
+        self.assertEqual(scheduler.stats().dropped, 1)
+
+    async def test_block(self):
+        scheduler = EventScheduler(1, 1, OverflowPolicy.Block)
+        await scheduler.submit(self._job(0))
+        await scheduler.submit(self._job(1))
+
+        # Synchronous submissions can't wait and are discarded
+        self.assertFalse(scheduler.submit_nowait(self._job(2)))
+
+        producer = asyncio.create_task(scheduler.submit(self._job(3)))
+        await asyncio.sleep(0.1)
+        self.assertFalse(producer.done())
+
+        self.release.set()
+        self.assertTrue(await producer)
+        await scheduler.join()
+        self.assertEqual(self.order, [ 0, 1, 3 ])
+
+    async def test_block_cancelled_waiter(self):
+        scheduler = EventScheduler(1, 1, OverflowPolicy.Block)
+        release_second = asyncio.Event()
+
+        async def second_job():
+            await release_second.wait()
+            self.order.append(1)
+
+        await scheduler.submit(self._job(0))
+        await scheduler.submit(second_job())
+        first = asyncio.create_task(scheduler.submit(self._job(2)))
+        second = asyncio.create_task(scheduler.submit(self._job(3)))
+        await asyncio.sleep(0)
+
+        # Cancel the first producer after it was woken up, but before it could submit
+        wake_waiters = scheduler._wake_waiters
+
+        def wake_and_cancel():
+            wake_waiters()
+            first.cancel()
+
+        scheduler._wake_waiters = wake_and_cancel
+        self.release.set()
+
+        # There is room in the queue while the second job is running
+        self.assertTrue(await asyncio.wait_for(second, 1))
+        release_second.set()
+        await scheduler.join()
+        self.assertTrue(first.cancelled())
+        self.assertEqual(self.order, [ 0, 1, 3 ])
+
+    async def test_drop_logging(self):
+        scheduler = EventScheduler(1, 1, OverflowPolicy.DropNewest)
+        scheduler.submit_nowait(self._job(0))
+        scheduler.submit_nowait(self._job(1))
+
+        with self.assertLogs(level="WARNING") as logs:
+            for i in range(10):
+                scheduler.submit_nowait(self._job(i))
+        self.assertEqual(len(logs.output), 1)
+        self.assertEqual(scheduler.stats().dropped, 10)
+
+        self.release.set()
+        await scheduler.join()
+
+    async def test_shutdown(self):
+        scheduler = EventScheduler(max_concurrency=1)
+        scheduler.submit_nowait(self._job(0))
+        scheduler.submit_nowait(self._job(1))
+        await asyncio.sleep(0)
+
+        await scheduler.shutdown()
+        self.assertEqual(scheduler.running, 0)
+        self.assertEqual(scheduler.queue_depth, 0)
+        self.assertEqual(self.order, [])
+
+    async def test_api_trigger(self):
+        apiobj = api.create_api_object("test", { "interactive": False })
+        apiobj.set_scheduler(EventScheduler(max_concurrency=1))
+        received = []
+
+        async def on_message(msg: api.ChatMessage):
+            received.append(msg.text)
+
+        apiobj.register_event_handler(api.APIEvents.Message, on_message)
+        apiobj.trigger_receive("foo")
+        await apiobj.trigger_receive_async("bar")
+        await apiobj.scheduler.join()
+        self.assertEqual(received, [ "foo", "bar" ])
+
+
+if __name__ == "__main__":
+    unittest.main()
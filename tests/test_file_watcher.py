@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import tempfile
+import unittest
+import json
+from context import bot
+from chatbot.util import config
+from chatbot.util.file_watcher import FileWatcher
+
+
+class TestInotify(unittest.IsolatedAsyncioTestCase):
+    use_inotify = True
+
+    async def asyncSetUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.changes = []
+        self.watcher = FileWatcher(self._tmpdir.name, self.changes.append, debounce=0.1,
+                                   poll_interval=0.02, use_inotify=self.use_inotify)
+        self.watcher.start()
+
+    async def asyncTearDown(self):
+        await self.watcher.stop()
+        self._tmpdir.cleanup()
+
+    def write(self, name, text):
+        with open(os.path.join(self._tmpdir.name, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    async def test_debounce(self):
+        for i in range(5):
+            self.write("foo.json", str(i))
+            await asyncio.sleep(0.03)
+        self.write("bar.json", "bar")
+        await asyncio.sleep(0.3)
+
+        self.assertEqual(sorted(self.changes), sorted([ os.path.join(self._tmpdir.name, "foo.json"),
+                                                        os.path.join(self._tmpdir.name, "bar.json") ]))
+
+    async def test_atomic_write(self):
+        path = os.path.join(self._tmpdir.name, "foo.json")
+        config.write_file_atomic(path, "{}")
+        await asyncio.sleep(0.3)
+        self.assertIn(path, self.changes)
+
+    async def test_stop(self):
+        self.write("foo.json", "foo")
+        await self.watcher.stop()
+        await asyncio.sleep(0.2)
+        self.assertEqual(self.changes, [])
+        self.assertEqual(self.watcher.backend, "")
+
+
+class TestPolling(TestInotify):
+    use_inotify = False
+
+    async def test_backend(self):
+        self.assertEqual(self.watcher.backend, "polling")
+
+
+class TestBotReload(unittest.IsolatedAsyncioTestCase):
+    async def test_reload_without_remount(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            profile = bot.BotProfileManager(tmpdir).load_or_create("test", "test")
+            apicfg = profile.get_api_config().load()
+            apicfg["interactive"] = False
+            apicfg.write()
+            botcfg = profile.get_bot_config().load()
+            botcfg["plugin_whitelist"] = [ "8ball" ]
+            botcfg["watch_plugin_configs_debounce"] = 0.05
+            botcfg["write_behind_delay"] = 0
+            botcfg.write_now()
+
+            b = bot.Bot(profile)
+            await b.init()
+            plugin = dict(b.iter_plugins())["8ball"]
+
+            await asyncio.sleep(0.1)  # Writing the initial config must not trigger a reload
+            with open(plugin.cfg.filename, "w", encoding="utf-8") as f:
+                json.dump({ "answers": [ "Foo" ] }, f)
+            await asyncio.sleep(0.3)
+
+            self.assertIs(dict(b.iter_plugins())["8ball"], plugin)
+            self.assertEqual(plugin.cfg["answers"], [ "Foo" ])
+
+            # Half-edited files are ignored until they are valid again
+            with open(plugin.cfg.filename, "w", encoding="utf-8") as f:
+                f.write('{ "answers": [ "Ba')
+            await asyncio.sleep(0.3)
+            self.assertEqual(plugin.cfg["answers"], [ "Foo" ])
+            self.assertTrue(plugin.cfg.is_modified_on_disk())
+
+            with open(plugin.cfg.filename, "w", encoding="utf-8") as f:
+                json.dump({ "answers": [ "Bar" ] }, f)
+            await asyncio.sleep(0.3)
+            self.assertEqual(plugin.cfg["answers"], [ "Bar" ])
+
+            runner = asyncio.create_task(b.run())
+            await asyncio.sleep(0)
+            await b.close()
+            await runner
+
+    async def test_reload_discards_pending_writes(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            profile = bot.BotProfileManager(tmpdir).load_or_create("test", "test")
+            apicfg = profile.get_api_config().load()
+            apicfg["interactive"] = False
+            apicfg.write()
+            botcfg = profile.get_bot_config().load()
+            botcfg["plugin_whitelist"] = [ "8ball" ]
+            botcfg["watch_plugin_configs_debounce"] = 0.05
+            botcfg["write_behind_delay"] = 60
+            botcfg.write_now()
+
+            b = bot.Bot(profile)
+            await b.init()
+            plugin = dict(b.iter_plugins())["8ball"]
+            plugin.cfg["answers"] = [ "Memory" ]
+            plugin.cfg.write()
+
+            with open(plugin.cfg.filename, "w", encoding="utf-8") as f:
+                json.dump({ "answers": [ "Disk" ] }, f)
+            await asyncio.sleep(0.3)
+            self.assertEqual(plugin.cfg["answers"], [ "Disk" ])
+
+            runner = asyncio.create_task(b.run())
+            await asyncio.sleep(0)
+            await b.close()
+            await runner
+
+            with open(plugin.cfg.filename, encoding="utf-8") as f:
+                self.assertEqual(json.load(f), { "answers": [ "Disk" ] })
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import tempfile
+import unittest
+from aiohttp import web
+import context  # pylint: disable=unused-import
+from chatbot.util import HTTPClient, HTTPCache
+from http_stub import StubServer
+
+
+class Test(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = StubServer()
+        await self.server.start()
+        self.cache = HTTPCache(max_entries=3)
+        self.client = HTTPClient(cache=self.cache)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.server.stop()
+
+    async def test_max_age(self):
+        self.server.add_route("/fresh", text="foo", headers={ "Cache-Control": "max-age=60" })
+        self.server.add_route("/nostore", text="foo", headers={ "Cache-Control": "no-store" })
+        self.server.add_route("/plain", text="foo")
+
+        for _ in range(3):
+            self.assertEqual(await self.client.get_str(self.server.url("/fresh")), "foo")
+            await self.client.get_str(self.server.url("/nostore"))
+            await self.client.get_str(self.server.url("/plain"))
+
+        self.assertEqual(self.server.hits["/fresh"], 1)
+        self.assertEqual(self.server.hits["/nostore"], 3)
+        self.assertEqual(self.server.hits["/plain"], 3)
+        self.assertEqual(self.cache.stats.hits, 2)
+        self.assertEqual(self.cache.stats.misses, 7)
+
+    async def test_ttl_override(self):
+        self.server.add_route("/plain", text="foo")
+        self.server.add_route("/fresh", text="foo", headers={ "Cache-Control": "max-age=60" })
+
+        await self.client.get_str(self.server.url("/plain"), ttl=60)
+        await self.client.get_str(self.server.url("/plain"), ttl=60)
+        self.assertEqual(self.server.hits["/plain"], 1)
+
+        await self.client.get_str(self.server.url("/fresh"))
+        await self.client.get_str(self.server.url("/fresh"), ttl=0)
+        self.assertEqual(self.server.hits["/fresh"], 2)
+
+        # Bypass the cache
+        await self.client.get_str(self.server.url("/plain"), use_cache=False)
+        self.assertEqual(self.server.hits["/plain"], 2)
+
+    async def test_request_arguments(self):
+        def echo(request):
+            text = request.query.get("q", "") + request.headers.get("Authorization", "")
+            return web.Response(text=text, headers={ "Cache-Control": "max-age=60" })
+
+        self.server.add_route("/echo", handler=echo)
+        url = self.server.url("/echo")
+
+        self.assertEqual(await self.client.get_str(url), "")
+        self.assertEqual(await self.client.get_str(url, params={ "q": "a" }), "a")
+        self.assertEqual(await self.client.get_str(url, params={ "q": "b" }), "b")
+        self.assertEqual(await self.client.get_str(url, headers={ "Authorization": "x" }), "x")
+        self.assertEqual(self.server.hits["/echo"], 4)
+
+        # Arguments that don't change the response still use the cache
+        self.assertEqual(await self.client.get_str(url, timeout=5), "")
+        self.assertEqual(self.server.hits["/echo"], 4)
+
+    async def test_etag(self):
+        def handler(request):
+            if request.headers.get("If-None-Match", None) == '"v1"':
+                return web.Response(status=304, headers={ "ETag": '"v1"' })
+            return web.Response(text="foo", headers={ "ETag": '"v1"', "Cache-Control": "no-cache" })
+
+        self.server.add_route("/etag", handler=handler)
+        for _ in range(3):
+            response = await self.client.get(self.server.url("/etag"))
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.text(), "foo")
+
+        self.assertEqual(self.server.hits["/etag"], 3)
+        self.assertEqual(self.cache.stats.revalidated, 2)
+        self.assertEqual(self.cache.stats.misses, 1)
+
+    async def test_last_modified(self):
+        modified = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+        def handler(request):
+            if request.headers.get("If-Modified-Since", None) == modified:
+                return web.Response(status=304)
+            return web.Response(text="foo", headers={ "Last-Modified": modified })
+
+        self.server.add_route("/modified", handler=handler)
+        await self.client.get_str(self.server.url("/modified"))
+        self.assertEqual(await self.client.get_str(self.server.url("/modified")), "foo")
+        self.assertEqual(self.cache.stats.revalidated, 1)
+
+    async def test_lru(self):
+        for i in range(4):
+            self.server.add_route(f"/{i}", text=str(i), headers={ "Cache-Control": "max-age=60" })
+
+        for i in (0, 1, 2, 0, 3):
+            await self.client.get_str(self.server.url(f"/{i}"))
+
+        # 1 was least recently used
+        self.assertEqual(len(self.cache), 3)
+        self.assertNotIn(self.server.url("/1"), self.cache)
+        self.assertIn(self.server.url("/0"), self.cache)
+        self.assertEqual(self.cache.stats.evictions, 1)
+
+    async def test_disk(self):
+        self.server.add_route("/fresh", text="foo", headers={ "Cache-Control": "max-age=60", "Content-Type": "text/plain" })
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.client.cache = HTTPCache(directory=tmpdir)
+            await self.client.get_str(self.server.url("/fresh"))
+
+            # A new cache, e.g. after a restart, reads the stored response
+            self.client.cache = HTTPCache(directory=tmpdir)
+            response = await self.client.get(self.server.url("/fresh"))
+            self.assertEqual(response.text(), "foo")
+            self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+            self.assertEqual(self.server.hits["/fresh"], 1)
+            self.assertEqual(self.client.cache.stats.hits, 1)
+
+            await self.client.cache.invalidate(self.server.url("/fresh"))
+            self.client.cache = HTTPCache(directory=tmpdir)
+            await self.client.get_str(self.server.url("/fresh"))
+            self.assertEqual(self.server.hits["/fresh"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+import aiohttp
+from aiohttp import web
+from context import util
+from chatbot.util import http_client
+from http_stub import StubServer
+
+
+class Test(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = StubServer()
+        await self.server.start()
+        self.client = http_client.HTTPClient(retry_delay=0.01)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.server.stop()
+        http_client.set_default_client(None)
+
+    async def test_get(self):
+        self.server.add_route("/text", text="foo")
+        self.server.add_route("/json", text='{ "a": [ 1, 2 ] }')
+
+        self.assertEqual(await self.client.get_str(self.server.url("/text")), "foo")
+        self.assertEqual(await self.client.get_json(self.server.url("/json")), { "a": [ 1, 2 ] })
+
+        response = await self.client.get(self.server.url("/missing"))
+        self.assertEqual(response.status, 404)
+        self.assertFalse(response.ok)
+
+    async def test_keepalive(self):
+        self.server.add_route("/foo", text="foo")
+        for _ in range(10):
+            await self.client.get_str(self.server.url("/foo"))
+        self.assertEqual(self.server.hits["/foo"], 10)
+        self.assertEqual(len(self.server.connections), 1)
+
+    async def test_connection_limit(self):
+        self.client = http_client.HTTPClient(limit_per_host=2)
+        self.server.add_route("/slow", text="foo", delay=0.05)
+        # Distinct URLs, identical ones would be coalesced
+        await asyncio.gather(*[ self.client.get_str(self.server.url(f"/slow?{i}")) for i in range(6) ])
+        self.assertEqual(len(self.server.connections), 2)
+
+    async def test_coalesce(self):
+        self.server.add_route("/slow", text="foo", delay=0.05)
+        results = await asyncio.gather(*[ self.client.get_str(self.server.url("/slow")) for _ in range(5) ])
+        self.assertEqual(results, [ "foo" ] * 5)
+        self.assertEqual(self.server.hits["/slow"], 1)
+        self.assertEqual(self.client.inflight.shared, 4)
+        self.assertEqual(len(self.client.inflight), 0)
+
+        # Sequential requests are not coalesced
+        await self.client.get_str(self.server.url("/slow"))
+        self.assertEqual(self.server.hits["/slow"], 2)
+
+        # Neither are requests with additional arguments
+        await asyncio.gather(*[ self.client.get_str(self.server.url("/slow"), timeout=5) for _ in range(2) ])
+        self.assertEqual(self.server.hits["/slow"], 4)
+
+    async def test_retry(self):
+        statuses = [ 503, 502, 200 ]
+        self.server.add_route("/flaky", handler=lambda _: web.Response(status=statuses.pop(0), text="ok"))
+
+        self.assertEqual(await self.client.get_str(self.server.url("/flaky")), "ok")
+        self.assertEqual(self.server.hits["/flaky"], 3)
+
+        # Give up after the last retry and return the error response
+        self.server.add_route("/down", status=503)
+        response = await self.client.get(self.server.url("/down"), retries=1)
+        self.assertEqual(response.status, 503)
+        self.assertEqual(self.server.hits["/down"], 2)
+
+    async def test_retry_unsafe(self):
+        self.server.add_route("/down", status=503)
+
+        # Non-idempotent methods are not retried by default
+        response = await self.client.request("POST", self.server.url("/down"))
+        self.assertEqual(response.status, 503)
+        self.assertEqual(self.server.hits["/down"], 1)
+
+        await self.client.request("post", self.server.url("/down"))
+        self.assertEqual(self.server.hits["/down"], 2)
+
+        # ...unless explicitly requested
+        await self.client.request("POST", self.server.url("/down"), retries=1)
+        self.assertEqual(self.server.hits["/down"], 4)
+
+        # Idempotent ones are
+        await self.client.request("PUT", self.server.url("/down"))
+        self.assertEqual(self.server.hits["/down"], 7)
+
+    async def test_timeout(self):
+        self.server.add_route("/slow", text="foo", delay=1)
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.client.get_str(self.server.url("/slow"), timeout=0.05, retries=1)
+        self.assertEqual(self.server.hits["/slow"], 2)
+
+    async def test_connection_error(self):
+        url = self.server.url("/foo")
+        await self.server.stop()
+        with self.assertRaises(aiohttp.ClientConnectionError):
+            await self.client.get_str(url, retries=0)
+
+    async def test_default_client(self):
+        self.server.add_route("/foo", text="foo")
+        http_client.set_default_client(self.client)
+        self.assertEqual(await util.async_http_get_str(self.server.url("/foo")), "foo")
+        self.assertEqual(self.client.requests, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
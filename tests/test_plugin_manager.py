@@ -2,7 +2,13 @@
 # -*- coding: utf-8 -*-
 
 from context import bot
+from chatbot import api
+import asyncio
 import logging
+import os
+import sys
+import tempfile
+import time
 import unittest
 
 
@@ -58,5 +64,228 @@ class Test(unittest.IsolatedAsyncioTestCase):
         self.assertIsNone(self.pm.get_plugin(name))
 
 
+PLUGIN_TEMPLATE = """
+import asyncio
+from chatbot.bot.subsystem.async_plugin import BasePlugin
+
+{manifest}
+
+class Plugin(BasePlugin):
+    dependencies = {deps!r}
+
+    def __init__(self, log):
+        super().__init__()
+        self.log = log
+
+    async def init(self, _old_instance):
+        self.log.append(("start", self.name))
+        await asyncio.sleep({delay})
+        if {fail}:
+            raise ValueError(self.name)
+        self.log.append(("done", self.name))
+
+    async def quit(self):
+        pass
+
+    def abort(self):
+        self.log.append(("abort", self.name))
+"""
+
+
+class TestParallelMount(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.pm = bot.subsystem.async_plugin.PluginManager(self._tmpdir.name, init_timeout=1)
+        self.log = []
+        self.errors = {}
+
+    async def asyncTearDown(self):
+        await self.pm.unmount_all(None)
+        self._tmpdir.cleanup()
+
+    def add_plugin(self, name, deps=(), delay=0.0, fail=False, manifest=None):
+        with open(os.path.join(self._tmpdir.name, name + ".py"), "w", encoding="utf-8") as f:
+            f.write(PLUGIN_TEMPLATE.format(deps=tuple(deps), delay=delay, fail=fail,
+                                           manifest=f"MANIFEST = {manifest!r}" if manifest else ""))
+
+    def handle_exception(self, name, e):
+        self.errors[name] = e
+        return True
+
+    async def test_concurrent(self):
+        for i in range(5):
+            self.add_plugin(f"slow{i}", delay=0.2)
+
+        start = time.perf_counter()
+        await self.pm.mount_all(self.handle_exception, self.log)
+        self.assertLess(time.perf_counter() - start, 0.6)
+        self.assertEqual(len(list(self.pm.iter_plugins())), 5)
+        self.assertEqual(self.errors, {})
+
+        timings = self.pm.get_mount_timings()
+        self.assertEqual(set(timings), { f"slow{i}" for i in range(5) })
+        self.assertGreaterEqual(timings["slow0"].init, 0.2)
+
+    async def test_dependencies(self):
+        self.add_plugin("a", deps=[ "b" ])
+        self.add_plugin("b", delay=0.1)
+        self.add_plugin("c", deps=[ "a", "b" ])
+
+        await self.pm.mount_all(self.handle_exception, self.log)
+        order = [ name for event, name in self.log if event == "done" ]
+        self.assertEqual(order, [ "b", "a", "c" ])
+        self.assertLess(self.log.index(("done", "b")), self.log.index(("start", "a")))
+
+    async def test_failed_dependency(self):
+        self.add_plugin("a", deps=[ "b" ])
+        self.add_plugin("b", fail=True)
+        self.add_plugin("c", deps=[ "missing" ])
+        self.add_plugin("d", deps=[ "e" ])
+        self.add_plugin("e", deps=[ "d" ])
+        self.add_plugin("f")
+
+        await self.pm.mount_all(self.handle_exception, self.log)
+        self.assertEqual([ name for name, _ in self.pm.iter_plugins() ], [ "f" ])
+        self.assertEqual(set(self.errors), { "a", "b", "c", "d", "e" })
+        self.assertIsInstance(self.errors["b"], ValueError)
+        self.assertIsInstance(self.errors["a"], ImportError)
+
+    async def test_timeout(self):
+        self.pm.init_timeout = 0.1
+        self.add_plugin("slow", delay=10)
+        self.add_plugin("fast")
+
+        await self.pm.mount_all(self.handle_exception, self.log)
+        self.assertTrue(self.pm.plugin_exists("fast"))
+        self.assertFalse(self.pm.plugin_exists("slow"))
+        self.assertIsInstance(self.errors["slow"], TimeoutError)
+        self.assertIn(("abort", "slow"), self.log)
+        self.assertNotIn(("abort", "fast"), self.log)
+
+    async def test_reraise(self):
+        self.add_plugin("a", fail=True)
+        self.add_plugin("b", delay=10)
+
+        with self.assertRaises(ValueError):
+            await self.pm.mount_all(None, self.log)
+
+        # Plugins still initializing are cancelled
+        await asyncio.sleep(0)
+        self.assertFalse(self.pm.plugin_exists("b"))
+        self.assertNotIn(("done", "b"), self.log)
+        self.assertIn(("abort", "a"), self.log)
+        self.assertIn(("abort", "b"), self.log)
+
+
+    async def test_lazy(self):
+        self.pm.lazy = True
+        self.add_plugin("lazy", delay=0.05, manifest={ "commands": [ "foo" ], "events": [ "Message" ] })
+        self.add_plugin("eager")
+
+        await self.pm.mount_all(self.handle_exception, self.log)
+        self.assertTrue(self.pm.plugin_exists("eager"))
+        self.assertFalse(self.pm.plugin_exists("lazy"))
+        self.assertTrue(self.pm.is_deferred("lazy"))
+        self.assertNotIn("lazy", sys.modules)
+
+        deferred = dict(self.pm.iter_deferred())
+        self.assertEqual(deferred["lazy"].commands, ("foo",))
+        self.assertEqual(deferred["lazy"].events, ("Message",))
+
+        # Concurrent first uses mount the plugin only once
+        plugins = await asyncio.gather(*[ self.pm.activate("lazy") for _ in range(3) ])
+        self.assertIsNotNone(plugins[0])
+        self.assertTrue(all(i is plugins[0] for i in plugins))
+        self.assertEqual(self.log.count(("start", "lazy")), 1)
+        self.assertFalse(self.pm.is_deferred("lazy"))
+        self.assertIs(await self.pm.activate("lazy"), plugins[0])
+        self.assertIsNone(await self.pm.activate("doesnotexist"))
+
+    async def test_lazy_failure(self):
+        self.pm.lazy = True
+        self.add_plugin("lazy", fail=True, manifest={ "commands": [ "foo" ] })
+
+        await self.pm.mount_all(self.handle_exception, self.log)
+        with self.assertRaises(ValueError):
+            await self.pm.activate("lazy")
+        self.assertFalse(self.pm.is_deferred("lazy"))
+        self.assertIsNone(await self.pm.activate("lazy"))
+
+    async def test_remount_cached(self):
+        self.add_plugin("foo")
+        await self.pm.mount_plugin("foo", self.log)
+        module = sys.modules["foo"]
+        self.assertFalse(self.pm.get_mount_timings()["foo"].cached)
+
+        # Unchanged modules are not executed again
+        await self.pm.mount_plugin("foo", self.log)
+        self.assertIs(sys.modules["foo"], module)
+        self.assertTrue(self.pm.get_mount_timings()["foo"].cached)
+        self.assertEqual(self.log.count(("done", "foo")), 2)
+
+        self.add_plugin("foo", delay=0.01)
+        await self.pm.mount_plugin("foo", self.log)
+        self.assertIsNot(sys.modules["foo"], module)
+        self.assertFalse(self.pm.get_mount_timings()["foo"].cached)
+
+    async def test_remount_package(self):
+        pkgdir = os.path.join(self._tmpdir.name, "pkg")
+        os.makedirs(pkgdir)
+        with open(os.path.join(pkgdir, "__init__.py"), "w", encoding="utf-8") as f:
+            f.write(PLUGIN_TEMPLATE.format(deps=(), delay=0, fail=False, manifest="from . import sub"))
+
+        def write_sub(value):
+            with open(os.path.join(pkgdir, "sub.py"), "w", encoding="utf-8") as f:
+                f.write(f"VALUE = {value}\n")
+
+        write_sub(1)
+        await self.pm.mount_plugin("pkg", self.log)
+        await self.pm.mount_plugin("pkg", self.log)
+        self.assertTrue(self.pm.get_mount_timings()["pkg"].cached)
+
+        # Changes in submodules cause the package to be executed again.
+        # The size differs, so a stale .pyc is not used if the mtime did not change.
+        write_sub(42)
+        await self.pm.mount_plugin("pkg", self.log)
+        self.assertFalse(self.pm.get_mount_timings()["pkg"].cached)
+        self.assertEqual(sys.modules["pkg"].sub.VALUE, 42)
+
+
+class TestLazyBot(unittest.IsolatedAsyncioTestCase):
+    async def test_lazy_command(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            profile = bot.BotProfileManager(tmpdir).load_or_create("test", "test")
+            apicfg = profile.get_api_config().load()
+            apicfg["interactive"] = False
+            apicfg.write()
+            botcfg = profile.get_bot_config().load()
+            botcfg["plugin_whitelist"] = [ "essentials", "botcontrol" ]
+            botcfg["plugin_lazy_loading"] = True
+            botcfg.write_now()
+
+            b = bot.Bot(profile)
+            await b.init()
+            self.assertEqual([ name for name, _ in b.iter_plugins() ], [ "botcontrol" ])
+            self.assertEqual(list(b.iter_deferred_plugins()), [ "essentials" ])
+
+            replies = []
+
+            async def on_sent(msg):
+                replies.append(msg.text)
+
+            b.register_event_handler(api.APIEvents.MessageSent, on_sent)
+            await b.api.trigger_receive_async("!lenny")
+            await b.api.trigger_receive_async("!lenny")
+            await b.api.scheduler.join()
+            self.assertEqual(len(replies), 2)
+            self.assertEqual(sorted(name for name, _ in b.iter_plugins()), [ "botcontrol", "essentials" ])
+            self.assertEqual(list(b.iter_deferred_plugins()), [])
+
+            runner = asyncio.create_task(b.run())
+            await asyncio.sleep(0)
+            await b.close()
+            await runner
+
+
 if __name__ == "__main__":
     unittest.main()
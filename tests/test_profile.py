@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+from context import bot
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.profile = bot.BotProfileManager(self._tmpdir.name).load_or_create("test", "test")
+
+    def tearDown(self):
+        self.profile.close()
+        self._tmpdir.cleanup()
+
+    def test_shared_config(self):
+        cfg = self.profile.get_plugin_config("foo")
+        self.assertIs(self.profile.get_plugin_config("foo"), cfg)
+        self.assertIsNot(self.profile.get_plugin_config("bar"), cfg)
+
+        cfg.reload({ "a": 1 }, create=True)
+        cfg["a"] = 2
+        self.profile.release_plugin_config("foo")
+        self.profile.release_plugin_config("foo")
+
+        # Unchanged files are not read again
+        cfg = self.profile.get_plugin_config("foo")
+        cfg.reload({ "a": 1 }, create=True)
+        self.assertEqual(cfg["a"], 2)
+
+    def test_config_modified_on_disk(self):
+        cfg = self.profile.get_plugin_config("foo")
+        cfg.reload({ "a": 1 }, create=True)
+        self.assertFalse(cfg.is_modified_on_disk())
+
+        # Ensure a different mtime on file systems with coarse timestamps
+        time.sleep(0.01)
+        with open(cfg.filename, "w") as f:
+            f.write('{ "a": 3 }')
+        stat = os.stat(cfg.filename)
+        os.utime(cfg.filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        self.assertTrue(cfg.is_modified_on_disk())
+        cfg.reload({ "a": 1 }, create=True)
+        self.assertEqual(cfg["a"], 3)
+
+    def test_shared_storage(self):
+        storage = self.profile.get_plugin_storage("foo")
+        self.assertIs(self.profile.get_plugin_storage("foo"), storage)
+
+        storage.set("a", 1, None, None)
+        self.profile.release_plugin_storage("foo")
+        self.assertFalse(os.path.exists(os.path.join(self.profile.get_path(), "storage", "foo.json")))
+
+        # Written when the last reference is released
+        self.profile.release_plugin_storage("foo")
+        self.assertTrue(os.path.exists(os.path.join(self.profile.get_path(), "storage", "foo.json")))
+        self.assertIs(self.profile.get_plugin_storage("foo"), storage)
+
+    def test_close(self):
+        storage = self.profile.get_plugin_storage("foo")
+        storage.set("a", 1, None, None)
+        self.profile.close()
+
+        storage = self.profile.get_plugin_storage("foo")
+        self.assertEqual(storage.get("a", None, None), 1)
+        self.profile.release_plugin_storage("foo")
+
+    def test_shutdown(self):
+        async def run():
+            self.profile.enable_write_behind(60)
+            storage = self.profile.get_plugin_storage("foo")
+            storage.set("a", 1, None, None)
+            self.profile.release_plugin_storage("foo")
+            await self.profile.shutdown()
+
+        # Deferred writes are flushed before the storages are closed
+        asyncio.run(run())
+        with open(os.path.join(self.profile.get_path(), "storage", "foo.json")) as f:
+            self.assertEqual(json.load(f), { "g--a": 1 })
+
+    def test_migrate_storages(self):
+        storage = self.profile.get_plugin_storage("foo")
+        storage.set("a", 1, None, None)
+        self.profile.release_plugin_storage("foo")
+
+        self.profile.set_storage_backend("sqlite")
+        asyncio.run(self.profile.migrate_storages())
+        self.assertTrue(os.path.exists(os.path.join(self.profile.get_path(), "storage", "foo.sqlite3")))
+
+        storage = self.profile.get_plugin_storage("foo")
+        self.assertEqual(storage.get("a", None, None), 1)
+        self.profile.release_plugin_storage("foo")
+
+
+if __name__ == "__main__":
+    unittest.main()
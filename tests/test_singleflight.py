@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+from context import util
+
+
+class Test(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.flight = util.SingleFlight()
+        self.started = 0
+
+    async def fetch(self, value, delay=0.02):
+        self.started += 1
+        await asyncio.sleep(delay)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    async def test_coalesce(self):
+        results = await asyncio.gather(*[ self.flight.do("a", self.fetch, [ 1 ]) for _ in range(5) ],
+                                       self.flight.do("b", self.fetch, [ 2 ]))
+        self.assertEqual(self.started, 2)
+        self.assertEqual(results[:5], [ [ 1 ] ] * 5)
+        self.assertIs(results[0], results[4])
+        self.assertEqual(results[5], [ 2 ])
+        self.assertEqual((self.flight.calls, self.flight.shared), (2, 4))
+        self.assertEqual(len(self.flight), 0)
+
+        # Completed calls are not cached
+        await self.flight.do("a", self.fetch, 1)
+        self.assertEqual(self.started, 3)
+
+    async def test_exception(self):
+        results = await asyncio.gather(*[ self.flight.do("a", self.fetch, ValueError("foo")) for _ in range(3) ],
+                                       return_exceptions=True)
+        self.assertEqual(self.started, 1)
+        for i in results:
+            self.assertIsInstance(i, ValueError)
+        self.assertNotIn("a", self.flight)
+
+    async def test_cancel(self):
+        first = asyncio.create_task(self.flight.do("a", self.fetch, 1, 0.05))
+        second = asyncio.create_task(self.flight.do("a", self.fetch, 1, 0.05))
+        await asyncio.sleep(0.01)
+        self.assertIn("a", self.flight)
+
+        # The remaining caller still gets the result
+        first.cancel()
+        self.assertEqual(await second, 1)
+        self.assertTrue(first.cancelled())
+        self.assertEqual(self.started, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,10 @@
 # -*- coding: utf-8 -*-
 
 from typing import Any
+import asyncio
+import json
 import os
+import tempfile
 from context import util
 import unittest
 
@@ -89,6 +92,23 @@ class TestStorage(unittest.TestCase):
         # This should simply do nothing
         self.storage.erase("non_existing_key", USER_ID, CHAT_ID)
 
+    def test_get_many(self):
+        self.storage.set("a", VALUE_USER_CHAT, USER_ID, CHAT_ID)
+        self.storage.set("b", VALUE_USER, USER_ID, None)
+        self.storage.set("c", VALUE_GLOBAL, None, None)
+        scope = self.storage.scope(USER_ID, CHAT_ID)
+
+        self.assertEqual(scope.get_many([ "a", "b", "c" ]), { "a": VALUE_USER_CHAT, "b": None, "c": None })
+        self.assertEqual(scope.get_many([ "a", "b", "c", "d" ], fallback=True),
+                         { "a": VALUE_USER_CHAT, "b": VALUE_USER, "c": VALUE_GLOBAL, "d": None })
+
+    def test_fallback_after_change(self):
+        self._test_fallback(USER_ID, CHAT_ID, None)
+        self.storage.scope(None, CHAT_ID).set("test", VALUE_CHAT)
+        self._test_fallback(USER_ID, CHAT_ID, VALUE_CHAT)
+        self.storage.scope(None, CHAT_ID).erase("test")
+        self._test_fallback(USER_ID, CHAT_ID, None)
+
     def test_write(self):
         scope = self.storage.scope(USER_ID, CHAT_ID)
         scope.set("test", VALUE_USER_CHAT)
@@ -97,5 +117,192 @@ class TestStorage(unittest.TestCase):
         self.assertEqual(scope.get("test"), VALUE_USER_CHAT)
 
 
+
+class TestJournalStorage(TestStorage):
+    def setUp(self):
+        self.tearDown()
+        self.backend = util.JournalBackend(TEST_STORAGE_FILE, compact_threshold=10)
+        self.storage = util.Storage(self.backend)
+
+    def tearDown(self):
+        super().tearDown()
+        if os.path.isfile(TEST_STORAGE_FILE + util.JournalBackend.JOURNAL_SUFFIX):
+            os.remove(TEST_STORAGE_FILE + util.JournalBackend.JOURNAL_SUFFIX)
+
+    def _reload(self) -> util.Storage:
+        storage = util.Storage(util.JournalBackend(TEST_STORAGE_FILE))
+        storage.load()
+        return storage
+
+    def test_replay(self):
+        self.storage.set("a", 1, USER_ID, None)
+        self.storage.set("b", [ 1, 2 ], None, CHAT_ID)
+        self.storage.write()
+        self.storage.erase("a", USER_ID, None)
+        self.storage.set("b", [ 3 ], None, CHAT_ID)
+        self.storage.write()
+
+        self.assertFalse(os.path.exists(TEST_STORAGE_FILE))
+        self.assertEqual(self.backend.journal_size, 4)
+
+        storage = self._reload()
+        self.assertIsNone(storage.get("a", USER_ID, None))
+        self.assertEqual(storage.get("b", None, CHAT_ID), [ 3 ])
+
+    def test_compaction(self):
+        for i in range(25):
+            self.storage.set("key", i, None, None)
+            self.storage.set(f"key{i}", i, None, None)
+            self.storage.write()
+
+        self.assertTrue(os.path.exists(TEST_STORAGE_FILE))
+        self.assertLessEqual(self.backend.journal_size, 10)
+
+        storage = self._reload()
+        self.assertEqual(storage.get("key", None, None), 24)
+        for i in range(25):
+            self.assertEqual(storage.get(f"key{i}", None, None), i)
+
+        # Snapshot is compatible to json storage after compaction
+        self.backend.compact()
+        self.assertFalse(os.path.exists(TEST_STORAGE_FILE + util.JournalBackend.JOURNAL_SUFFIX))
+        storage = util.Storage(util.config.Config(TEST_STORAGE_FILE))
+        storage.load()
+        self.assertEqual(storage.get("key", None, None), 24)
+
+    def test_broken_record(self):
+        self.storage.set("a", 1, None, None)
+        self.storage.write()
+
+        # Simulate a crash while writing
+        with open(TEST_STORAGE_FILE + util.JournalBackend.JOURNAL_SUFFIX, "a") as f:
+            f.write('{"op": "set", "ke')
+
+        storage = self._reload()
+        self.assertEqual(storage.get("a", None, None), 1)
+        storage.set("b", 2, None, None)
+        storage.write()
+        self.assertEqual(self._reload().get("b", None, None), 2)
+
+    def test_load_existing_json(self):
+        storage = util.Storage(util.config.Config(TEST_STORAGE_FILE))
+        storage.set("a", 1, USER_ID, CHAT_ID)
+        storage.write()
+        self.assertEqual(self._reload().get("a", USER_ID, CHAT_ID), 1)
+
+
+
+class TestSQLiteStorage(TestStorage):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.dbfile = os.path.join(self._tmpdir.name, "storage.sqlite3")
+        self.storage = util.SQLiteStorage(self.dbfile)
+
+    def tearDown(self):
+        self.storage.close()
+        self._tmpdir.cleanup()
+
+    def test_persistence(self):
+        self.storage.set("a", { "x": 1 }, USER_ID, CHAT_ID)
+        self.storage.set("b", None, None, None)
+        self.storage.write()
+        self.storage.set("c", 3, None, None)
+        self.storage.close()
+
+        self.storage = util.SQLiteStorage(self.dbfile)
+        self.assertEqual(self.storage.get("a", USER_ID, CHAT_ID), { "x": 1 })
+        self.assertEqual(self.storage.get("c", None, None), 3)
+        self.storage.set("c", 4, None, None)
+        self.storage.load()  # Discards unwritten changes
+        self.assertEqual(self.storage.get("c", None, None), 3)
+
+    def test_single_query_fallback(self):
+        queries = []
+        fetch_rows = self.storage._fetch_rows
+
+        def counting_fetch_rows(rowkeys):
+            queries.append(len(rowkeys))
+            return fetch_rows(rowkeys)
+
+        self.storage._fetch_rows = counting_fetch_rows
+        self.storage.set("test", VALUE_GLOBAL, None, None)
+        self.storage.write()
+
+        self._test_fallback(USER_ID, CHAT_ID, VALUE_GLOBAL)
+        self.assertEqual(queries, [ 4 ])
+
+        # Absent keys are cached, only the existing global key is queried
+        self._test_fallback(USER_ID, CHAT_ID, VALUE_GLOBAL)
+        self.assertEqual(queries, [ 4, 1 ])
+
+        self.storage.scope(USER_ID, None).get_many([ "foo", "bar" ], fallback=True)
+        self.assertEqual(queries, [ 4, 1, 4 ])
+
+        # Setting a key invalidates the cache
+        self.storage.set("test", VALUE_USER, USER_ID, None)
+        self.storage.write()
+        self._test_fallback(USER_ID, CHAT_ID, VALUE_USER)
+        self.assertEqual(queries, [ 4, 1, 4, 2 ])
+
+        self.storage.load()
+        self._test_fallback(USER_ID, CHAT_ID, VALUE_USER)
+        self.assertEqual(queries[-1], 4)
+
+    def test_scope_bulk_operations(self):
+        for i in range(5):
+            self.storage.set(f"key{i}", i, USER_ID, CHAT_ID)
+        self.storage.set("user", 1, USER_ID, None)
+        self.storage.set("other", 2, "otheruser", CHAT_ID)
+        self.storage.write()
+        self.storage.erase("key0", USER_ID, CHAT_ID)
+
+        scope = self.storage.scope(USER_ID, CHAT_ID)
+        self.assertEqual(dict(scope.items()), { f"key{i}": i for i in range(1, 5) })
+
+        self.assertEqual(asyncio.run(scope.clear()), 4)
+        self.assertEqual(list(scope.items()), [])
+        self.assertEqual(self.storage.get("user", USER_ID, None), 1)
+
+        self.storage.set("key", 1, USER_ID, "otherchat")
+        self.assertEqual(asyncio.run(self.storage.erase_user_data(USER_ID)), 2)
+        self.assertIsNone(self.storage.get("user", USER_ID, None))
+        self.assertEqual(asyncio.run(self.storage.erase_chat_data(CHAT_ID)), 1)
+        self.assertIsNone(self.storage.get("other", "otheruser", CHAT_ID))
+
+    def test_migrate_from_json(self):
+        jsonfile = os.path.join(self._tmpdir.name, "storage.json")
+        storage = util.Storage(util.config.Config(jsonfile))
+        storage.set("a-b", 1, USER_ID, CHAT_ID)
+        storage.set("b", 2, "123", "-100456")
+        storage.set("c", 3, USER_ID, None)
+        storage.set("d", 4, None, CHAT_ID)
+        storage.set("e", 5, None, None)
+        storage.write()
+
+        with open(jsonfile) as f:
+            data = json.load(f)
+        data["unknown format"] = 6
+        with open(jsonfile, "w") as f:
+            json.dump(data, f)
+
+        skipped = asyncio.run(self.storage.migrate_from_json(jsonfile))
+        self.assertEqual(skipped, [ "unknown format" ])
+        self.assertEqual(self.storage.get("a-b", USER_ID, CHAT_ID), 1)
+        self.assertEqual(self.storage.get("b", "123", "-100456"), 2)
+        self.assertEqual(self.storage.get("c", USER_ID, None), 3)
+        self.assertEqual(self.storage.get("d", None, CHAT_ID), 4)
+        self.assertEqual(self.storage.get("e", None, None), 5)
+
+        # Creating a new database is retried if it failed before
+        dbfile = os.path.join(self._tmpdir.name, "migrated.sqlite3")
+        with open(dbfile + ".tmp", "w") as f:
+            f.write("incomplete")
+        self.assertEqual(util.migrate_json_file(jsonfile, dbfile), [ "unknown format" ])
+        self.assertFalse(os.path.exists(dbfile + ".tmp"))
+        migrated = util.SQLiteStorage(dbfile)
+        self.assertEqual(migrated.get("a-b", USER_ID, CHAT_ID), 1)
+        migrated.close()
+
+
 if __name__ == '__main__':
     unittest.main()
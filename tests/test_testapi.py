@@ -39,6 +39,23 @@ class Test(unittest.IsolatedAsyncioTestCase):
         apiobj.unregister_event_handler(api.APIEvents.Message)
         apiobj.unregister_event_handler(api.APIEvents.MessageSent)
 
+    async def test_custom_author(self):
+        apiobj = create_test_api({ "interactive": False })
+        chat = apiobj.create_chat()
+        user = apiobj.create_user("someone", chat=chat)
+        received = []
+
+        async def on_message(msg: api.ChatMessage):
+            received.append((msg.author.id, msg.chat.id))
+
+        apiobj.register_event_handler(api.APIEvents.Message, on_message)
+        apiobj.trigger_receive("foo", author=user, chat=chat)
+        await apiobj.trigger_receive_async("bar")
+        await apiobj.scheduler.join()
+        self.assertEqual(received[0], ("someone", chat.id))
+        self.assertEqual(received[1][0], "testfriend")
+        self.assertNotEqual(received[1][1], chat.id)
+
 
 if __name__ == "__main__":
     unittest.main()
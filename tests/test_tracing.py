@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+from context import create_test_api
+from chatbot import api
+from chatbot.util import tracing
+from chatbot.bot.subsystem import APIEventDispatcher, command
+
+
+class Test(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.api = create_test_api({ "interactive": False })
+        self.api.set_scheduler(api.EventScheduler(max_concurrency=1))
+        self.dispatcher = APIEventDispatcher(self.api)
+        self.dispatcher.set_lane_key(api.APIEvents.Message, lambda msg: msg.chat.id)
+        self.cmd = command.CommandHandler(prefix=[ "!" ])
+        self.dispatcher.register(api.APIEvents.Message, self.cmd.execute, label="commands")
+
+        async def say(msg, text):
+            await asyncio.sleep(0.01)
+            await msg.reply(text)
+
+        self.cmd.register("say", say, 1, command.CommandFlag.Expand)
+
+    def tearDown(self):
+        tracing.configure()
+
+    async def test_disabled(self):
+        tracing.configure(sample_rate=0.0)
+        self.assertIs(tracing.span("foo"), tracing.span("bar"))
+        self.api.trigger_receive("!say foo")
+        await self.api.scheduler.join()
+        self.assertEqual(tracing.get_tracer().traces, [])
+
+    async def test_span_tree(self):
+        tracer = tracing.configure(sample_rate=1.0)
+        finished = []
+        tracer.add_callback(finished.append)
+
+        # The second message is queued by the scheduler
+        self.api.trigger_receive("!say foo")
+        self.api.trigger_receive("!say bar")
+        await self.api.scheduler.join()
+
+        self.assertEqual(len(finished), 2)
+        self.assertEqual(tracer.traces, finished)
+
+        for trace in finished:
+            self.assertTrue(trace.finished)
+            self.assertEqual(trace.name, api.APIEvents.Message)
+            dispatch = trace.find("dispatch " + api.APIEvents.Message)
+            handler = trace.find("commands")
+            cmd = trace.find("command say")
+            match = trace.find("command_match")
+            send = trace.find("send_message")
+            self.assertIsNotNone(trace.find("received"))
+            self.assertIsNotNone(dispatch)
+            self.assertIn(handler, dispatch.children)
+            self.assertIn(cmd, handler.children)
+            self.assertIn(match, handler.children)
+            self.assertLessEqual(match.start, cmd.start)
+            self.assertIn(send, cmd.children)
+            self.assertGreaterEqual(cmd.duration, 0.01)
+            self.assertLessEqual(send.end, trace.root.end)
+            self.assertIn("send_message", trace.format())
+
+        # Queueing delay is visible as the time between receiving and dispatching
+        first = finished[0].find("dispatch " + api.APIEvents.Message)
+        second = finished[1].find("dispatch " + api.APIEvents.Message)
+        self.assertGreater(second.start - finished[1].root.start, first.start - finished[0].root.start)
+
+    async def test_unrelated_events(self):
+        tracer = tracing.configure(sample_rate=1.0)
+        self.dispatcher.register(api.APIEvents.MessageSent, self.cmd.execute, label="sent")
+
+        self.api.trigger_receive("!say foo")
+        await self.api.scheduler.join()
+
+        # The MessageSent event caused by the reply must not finish the trace early
+        self.assertEqual(len(tracer.traces), 1)
+        self.assertIsNotNone(tracer.traces[0].find("command say"))
+
+    async def test_rejected_command(self):
+        tracer = tracing.configure(sample_rate=1.0)
+
+        # Missing argument -> rejected before the handler runs
+        self.api.trigger_receive("!say")
+        await self.api.scheduler.join()
+
+        self.assertEqual(len(tracer.traces), 1)
+        self.assertIsNone(tracer.traces[0].find("command_match"))
+        self.assertIsNone(tracer.traces[0].find("command say"))
+
+    async def test_sampling(self):
+        tracer = tracing.configure(sample_rate=0.5, max_traces=10)
+        finished = []
+        tracer.add_callback(finished.append)
+
+        for _ in range(200):
+            self.api.trigger_receive("no command")
+        await self.api.scheduler.join()
+
+        self.assertGreater(len(finished), 20)
+        self.assertLess(len(finished), 180)
+        self.assertEqual(len(tracer.traces), 10)
+
+    async def test_mark(self):
+        tracing.mark("nothing")  # No trace -> no-op
+
+        tracer = tracing.configure(sample_rate=1.0)
+        with tracing.start_trace("foo") as trace:
+            tracing.mark("bar")
+            with tracing.span("baz") as span:
+                tracing.mark("qux")
+            tracing.finish_trace("foo")
+            tracing.mark("ignored")
+
+        self.assertEqual(tracer.traces, [ trace ])
+        self.assertEqual([ i.name for i in trace.root.children ], [ "received", "bar", "baz" ])
+        self.assertEqual([ i.name for i in span.children ], [ "qux" ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+import unittest
+from context import util
+from chatbot.util import worker_pool
+
+
+class Test(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        worker_pool.set_default_pools(None)
+
+    async def test_reuse_threads(self):
+        pool = util.WorkerPool("test-worker", 2)
+        names = set()
+        for _ in range(10):
+            names.add(await pool.run(lambda: threading.current_thread().name))
+
+        stats = pool.get_stats()
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names.pop().startswith("test-worker"))
+        self.assertEqual((stats.threads, stats.completed, stats.active, stats.queued), (1, 10, 0, 0))
+        self.assertTrue(await pool.shutdown())
+
+        # Restarted on next use
+        self.assertEqual(await pool.run(sum, [ 1, 2 ]), 3)
+        await pool.shutdown()
+
+    async def test_metrics(self):
+        pool = util.WorkerPool("test-worker", 2)
+        event = threading.Event()
+        tasks = [ asyncio.create_task(pool.run(event.wait, 5)) for _ in range(5) ]
+        await asyncio.sleep(0.05)
+
+        stats = pool.get_stats()
+        self.assertEqual((stats.active, stats.queued, stats.completed), (2, 3, 0))
+        self.assertEqual(stats.utilization, 1.0)
+
+        event.set()
+        await asyncio.gather(*tasks)
+        stats = pool.get_stats()
+        self.assertEqual((stats.active, stats.queued, stats.completed), (0, 0, 5))
+        self.assertEqual(stats.utilization, 0.0)
+        await pool.shutdown()
+
+    async def test_exception(self):
+        pool = util.WorkerPool("test-worker", 1)
+        with self.assertRaises(ZeroDivisionError):
+            await pool.run(lambda: 1 / 0)
+        self.assertEqual(pool.get_stats().completed, 1)
+        await pool.shutdown()
+
+    async def test_shutdown(self):
+        pool = util.WorkerPool("test-worker", 1)
+        event = threading.Event()
+        running = asyncio.create_task(pool.run(event.wait, 5))
+        queued = asyncio.create_task(pool.run(event.wait, 5))
+        await asyncio.sleep(0.05)
+
+        # Queued tasks are cancelled, running ones can't be interrupted
+        self.assertFalse(await pool.shutdown(timeout=0.05))
+        await asyncio.sleep(0)
+        self.assertTrue(queued.done())
+        self.assertEqual(pool.get_stats().queued, 0)
+
+        event.set()
+        self.assertTrue(await running)
+
+    async def test_default_pools(self):
+        pools = util.WorkerPools(io_workers=2, cpu_workers=1)
+        worker_pool.set_default_pools(pools)
+        self.assertEqual(await util.run_in_thread(lambda: threading.current_thread().name[:9]), "io-worker")
+        self.assertEqual(await util.run_cpu_bound(lambda: threading.current_thread().name[:10]), "cpu-worker")
+        self.assertEqual(pools.io.get_stats().completed, 1)
+        self.assertEqual(pools.cpu.get_stats().completed, 1)
+        self.assertTrue(await pools.shutdown(timeout=1))
+
+
+if __name__ == "__main__":
+    unittest.main()